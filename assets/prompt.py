@@ -39,6 +39,17 @@ Provide a comprehensive assessment in the following JSON format:
 Ensure your assessment is fair, constructive, and specific to help the student improve.
 """
 
+# Prompt for merging summaries of consecutive parts of a very long document
+GROUP_SUMMARY_PROMPT = """
+You are an expert academic assessor. Below are summaries of consecutive parts of a student assignment.
+
+{summaries}
+
+{requirements_context}
+
+Merge them into a single, shorter summary of this part of the assignment. Keep the key points, strengths, and weaknesses, and drop repetition.
+"""
+
 # Prompt for creating final assessment from combined summaries
 FINAL_ASSESSMENT_PROMPT = """
 You are an expert academic assessor. Below are summaries from different parts of a student assignment.
@@ -97,4 +108,11 @@ Provide a comprehensive assessment in the following JSON format:
 ```
 
 Ensure your assessment is fair, constructive, and specific to help the student improve.
-"""
\ No newline at end of file
+"""
+
+# Prompt for transcribing scanned pages of an otherwise text-based document via Gemini File API
+PAGE_TRANSCRIPTION_PROMPT = """
+The attached PDF holds pages {pages} of a student assignment, which are scanned images without a text layer.
+
+Transcribe their content as markdown, in reading order. Keep headings, lists and tables; describe figures and diagrams briefly in square brackets. Do not summarize, correct or assess the work; return only the transcription.
+"""
@@ -0,0 +1,275 @@
+"""Pluggable model backends.
+
+GeminiProcessor talks to its client through the subset of the google-genai
+``Client`` surface listed below, so any object providing it can stand in for
+Gemini:
+
+- ``models.generate_content(model, contents, config)`` and
+  ``models.generate_content_stream(...)``
+- ``aio.models.generate_content(...)``
+- ``files.upload(file)``, ``files.delete(name)`` and ``aio.files.upload(file)``
+- ``caches.create(model, config)``
+
+Backends are registered by name and selected with ``MODEL_BACKEND``. Besides
+the real Gemini client there is a deterministic local fake with configurable
+latency, token throughput, failure rate and canned feedback, so the app and
+the benchmarks run without an API key or network access. Latency can be set
+per model, and models can be made to answer with quota exhaustion, to
+exercise routing across model tiers.
+"""
+
+import asyncio
+import copy
+import datetime
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from chunking import estimate_tokens
+
+# Name of the backend used by the app and batch.py
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gemini")
+
+# Fake backend behaviour
+FAKE_LATENCY_SECONDS = float(os.getenv("FAKE_BACKEND_LATENCY_SECONDS", "0.5"))
+FAKE_TOKENS_PER_SECOND = float(os.getenv("FAKE_BACKEND_TOKENS_PER_SECOND", "200"))
+FAKE_FAILURE_RATE = float(os.getenv("FAKE_BACKEND_FAILURE_RATE", "0"))
+FAKE_SEED = int(os.getenv("FAKE_BACKEND_SEED", "0"))
+
+# Per-model latency overrides ("model=seconds,...") and models that are out of quota ("model,...")
+FAKE_MODEL_LATENCY = os.getenv("FAKE_BACKEND_MODEL_LATENCY", "")
+FAKE_EXHAUSTED_MODELS = os.getenv("FAKE_BACKEND_EXHAUSTED_MODELS", "")
+
+# Input tokens the fake bills for an attached file
+FAKE_FILE_TOKENS = 2000
+
+# Approximate length of a fake chunk summary
+FAKE_SUMMARY_TOKENS = 150
+
+# Number of pieces a fake streamed response is split into
+FAKE_STREAM_PIECES = 8
+
+CANNED_FEEDBACK = {
+    "title": "Assessment of the Submitted Assignment",
+    "grade": "B",
+    "score": 78,
+    "summary": "The assignment addresses the main question with a clear structure and reasonable evidence.",
+    "strengths": ["Clear structure", "Relevant examples", "Consistent argument"],
+    "areas_for_improvement": ["Deeper analysis", "More recent sources", "Tighter conclusion"],
+    "detailed_feedback": "The work is well organised and mostly on topic. The analysis would benefit from more depth.",
+    "category_scores": {"Content": 80, "Structure": 82, "Analysis": 72, "Language": 79, "References": 70}
+}
+
+_backends = {}
+
+
+def register_backend(name, factory):
+    """Register a client factory; it is called with api_key and max_connections keyword arguments"""
+    _backends[name] = factory
+
+
+def create_client(backend=None, **options):
+    """Create a client for the named backend, or the one selected by MODEL_BACKEND"""
+    name = backend or MODEL_BACKEND
+    if name not in _backends:
+        raise ValueError(f"Unknown model backend {name!r}; choose one of {', '.join(sorted(_backends))}")
+    return _backends[name](**options)
+
+
+def requires_api_key(backend=None):
+    """Check whether the backend talks to the real API and needs GEMINI_API_KEY"""
+    return (backend or MODEL_BACKEND) == "gemini"
+
+
+def _create_gemini_client(api_key=None, max_connections=32):
+    """Create a google-genai client with a connection pool sized for concurrent chunk calls"""
+    import httpx
+    from google import genai
+    from google.genai import types
+
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(client_args={
+            "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        })
+    )
+
+
+class FakeGeminiClient:
+    """Deterministic local stand-in for the Gemini client
+
+    Each call sleeps for a fixed latency plus the time to "generate" its output
+    at the configured token throughput, and fails with a retryable 503 at the
+    configured rate. Feedback prompts get canned feedback JSON whose score
+    depends on the prompt, everything else gets a summary-sized text.
+    """
+
+    def __init__(self, latency_seconds=FAKE_LATENCY_SECONDS, tokens_per_second=FAKE_TOKENS_PER_SECOND,
+                 failure_rate=FAKE_FAILURE_RATE, seed=FAKE_SEED, feedback=None, model_latency=None,
+                 exhausted_models=None, **options):
+        """Initialize fake client; extra options accepted by real clients are ignored"""
+        self.latency_seconds = latency_seconds
+        self.model_latency = model_latency if model_latency is not None else {
+            model.strip(): float(seconds)
+            for model, _, seconds in (entry.partition("=") for entry in FAKE_MODEL_LATENCY.split(",") if entry.strip())
+        }
+        self.exhausted_models = set(exhausted_models if exhausted_models is not None else
+                                    filter(None, (model.strip() for model in FAKE_EXHAUSTED_MODELS.split(","))))
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.feedback = feedback or CANNED_FEEDBACK
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cached_tokens = {}  # cached content name -> token count
+        self._uploads = 0
+        self.calls = 0
+        self.calls_by_model = {}
+
+        self.models = SimpleNamespace(
+            generate_content=self._generate_content,
+            generate_content_stream=self._generate_content_stream
+        )
+        self.files = SimpleNamespace(upload=self._upload, delete=lambda name: None)
+        self.caches = SimpleNamespace(create=self._create_cache)
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self._generate_content_async),
+            files=SimpleNamespace(upload=self._upload_async)
+        )
+
+    def _next_call(self, model=None):
+        """Count a call and decide whether it fails"""
+        from google.genai import errors
+
+        with self._lock:
+            self.calls += 1
+            if model is not None:
+                self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+            failed = self._random.random() < self.failure_rate
+        if model in self.exhausted_models:
+            raise errors.APIError(429, {"error": {"code": 429, "message": "Fake quota exhausted", "status": "RESOURCE_EXHAUSTED"}})
+        if failed:
+            raise errors.APIError(503, {"error": {"code": 503, "message": "Fake backend failure", "status": "UNAVAILABLE"}})
+
+    def _latency(self, model):
+        """Fixed latency of a call to a model"""
+        return self.model_latency.get(model, self.latency_seconds)
+
+    @staticmethod
+    def _prompt_text(contents):
+        """Join the text parts of a request"""
+        parts = [contents] if isinstance(contents, str) else contents
+        return "\n".join(part for part in parts if isinstance(part, str))
+
+    def _respond(self, contents, config):
+        """Build the response text and usage metadata for a request"""
+        from google.genai import types
+
+        text = self._prompt_text(contents)
+        parts = [contents] if isinstance(contents, str) else contents
+        prompt_tokens = estimate_tokens(text) + FAKE_FILE_TOKENS * sum(1 for part in parts if not isinstance(part, str))
+        cached_tokens = self._cached_tokens.get(getattr(config, "cached_content", None), 0)
+
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        structured = getattr(config, "response_schema", None) is not None
+        if structured or "category_scores" in text:
+            feedback = copy.deepcopy(self.feedback)
+            feedback["score"] = 55 + digest[0] % 40
+            output = json.dumps(feedback, indent=2)
+            if not structured:
+                output = f"```json\n{output}\n```"
+        else:
+            words = text.split()
+            start = digest[1] % max(1, len(words))
+            output = "Key points: " + " ".join(words[start:start + FAKE_SUMMARY_TOKENS]) + "\n\nStrengths and weaknesses noted."
+
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens + cached_tokens,
+            cached_content_token_count=cached_tokens or None,
+            candidates_token_count=estimate_tokens(output)
+        )
+        return output, usage
+
+    @staticmethod
+    def _response(text, usage=None):
+        """Wrap text in a GenerateContentResponse"""
+        from google.genai import types
+
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+            usage_metadata=usage
+        )
+
+    def _generation_seconds(self, output_tokens):
+        """Time the fake spends producing output"""
+        return output_tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _generate_content(self, model, contents, config=None):
+        """Fake models.generate_content"""
+        self._next_call(model)
+        output, usage = self._respond(contents, config)
+        time.sleep(self._latency(model) + self._generation_seconds(usage.candidates_token_count))
+        return self._response(output, usage)
+
+    def _generate_content_stream(self, model, contents, config=None):
+        """Fake models.generate_content_stream"""
+        self._next_call(model)
+        output, usage = self._respond(contents, config)
+        time.sleep(self._latency(model))
+
+        size = max(1, -(-len(output) // FAKE_STREAM_PIECES))
+        pieces = [output[i:i + size] for i in range(0, len(output), size)]
+        for index, piece in enumerate(pieces):
+            time.sleep(self._generation_seconds(estimate_tokens(piece)))
+            yield self._response(piece, usage if index == len(pieces) - 1 else None)
+
+    async def _generate_content_async(self, model, contents, config=None):
+        """Fake aio.models.generate_content"""
+        self._next_call(model)
+        output, usage = self._respond(contents, config)
+        await asyncio.sleep(self._latency(model) + self._generation_seconds(usage.candidates_token_count))
+        return self._response(output, usage)
+
+    def _uploaded_file(self):
+        """Describe a new fake upload"""
+        from google.genai import types
+
+        with self._lock:
+            self._uploads += 1
+            number = self._uploads
+        return types.File(
+            name=f"files/fake-{number}",
+            uri=f"fake://files/{number}",
+            mime_type="application/pdf",
+            expiration_time=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=48)
+        )
+
+    def _upload(self, file, config=None):
+        """Fake files.upload"""
+        self._next_call()
+        time.sleep(self.latency_seconds)
+        return self._uploaded_file()
+
+    async def _upload_async(self, file, config=None):
+        """Fake aio.files.upload"""
+        self._next_call()
+        await asyncio.sleep(self.latency_seconds)
+        return self._uploaded_file()
+
+    def _create_cache(self, model, config):
+        """Fake caches.create"""
+        from google.genai import types
+
+        self._next_call()
+        tokens = sum(estimate_tokens(part.text or "") for content in config.contents for part in content.parts)
+        with self._lock:
+            name = f"cachedContents/fake-{len(self._cached_tokens) + 1}"
+            self._cached_tokens[name] = tokens
+        return types.CachedContent(name=name, usage_metadata=types.CachedContentUsageMetadata(total_token_count=tokens))
+
+
+register_backend("gemini", _create_gemini_client)
+register_backend("fake", FakeGeminiClient)
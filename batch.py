@@ -0,0 +1,372 @@
+"""Headless batch grading for the AI PDF Feedback System.
+
+Grades every PDF in a directory (or listed in a manifest) against a single
+requirements file, writing one JSON feedback record per submission and a
+summary CSV. Re-running the same command resumes an interrupted batch.
+
+Usage:
+    python batch.py submissions/ --requirements rubric.pdf --output results/
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from backends import create_client, requires_api_key
+from cache import hash_bytes, hash_file
+from feedback_store import FeedbackStore
+from revisions import RevisionStore
+from main import GeminiProcessor, PDFProcessor, FeedbackParseError, MAX_CONCURRENT_CHUNKS
+from shared_state import get_shared_backend
+from tracing import Tracer, use as use_tracer
+
+logger = logging.getLogger("batch")
+
+SUMMARY_FILE_NAME = "summary.csv"
+PDF_REPORTS_DIR_NAME = "reports"
+SUMMARY_FIELDS = ["file", "status", "method", "route_reason", "grade", "score", "elapsed_seconds", "error"]
+
+
+class BatchGrader:
+    """Grades a collection of PDF submissions without the Streamlit UI"""
+
+    def __init__(self, gemini, output_dir, requirements_text=None, workers=4, retry_failed=True, cache=None,
+                 store=None, cohort=None):
+        """Initialize batch grader"""
+        self.gemini = gemini
+        self.cache = cache
+        self.store = store
+        self.cohort = cohort
+        self.output_dir = pathlib.Path(output_dir)
+        self.requirements_text = requirements_text
+        # Records graded against other requirements are graded again
+        self.requirements_hash = hash_bytes((requirements_text or "").encode("utf-8"))
+        self.workers = max(1, workers)
+        self.retry_failed = retry_failed
+
+    @staticmethod
+    def collect_submissions(source):
+        """Return (submission_id, path) pairs from a directory or a manifest file"""
+        source = pathlib.Path(source)
+
+        if source.is_dir():
+            paths = sorted(p for p in source.rglob("*") if p.suffix.lower() == ".pdf")
+            return [(BatchGrader._submission_id(p.relative_to(source)), p) for p in paths]
+
+        # Manifests are either a CSV with a "path" column or one path per line,
+        # with relative paths resolved against the manifest's directory
+        if source.suffix.lower() == ".csv":
+            with open(source, newline="", encoding="utf-8") as f:
+                entries = [row["path"] for row in csv.DictReader(f) if row.get("path")]
+        else:
+            with open(source, encoding="utf-8") as f:
+                entries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+        submissions = []
+        for entry in entries:
+            path = pathlib.Path(entry)
+            if not path.is_absolute():
+                path = source.parent / path
+            submissions.append((BatchGrader._submission_id(pathlib.Path(entry)), path))
+        return submissions
+
+    @staticmethod
+    def _submission_id(relative_path):
+        """Build a flat, filesystem-safe identifier from a relative submission path"""
+        parts = [part for part in relative_path.with_suffix("").parts if part not in ("", ".", "..", "/")]
+        submission_id = "__".join(parts)
+        if len(relative_path.parts) > 1 or "__" in submission_id:
+            # A short hash of the full path keeps "a/b.pdf" and "a__b.pdf" from sharing a record
+            submission_id += "-" + hash_bytes(relative_path.as_posix().encode("utf-8"))[:8]
+        return submission_id
+
+    def record_path(self, submission_id):
+        """Return the JSON record path for a submission"""
+        return self.output_dir / f"{submission_id}.json"
+
+    def is_done(self, submission_id):
+        """Check whether a submission already has a record for these requirements that needs no regrading"""
+        record = self._load_record(self.record_path(submission_id))
+        if record is None or record.get("requirements_hash") != self.requirements_hash:
+            return False
+        return record["status"] == "ok" or not self.retry_failed
+
+    def grade_submission(self, submission_id, path):
+        """Extract, analyze and persist feedback for a single submission"""
+        started = time.perf_counter()
+        record = {
+            "file": str(path),
+            "submission_id": submission_id,
+            "requirements_hash": self.requirements_hash,
+            "status": "ok",
+            "method": None,
+            "route_reason": None,
+            "feedback": None,
+            "error": None,
+        }
+
+        tracer = Tracer(submission_id=submission_id)
+        try:
+            with use_tracer(tracer):
+                self._grade(path, record)
+        except FeedbackParseError as e:
+            record["status"] = "error"
+            record["error"] = f"{e}: {e.response_text[:500]}"
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = str(e)
+
+        record["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+        record["timings"] = tracer.summary()
+        record["graded_at"] = datetime.now(timezone.utc).isoformat()
+        self._write_record(self.record_path(submission_id), record)
+        tracer.export()
+        if self.store and record["status"] == "ok":
+            self._store_feedback(record)
+        return record
+
+    def _store_feedback(self, record):
+        """Add a graded submission to its cohort in the feedback store"""
+        try:
+            self.store.add(
+                record["submission_id"], record["feedback"], cohort=self.cohort,
+                submission=record["submission_id"], source="batch"
+            )
+        except Exception as e:
+            logger.warning("Could not store feedback for %s: %s", record["submission_id"], e)
+
+    def _grade(self, path, record):
+        """Fill a record with the feedback for one submission, raising on failure"""
+        file_hash = hash_file(path)
+        analysis_key = GeminiProcessor.cache_key(file_hash, self.requirements_text)
+        cached_feedback = self.cache.get_json(analysis_key) if self.cache else None
+
+        if cached_feedback is not None:
+            record["method"] = "cache"
+            record["feedback"] = cached_feedback
+        else:
+            assignment_text, record["route_reason"] = self._extract_text(path, file_hash)
+
+            # Mirror the app: fall back to the File API for non-extractable PDFs
+            if assignment_text and assignment_text.strip():
+                record["method"] = "text"
+                # A submission path re-graded in a later run is compared with its earlier draft
+                details = {}
+                record["feedback"] = self.gemini.analyze_text(
+                    assignment_text, self.requirements_text,
+                    submitter=GeminiProcessor.submitter_key(f"batch:{record['submission_id']}", self.requirements_text),
+                    details=details
+                )
+                if details.get("revision"):
+                    record["revision"] = {
+                        "chunks": details["revision"]["chunks"],
+                        "reanalyzed": details["revision"]["reanalyzed"]
+                    }
+            else:
+                record["method"] = "file_api"
+                record["feedback"] = self.gemini.analyze_file(str(path), self.requirements_text)
+
+            if self.cache and record["feedback"]:
+                self.cache.set_json(analysis_key, record["feedback"], kind="feedback")
+
+    def _extract_text(self, path, file_hash):
+        """Extract markdown from a submission, using the cache when available
+
+        Returns (text, route_reason); text is empty when the pre-scan routes the
+        document to the File API, and route_reason is None on a cache hit.
+        """
+        extraction_key = PDFProcessor.cache_key(file_hash)
+        if self.cache:
+            cached_text = self.cache.get(extraction_key)
+            if cached_text is not None:
+                return cached_text, None
+
+        try:
+            plan = PDFProcessor.plan_extraction(str(path))
+            logger.info("%s: %s", path, plan["reason"])
+            assignment_text = PDFProcessor.convert_planned(str(path), plan, self.gemini.transcribe_pages)
+        except Exception as e:
+            logger.warning("Text extraction failed for %s: %s", path, e)
+            return None, str(e)
+
+        if self.cache:
+            self.cache.set(extraction_key, assignment_text, kind="extraction")
+        return assignment_text, plan["reason"]
+
+    def run(self, submissions):
+        """Grade all pending submissions in parallel and write the summary CSV"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        pending = [(sid, path) for sid, path in submissions if not self.is_done(sid)]
+        skipped = len(submissions) - len(pending)
+        if skipped:
+            logger.info("Resuming: %d of %d submissions already graded", skipped, len(submissions))
+
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.grade_submission, sid, path): sid for sid, path in pending}
+            for completed, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                if record["status"] != "ok":
+                    failures += 1
+                    logger.error("[%d/%d] %s failed: %s", completed, len(pending), futures[future], record["error"])
+                else:
+                    logger.info("[%d/%d] %s graded in %.1fs", completed, len(pending), futures[future], record["elapsed_seconds"])
+
+        self.write_summary(submissions)
+        return len(pending) - failures, failures, skipped
+
+    def write_summary(self, submissions):
+        """Rebuild the summary CSV from every record on disk, including earlier runs"""
+        records = [self._load_record(self.record_path(sid)) for sid, _ in submissions]
+        records = [record for record in records if record is not None]
+
+        # One column per assessment category seen across the batch
+        categories = []
+        for record in records:
+            for category in ((record.get("feedback") or {}).get("category_scores") or {}):
+                if category not in categories:
+                    categories.append(category)
+
+        summary_path = self.output_dir / SUMMARY_FILE_NAME
+        tmp_path = summary_path.with_suffix(".csv.tmp")
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS + categories)
+            writer.writeheader()
+            for record in records:
+                feedback = record.get("feedback") or {}
+                row = {field: record.get(field) for field in SUMMARY_FIELDS}
+                row["grade"] = feedback.get("grade")
+                row["score"] = feedback.get("score")
+                row.update(feedback.get("category_scores") or {})
+                writer.writerow(row)
+        os.replace(tmp_path, summary_path)
+        return summary_path
+
+    def export_pdf_reports(self, submissions, workers=None):
+        """Write a PDF feedback report for every graded submission, in parallel; return the report directory"""
+        from pdf_report import REPORT_EXPORT_WORKERS, export_pdf_reports
+
+        records = [self._load_record(self.record_path(sid)) for sid, _ in submissions]
+        reports = [
+            (record["submission_id"], record["feedback"])
+            for record in records
+            if record is not None and record["status"] == "ok" and record.get("feedback")
+        ]
+        report_dir = self.output_dir / PDF_REPORTS_DIR_NAME
+        export_pdf_reports(reports, report_dir, workers=workers or REPORT_EXPORT_WORKERS)
+        logger.info("Wrote %d PDF reports to %s", len(reports), report_dir)
+        return report_dir
+
+    @staticmethod
+    def _load_record(record_path):
+        """Load a JSON record, treating missing or corrupt files as absent"""
+        try:
+            with open(record_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    @staticmethod
+    def _write_record(record_path, record):
+        """Write a JSON record atomically so an interrupted run never leaves partial files"""
+        tmp_path = record_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, record_path)
+
+
+def load_requirements(requirements_path):
+    """Load requirements from a PDF or plain-text file"""
+    if requirements_path is None:
+        return None
+    if pathlib.Path(requirements_path).suffix.lower() == ".pdf":
+        return PDFProcessor.convert_to_markdown(requirements_path)
+    with open(requirements_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Grade a batch of PDF assignments without the web UI.")
+    parser.add_argument("source", help="Directory of PDFs, or a manifest (.csv with a 'path' column, or one path per line)")
+    parser.add_argument("-r", "--requirements", help="Requirements/question paper as PDF or text file")
+    parser.add_argument("-o", "--output", default="batch_results", help="Directory for JSON records and summary CSV")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of submissions graded in parallel")
+    parser.add_argument("--chunk-concurrency", type=int, default=MAX_CONCURRENT_CHUNKS,
+                        help="Concurrent chunk requests per long submission")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Ignore the result cache and earlier drafts, and always call the model")
+    parser.add_argument("--no-retry-failed", action="store_true",
+                        help="When resuming, skip submissions whose previous attempt failed")
+    parser.add_argument("--cohort",
+                        help="Cohort the feedback is stored under for the analytics page (default: source name)")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Do not add the feedback to the cohort analytics store")
+    parser.add_argument("--pdf-reports", action="store_true",
+                        help=f"Also write a PDF feedback report per graded submission to <output>/{PDF_REPORTS_DIR_NAME}")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Command line entry point"""
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key and requires_api_key():
+        logger.error("No Gemini API key found. Please set GEMINI_API_KEY in the environment or .env file.")
+        return 2
+
+    cache = None if args.no_cache else get_shared_backend().result_cache()
+    gemini = GeminiProcessor(
+        max_concurrency=args.chunk_concurrency,
+        client=create_client(api_key=api_key),
+        result_cache=cache,
+        # Revised drafts only re-analyze the parts that changed
+        revisions=None if args.no_cache else RevisionStore()
+    )
+    grader = BatchGrader(
+        gemini,
+        args.output,
+        requirements_text=load_requirements(args.requirements),
+        workers=args.workers,
+        retry_failed=not args.no_retry_failed,
+        cache=cache,
+        store=None if args.no_store else FeedbackStore(),
+        cohort=args.cohort or pathlib.Path(args.source).stem
+    )
+
+    submissions = grader.collect_submissions(args.source)
+    if not submissions:
+        logger.error("No PDF submissions found in %s", args.source)
+        return 1
+
+    graded, failed, skipped = grader.run(submissions)
+    if args.pdf_reports:
+        grader.export_pdf_reports(submissions)
+
+    # Uploads left idle by earlier runs are deleted; this run's stay reusable for a re-run
+    removed = gemini.upload_registry.cleanup(gemini.client)
+    if removed:
+        logger.info("Removed %d stale File API uploads", removed)
+    logger.info("Done: %d graded, %d failed, %d skipped. Summary: %s",
+                graded, failed, skipped, grader.output_dir / SUMMARY_FILE_NAME)
+
+    usage = gemini.token_savings()
+    logger.info("Token usage: %d calls, %d retries, %d prompt tokens, %d output tokens, %d input tokens saved by cached context",
+                usage["calls"], usage["retries"], usage["prompt_tokens"], usage["output_tokens"], usage["input_tokens_saved"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
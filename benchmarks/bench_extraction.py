@@ -0,0 +1,93 @@
+"""Benchmark single-call vs page-sharded PDF extraction.
+
+Compares pages/sec of one pymupdf4llm.to_markdown call against the process
+pool path in extraction.py, and reports time-to-first-shard for streaming.
+
+Usage:
+    python benchmarks/bench_extraction.py thesis.pdf
+    python benchmarks/bench_extraction.py --generate 300
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import pymupdf
+import pymupdf4llm
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import extraction  # noqa: E402
+
+SAMPLE_PARAGRAPH = (
+    "The results indicate a strong correlation between the observed variables, "
+    "although further analysis is required to establish causality. "
+)
+
+
+def generate_pdf(path, pages):
+    """Write a synthetic text PDF with a heading and several paragraphs per page"""
+    doc = pymupdf.open()
+    for i in range(pages):
+        page = doc.new_page()
+        text = f"Section {i + 1}\n\n" + "\n\n".join(SAMPLE_PARAGRAPH * 3 for _ in range(8))
+        page.insert_textbox(pymupdf.Rect(56, 56, 540, 790), text, fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def time_call(fn, repeat):
+    """Return the best wall time of a callable over several runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def time_to_first_shard(file_path, pages_per_shard):
+    """Return seconds until the first shard of a streamed conversion is available"""
+    started = time.perf_counter()
+    stream = extraction.iter_markdown_shards(file_path, pages_per_shard)
+    next(stream)
+    elapsed = time.perf_counter() - started
+    stream.close()
+    return elapsed
+
+
+def main():
+    """Run the extraction benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdfs", nargs="*", help="PDF files to benchmark")
+    parser.add_argument("--generate", type=int, metavar="PAGES", help="Benchmark a generated PDF with this many pages")
+    parser.add_argument("--pages-per-shard", type=int, default=extraction.PAGES_PER_SHARD)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pdfs = list(args.pdfs)
+    if args.generate:
+        generated = os.path.join(tempfile.mkdtemp(), f"generated_{args.generate}p.pdf")
+        generate_pdf(generated, args.generate)
+        pdfs.append(generated)
+    if not pdfs:
+        parser.error("pass at least one PDF or --generate PAGES")
+
+    # Warm the worker pool so process start-up is not billed to the first file
+    extraction.convert_to_markdown_parallel(pdfs[0], args.pages_per_shard)
+
+    print(f"{'file':<32} {'pages':>6} {'single p/s':>11} {'sharded p/s':>12} {'speedup':>8} {'first shard':>12}")
+    for pdf in pdfs:
+        pages = extraction.page_count(pdf)
+        single = time_call(lambda: pymupdf4llm.to_markdown(pdf, show_progress=False), args.repeat)
+        sharded = time_call(lambda: extraction.convert_to_markdown_parallel(pdf, args.pages_per_shard), args.repeat)
+        first = time_to_first_shard(pdf, args.pages_per_shard)
+        print(f"{pathlib.Path(pdf).name[:32]:<32} {pages:>6} {pages / single:>11.1f} {pages / sharded:>12.1f} "
+              f"{single / sharded:>7.2f}x {first:>11.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Offline end-to-end benchmark of the analysis pipeline.
+
+Runs extraction, chunking, map, reduce, final assessment, parsing and report
+generation over generated PDFs of several lengths against the deterministic
+fake model backend, so no API key or network access is needed. Reports
+per-stage latency percentiles and document/page throughput.
+
+It then checks model routing: with each tier's model out of quota in turn,
+a long document must still be fully analyzed by the other tier, with the
+exhausted tier cooled down after its first failures. The exit status is 1
+if a routing check fails.
+
+Usage:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --pages 10,100,400 --runs 5 --latency 0.2 --failure-rate 0.05
+    python benchmarks/bench_pipeline.py --json results.json
+    python benchmarks/bench_pipeline.py --pages 5 --runs 1 --routing-pages 60
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from backends import FakeGeminiClient  # noqa: E402
+from bench_extraction import generate_pdf  # noqa: E402
+from context_cache import RequirementsContextCache  # noqa: E402
+from file_uploads import FileUploadRegistry  # noqa: E402
+from main import GeminiProcessor, PDFProcessor, ReportGenerator  # noqa: E402
+from rate_limit import TokenBucketLimiter  # noqa: E402
+from routing import DEFAULT_TIERS, ModelRouter  # noqa: E402
+from tracing import Tracer, span, use  # noqa: E402
+
+# Stages reported, in pipeline order
+STAGES = ["extract.markdown", "chunk", "map.chunk", "reduce.level", "final", "parse", "report", "document"]
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[rank - 1]
+
+
+def create_processor(client, workdir, concurrency, router=None):
+    """Return a processor on the fake client without context caching or rate limiting"""
+    return GeminiProcessor(
+        max_concurrency=concurrency,
+        client=client,
+        context_cache=RequirementsContextCache(enabled=False),
+        limiter=TokenBucketLimiter(0, 0),
+        upload_registry=FileUploadRegistry(os.path.join(workdir, "uploads.sqlite3")),
+        router=router
+    )
+
+
+def run_document(pdf, client, workdir, concurrency):
+    """Run the whole pipeline once for a PDF and return its trace"""
+    gemini = create_processor(client, workdir, concurrency)
+    tracer = Tracer()
+    with use(tracer), span("document"):
+        text = PDFProcessor.convert_to_markdown(pdf)
+        feedback = gemini.analyze_text(text)
+        with span("report"):
+            ReportGenerator.create_markdown_report(feedback)
+    return tracer
+
+
+def check_routing(pdf, workdir, concurrency, latency):
+    """Analyze a long PDF with each tier's model exhausted in turn and check the calls fell back
+
+    Returns one result row per exhausted tier, with the failed checks listed.
+    """
+    text = PDFProcessor.convert_to_markdown(pdf)
+    rows = []
+    for exhausted in DEFAULT_TIERS.values():
+        client = FakeGeminiClient(latency_seconds=latency, exhausted_models={exhausted.model})
+        # A fresh router per scenario, so cooldowns from one do not leak into the next
+        gemini = create_processor(client, workdir, concurrency, ModelRouter())
+        gemini.analyze_text(text)
+
+        routes = gemini.token_savings().get("routes", {})
+        stages = sorted({route.split(":", 1)[0] for route in routes})
+        failures = []
+        if any(route.endswith(f":{exhausted.model}") for route in routes):
+            failures.append(f"calls answered by exhausted {exhausted.model}")
+        if "map" not in stages or "final" not in stages:
+            failures.append(f"analysis incomplete, stages answered: {stages}")
+        # Once the tier is cooled down, only the calls already in flight can have tried it
+        exhausted_calls = client.calls_by_model.get(exhausted.model, 0)
+        if exhausted_calls > gemini.max_concurrency:
+            failures.append(f"{exhausted_calls} calls sent to the exhausted tier after its cooldown started")
+        rows.append({
+            "stage": "routing", "exhausted": exhausted.name, "routes": routes,
+            "exhausted_calls": exhausted_calls, "failures": failures
+        })
+    return rows
+
+
+def main():
+    """Run the pipeline benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default="5,20,60", help="Comma-separated page counts of the generated PDFs")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per PDF")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake per-call latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=2000, help="Fake output token throughput")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of fake calls failing with a retryable 503")
+    parser.add_argument("--concurrency", type=int, default=None, help="Chunks analyzed in parallel")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--routing-pages", type=int, default=60, help="Pages of the PDF used for the routing checks")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    results = []
+    print(f"{'pages':>6} {'stage':<18} {'count':>6} " + " ".join(f"{'p' + str(p):>9}" for p in PERCENTILES))
+    for pages in (int(p) for p in args.pages.split(",")):
+        pdf = os.path.join(workdir, f"generated_{pages}p.pdf")
+        generate_pdf(pdf, pages)
+        client = FakeGeminiClient(
+            latency_seconds=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            failure_rate=args.failure_rate,
+            seed=args.seed
+        )
+
+        durations = {stage: [] for stage in STAGES}
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            tracer = run_document(pdf, client, workdir, args.concurrency)
+            for recorded in tracer.spans:
+                if recorded["name"] in durations:
+                    durations[recorded["name"]].append(recorded["duration_seconds"])
+        elapsed = time.perf_counter() - started
+
+        for stage in STAGES:
+            values = durations[stage]
+            if not values:
+                continue
+            row = {"pages": pages, "stage": stage, "count": len(values)}
+            row.update({f"p{p}": round(percentile(values, p), 4) for p in PERCENTILES})
+            results.append(row)
+            print(f"{pages:>6} {stage:<18} {len(values):>6} " + " ".join(f"{row[f'p{p}']:>8.3f}s" for p in PERCENTILES))
+
+        throughput = {
+            "pages": pages, "stage": "throughput", "documents_per_second": round(args.runs / elapsed, 3),
+            "pages_per_second": round(args.runs * pages / elapsed, 2), "model_calls": client.calls
+        }
+        results.append(throughput)
+        print(f"{pages:>6} {'throughput':<18} {throughput['documents_per_second']:>8.2f} docs/s "
+              f"{throughput['pages_per_second']:>8.1f} pages/s {client.calls:>6} model calls")
+
+    pdf = os.path.join(workdir, f"routing_{args.routing_pages}p.pdf")
+    generate_pdf(pdf, args.routing_pages)
+    routing = check_routing(pdf, workdir, args.concurrency, args.latency)
+    results.extend(routing)
+    for row in routing:
+        status = "ok" if not row["failures"] else "FAILED: " + "; ".join(row["failures"])
+        answered = ", ".join(f"{route}={count}" for route, count in sorted(row["routes"].items()))
+        print(f"routing with {row['exhausted']} exhausted ({row['exhausted_calls']} calls refused): {answered} [{status}]")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if any(row["failures"] for row in routing):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark PDF feedback report generation.
+
+Measures single-report latency and bulk export throughput of pdf_report.py
+over synthetic feedback, comparing one process against the process pool.
+
+Usage:
+    python benchmarks/bench_report_pdf.py
+    python benchmarks/bench_report_pdf.py --reports 2000 --workers 1,4,8
+"""
+
+import argparse
+import copy
+import pathlib
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from backends import CANNED_FEEDBACK  # noqa: E402
+from pdf_report import build_pdf_report, export_pdf_reports, load_templates  # noqa: E402
+
+DETAILED_PARAGRAPH = (
+    "The argument is generally well supported, although several claims in the discussion would "
+    "benefit from direct references to the literature reviewed earlier in the assignment. "
+)
+
+
+def synthetic_feedback(count, seed=0):
+    """Return (name, feedback_data) pairs with varied scores and feedback lengths"""
+    rng = random.Random(seed)
+    reports = []
+    for index in range(count):
+        feedback = copy.deepcopy(CANNED_FEEDBACK)
+        feedback["score"] = rng.randint(40, 98)
+        feedback["category_scores"] = {category: rng.randint(35, 100) for category in feedback["category_scores"]}
+        feedback["detailed_feedback"] = "\n\n".join(DETAILED_PARAGRAPH * rng.randint(2, 6) for _ in range(rng.randint(2, 8)))
+        reports.append((f"student_{index:05d}", feedback))
+    return reports
+
+
+def main():
+    """Run the PDF report benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=500, help="Reports generated per bulk run")
+    parser.add_argument("--workers", default="1,4", help="Comma-separated worker counts for bulk export")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    reports = synthetic_feedback(args.reports, args.seed)
+
+    started = time.perf_counter()
+    templates = load_templates()
+    print(f"template load: {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    timings = []
+    for _, feedback in reports[:50]:
+        started = time.perf_counter()
+        build_pdf_report(feedback, templates)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f"single report: p50 {timings[len(timings) // 2] * 1000:.1f}ms, "
+          f"p90 {timings[int(len(timings) * 0.9)] * 1000:.1f}ms")
+
+    for workers in (int(w) for w in args.workers.split(",")):
+        output_dir = tempfile.mkdtemp()
+        started = time.perf_counter()
+        paths = export_pdf_reports(reports, output_dir, workers=workers)
+        elapsed = time.perf_counter() - started
+        size = sum(pathlib.Path(path).stat().st_size for path in paths) / len(paths)
+        print(f"bulk {workers:>2} workers: {len(paths)} reports in {elapsed:.2f}s "
+              f"({len(paths) / elapsed:.0f} reports/s, {size / 1024:.1f} KiB each)")
+        shutil.rmtree(output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark incremental re-grading of revised drafts.
+
+Grades a generated long assignment against the fake model backend, then
+grades revisions of it with a few paragraphs edited, inserted or deleted,
+and reports model calls, re-analyzed chunks and latency of each run.
+Compare against CHUNK_STABLE_BOUNDARIES=0 to see the effect of
+content-defined chunk boundaries.
+
+Usage:
+    python benchmarks/bench_revisions.py
+    python benchmarks/bench_revisions.py --paragraphs 800 --edits 1,2,5,20 --latency 0.2
+"""
+
+import argparse
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from backends import FakeGeminiClient  # noqa: E402
+from cache import ResultCache  # noqa: E402
+from chunking import STABLE_BOUNDARIES  # noqa: E402
+from context_cache import RequirementsContextCache  # noqa: E402
+from file_uploads import FileUploadRegistry  # noqa: E402
+from main import GeminiProcessor  # noqa: E402
+from rate_limit import TokenBucketLimiter  # noqa: E402
+from revisions import RevisionStore  # noqa: E402
+
+WORDS = ("analysis", "evidence", "method", "results", "theory", "argument", "data", "model", "sample", "context")
+
+
+def paragraph(rng):
+    """Return a paragraph of random prose"""
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 220))) + "."
+
+
+def revise(paragraphs, edits, rng):
+    """Return a copy of a draft with paragraphs rewritten, inserted or deleted at random"""
+    revised = list(paragraphs)
+    for _ in range(edits):
+        index = rng.randrange(len(revised))
+        action = rng.choice(("rewrite", "insert", "delete"))
+        if action == "rewrite":
+            revised[index] = paragraph(rng)
+        elif action == "insert":
+            revised.insert(index, paragraph(rng))
+        else:
+            del revised[index]
+    return revised
+
+
+def grade(gemini, client, text):
+    """Grade a draft and return (model calls, chunks re-analyzed, total chunks, seconds)"""
+    calls = client.calls
+    details = {}
+    started = time.perf_counter()
+    gemini.analyze_text(text, submitter="bench", details=details)
+    elapsed = time.perf_counter() - started
+    return client.calls - calls, details["revision"]["reanalyzed"], details["revision"]["chunks"], elapsed
+
+
+def main():
+    """Run the revision benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paragraphs", type=int, default=400, help="Paragraphs in the original draft")
+    parser.add_argument("--edits", default="1,2,5,20", help="Comma-separated numbers of edits per revision")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake model latency per call, in seconds")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    draft = [paragraph(rng) for _ in range(args.paragraphs)]
+    print(f"stable chunk boundaries: {'on' if STABLE_BOUNDARIES else 'off'}")
+
+    for edits in [0] + [int(e) for e in args.edits.split(",")]:
+        # Fresh stores per revision, so each one is compared against the original only
+        with tempfile.TemporaryDirectory() as workdir:
+            client = FakeGeminiClient(latency_seconds=args.latency, tokens_per_second=1e9, seed=args.seed)
+            gemini = GeminiProcessor(
+                max_concurrency=args.concurrency,
+                client=client,
+                context_cache=RequirementsContextCache(enabled=False),
+                limiter=TokenBucketLimiter(0, 0),
+                result_cache=ResultCache(os.path.join(workdir, "results.sqlite3")),
+                upload_registry=FileUploadRegistry(os.path.join(workdir, "uploads.sqlite3")),
+                revisions=RevisionStore(os.path.join(workdir, "revisions.sqlite3"))
+            )
+            first = grade(gemini, client, "\n\n".join(draft))
+            if not edits:
+                print(f"original: {first[0]} calls, {first[2]} chunks in {first[3]:.2f}s")
+                continue
+            calls, reanalyzed, chunks, elapsed = grade(gemini, client, "\n\n".join(revise(draft, edits, rng)))
+            print(f"{edits:>3} edits: {calls} calls ({first[0] / calls:.1f}x fewer), "
+                  f"{reanalyzed}/{chunks} chunks re-analyzed in {elapsed:.2f}s ({first[3] / elapsed:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark the cold-start import cost of the Streamlit app.
+
+Imports a module in fresh interpreters with ``-X importtime`` and reports
+the wall time of the import plus the cumulative cost of each top-level
+package it pulls in, so regressions in cold-start time show up per module.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --module main --runs 5 --top 15
+"""
+
+import argparse
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# "import time: self [us] | cumulative | imported package" lines printed by -X importtime
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_profile(module):
+    """Import a module in a fresh interpreter; return (wall seconds, {directly imported module: cumulative seconds})"""
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - started
+
+    # -X importtime lists each module after its own imports, indented two spaces per nesting level
+    packages = {}
+    children = []
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(2)) / 1e6, (len(match.group(3)) - 1) // 2, match.group(4)
+        if depth == 1:
+            children.append((name, cumulative))
+        elif depth == 0:
+            # Break the profiled module down into what it imports directly; keep other top-level imports whole
+            if name == module:
+                for child, seconds in children:
+                    packages[child] = packages.get(child, 0.0) + seconds
+                packages[f"{module} (own code)"] = cumulative - sum(seconds for _, seconds in children)
+            children = []
+    return wall, packages
+
+
+def main():
+    """Run the startup benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main", help="Module to import")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to average over")
+    parser.add_argument("--top", type=int, default=20, help="Number of packages to list")
+    args = parser.parse_args()
+
+    walls = []
+    per_module = {}
+    for _ in range(args.runs):
+        wall, packages = import_profile(args.module)
+        walls.append(wall)
+        for name, seconds in packages.items():
+            per_module.setdefault(name, []).append(seconds)
+
+    print(f"import {args.module}: median {statistics.median(walls):.3f}s over {args.runs} fresh interpreters "
+          f"(includes interpreter start-up)")
+    print(f"{'module':<28} {'median import':>14}")
+    ranked = sorted(per_module.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, seconds in ranked[:args.top]:
+        print(f"{name:<28} {statistics.median(seconds):>13.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Persistent, content-addressed result cache for the AI PDF Feedback System.
+
+Extraction output and parsed feedback are stored in a small SQLite database,
+keyed by hashes of everything that determines the result (PDF bytes,
+requirements text, prompt templates, model name). Entries are evicted when
+they exceed a maximum age or when the cache grows beyond a size budget, in
+least-recently-used order. The total size is tracked as entries are written,
+so a full eviction pass only runs when the budget is exceeded or every
+CACHE_EVICT_INTERVAL_SECONDS, to catch writes by other processes.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Default cache location and limits, overridable through the environment
+CACHE_PATH = os.getenv("RESULT_CACHE_PATH", ".cache/results.sqlite3")
+CACHE_MAX_BYTES = int(float(os.getenv("RESULT_CACHE_MAX_MB", "512")) * 1024 * 1024)
+CACHE_MAX_AGE_SECONDS = int(float(os.getenv("RESULT_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600)
+
+# Seconds between full eviction passes while the tracked size is under budget
+CACHE_EVICT_INTERVAL_SECONDS = 60
+
+# Read buffer size used when hashing files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_bytes(data):
+    """Return the SHA-256 hex digest of a bytes object"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(file_path):
+    """Return the SHA-256 hex digest of a file without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    """Build a cache key from an ordered list of key parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str("" if part is None else part).encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") never collide
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed key/value cache with size- and age-based eviction"""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, max_age_seconds=CACHE_MAX_AGE_SECONDS):
+        """Initialize cache and create the database if needed"""
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._size = None  # total entry size as of the last eviction pass, plus writes since
+        self._next_evict = 0.0
+        self._size_lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection; one per call keeps the cache safe to share across threads"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Return the cached string for a key, or None on a miss or expired entry"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.max_age_seconds and now - created_at > self.max_age_seconds:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key, value, kind="text"):
+        """Store a string under a key and evict old entries if over budget"""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._connect() as conn:
+            replaced = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, kind, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, value, size, now, now)
+            )
+        with self._size_lock:
+            if self._size is not None:
+                self._size += size - (replaced[0] if replaced else 0)
+            due = self._size is None or now >= self._next_evict or bool(self.max_bytes and self._size > self.max_bytes)
+        if due:
+            self.evict()
+
+    def get_json(self, key):
+        """Return a cached JSON value, or None on a miss"""
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key, value, kind="json"):
+        """Store a JSON-serializable value"""
+        self.set(key, json.dumps(value, ensure_ascii=False), kind=kind)
+
+    def evict(self):
+        """Drop expired entries, then least-recently-used entries until under the size budget"""
+        with self._connect() as conn:
+            if self.max_age_seconds:
+                conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if self.max_bytes and total > self.max_bytes:
+                to_delete = []
+                for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+                    if total <= self.max_bytes:
+                        break
+                    to_delete.append((key,))
+                    total -= size
+                conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+
+        with self._size_lock:
+            self._size = total
+            self._next_evict = time.time() + CACHE_EVICT_INTERVAL_SECONDS
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+        with self._size_lock:
+            self._size = 0
@@ -0,0 +1,103 @@
+"""Vectorized cohort aggregates over stored feedback.
+
+Every function takes the DataFrame returned by ``FeedbackStore.load`` and
+returns a small aggregated frame, computed column-wise with pandas/NumPy
+rather than per record, so a dashboard over tens of thousands of
+submissions only ever charts a handful of rows.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Columns of a loaded cohort that are not category scores
+RECORD_COLUMNS = ("cohort", "submission", "source", "grade", "score", "graded_at")
+
+# Percentiles reported per category
+PERCENTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# Robust z-score above which a score is flagged as an outlier
+OUTLIER_THRESHOLD = float(os.getenv("COHORT_OUTLIER_THRESHOLD", "3.5"))
+
+# Scale factor making the median absolute deviation comparable to a standard deviation
+MAD_SCALE = 0.6745
+
+# Width of the overall score histogram bins
+SCORE_BIN_WIDTH = 5
+
+
+def category_columns(frame):
+    """Return the category score columns of a loaded cohort"""
+    return [column for column in frame.columns if column not in RECORD_COLUMNS]
+
+
+def grade_distribution(frame):
+    """Count submissions per grade, best grade first
+
+    Grades are free-form letters, so they are ordered by the mean overall
+    score of the submissions that received them.
+    """
+    grades = frame.dropna(subset=["grade"]).groupby("grade")["score"].agg(count="size", mean_score="mean")
+    grades["share"] = grades["count"] / grades["count"].sum()
+    return grades.sort_values("mean_score", ascending=False).reset_index()
+
+
+def score_histogram(frame, bin_width=SCORE_BIN_WIDTH):
+    """Bin overall scores into fixed-width buckets between 0 and 100"""
+    edges = np.arange(0, 100 + bin_width, bin_width)
+    counts, edges = np.histogram(frame["score"].dropna().clip(0, 100), bins=edges)
+    return pd.DataFrame({"bin_start": edges[:-1], "bin_end": edges[1:], "count": counts})
+
+
+def category_summary(frame):
+    """Mean, spread, percentiles and box-plot fences per category"""
+    columns = ["score"] + category_columns(frame)
+    scores = frame[columns]
+    summary = pd.DataFrame({
+        "count": scores.count(),
+        "mean": scores.mean(),
+        "std": scores.std(),
+        "min": scores.min(),
+        "max": scores.max(),
+    })
+    quantiles = scores.quantile(list(PERCENTILES)).T
+    quantiles.columns = [f"p{int(q * 100)}" for q in PERCENTILES]
+    summary = summary.join(quantiles)
+
+    # Tukey fences clipped to the observed range, as drawn by a box plot
+    spread = 1.5 * (summary["p75"] - summary["p25"])
+    summary["lower_fence"] = np.maximum(summary["p25"] - spread, summary["min"])
+    summary["upper_fence"] = np.minimum(summary["p75"] + spread, summary["max"])
+    summary.index.name = "category"
+    return summary.reset_index()
+
+
+def robust_z_scores(frame):
+    """Return per-column robust z-scores (median and MAD based) of the overall and category scores"""
+    columns = ["score"] + category_columns(frame)
+    scores = frame[columns]
+    median = scores.median()
+    mad = (scores - median).abs().median()
+    # A column where most scores are identical has no spread to measure deviations against
+    return MAD_SCALE * (scores - median) / mad.replace(0, np.nan)
+
+
+def outliers(frame, threshold=OUTLIER_THRESHOLD):
+    """Return submissions with any score far from the cohort median, most extreme first
+
+    Each row lists the submission, its scores, the largest absolute robust
+    z-score and the columns that crossed the threshold.
+    """
+    z = robust_z_scores(frame)
+    flagged = z.abs() > threshold
+    mask = flagged.any(axis=1)
+    if not mask.any():
+        return pd.DataFrame(columns=["submission", "grade", "max_abs_z", "flagged"])
+
+    result = frame.loc[mask, ["submission", "grade", *z.columns]].copy()
+    result["max_abs_z"] = z.loc[mask].abs().max(axis=1).round(2)
+    # Join the names of flagged columns per row without a Python loop over records
+    names = flagged.loc[mask].to_numpy() * np.array([f"{column}, " for column in z.columns], dtype=object)
+    result["flagged"] = pd.Series(names.sum(axis=1), index=result.index).str.rstrip(", ")
+    return result.sort_values("max_abs_z", ascending=False)
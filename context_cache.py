@@ -0,0 +1,118 @@
+"""Reusable Gemini cached contexts for repeated requirements text.
+
+When the same rubric is used for many chunks or many submissions, the
+requirements and the assessor preamble are registered once as a Gemini
+cached content and each request references it by name instead of
+re-sending the text. Small requirements stay inline: Gemini only accepts
+cached contents above a minimum token count. Inline requests carry the same
+preamble as a system instruction, so both paths prompt the model alike.
+
+Registrations of different requirements run concurrently; concurrent
+requests for the same requirements wait for one registration.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from chunking import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Enable or disable cached-context mode
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "1") != "0"
+
+# Requirements shorter than this (in tokens) are sent inline instead
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "4096"))
+
+# Lifetime of a registered context; entries are re-created shortly before they expire
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = 300
+
+# After a failed registration, requests go inline for this long before retrying
+CONTEXT_CACHE_RETRY_AFTER_SECONDS = 600
+
+SYSTEM_PREAMBLE = (
+    "You are an expert academic assessor. The student assignment you are asked about "
+    "is based on the assignment requirements/questions you are given."
+)
+
+
+class RequirementsContextCache:
+    """Registers requirements text as a Gemini cached content and hands out its name"""
+
+    def __init__(self, enabled=CONTEXT_CACHE_ENABLED, min_tokens=CONTEXT_CACHE_MIN_TOKENS,
+                 ttl_seconds=CONTEXT_CACHE_TTL_SECONDS):
+        """Initialize cache registry"""
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # (model, requirements hash) -> (cache name, expires_at, registered tokens)
+        self._failed_until = {}  # (model, requirements hash) -> time before which creation is not retried
+        self._key_locks = {}  # (model, requirements hash) -> lock held while that entry is registered
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        """Return (cache name, retry) for a key: a usable name, or whether registering may be tried"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] - time.time() > CONTEXT_CACHE_REFRESH_MARGIN_SECONDS:
+                return entry[0], False
+            return None, self._failed_until.get(key, 0) <= time.time()
+
+    def get(self, client, model, requirements_text, on_registered=None):
+        """Return the cached content name for these requirements, or None to send them inline
+
+        on_registered(tokens) is called when this call registered the context,
+        so callers can attribute the registration to their own analysis.
+        """
+        from google.genai import types
+
+        if not self.enabled or not requirements_text:
+            return None
+        if estimate_tokens(requirements_text) < self.min_tokens:
+            return None
+
+        key = (model, hashlib.sha256(requirements_text.encode("utf-8")).hexdigest())
+        name, retry = self._lookup(key)
+        if name or not retry:
+            return name
+
+        # The network call holds only this key's lock: other requirements are not held up,
+        # and concurrent chunks of the same requirements never register twice
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            name, retry = self._lookup(key)
+            if name or not retry:
+                return name
+
+            try:
+                cached = client.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        display_name=f"requirements-{key[1][:16]}",
+                        system_instruction=SYSTEM_PREAMBLE,
+                        contents=[types.Content(
+                            role="user",
+                            parts=[types.Part(text=f"Assignment requirements/questions:\n\n{requirements_text}")]
+                        )],
+                        ttl=f"{self.ttl_seconds}s"
+                    )
+                )
+            except Exception as e:
+                # Caching is an optimization only: fall back to inline requirements
+                logger.warning("Could not register cached requirements context: %s", e)
+                with self._lock:
+                    self._failed_until[key] = time.time() + CONTEXT_CACHE_RETRY_AFTER_SECONDS
+                return None
+
+            usage = getattr(cached, "usage_metadata", None)
+            tokens = getattr(usage, "total_token_count", None) or estimate_tokens(requirements_text)
+            with self._lock:
+                self._entries[key] = (cached.name, time.time() + self.ttl_seconds, tokens)
+        if on_registered:
+            on_registered(tokens)
+        return cached.name
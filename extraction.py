@@ -0,0 +1,250 @@
+"""Page-sharded, multi-process PDF to markdown conversion.
+
+pymupdf4llm converts a document on a single core. For long submissions the
+page list is split into contiguous shards that are converted in a process
+pool and joined back in page order, reporting progress as each shard in
+order completes.
+
+Before converting, a cheap per-page pre-scan measures each page's text layer
+and image coverage without rendering markdown. Scanned documents are routed
+to the Gemini File API without a wasted conversion. In otherwise text-based
+documents, runs of image-only pages are left out of the conversion and
+planned for transcription through the File API instead, to be merged back
+in page order.
+
+Worker functions live in this module rather than in main.py so they can be
+pickled by the process pool without importing the Streamlit script. pymupdf
+and pymupdf4llm are imported on first use, so importing this module does not
+add their load time to app start-up.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Pages converted per worker task
+PAGES_PER_SHARD = int(os.getenv("PDF_PAGES_PER_SHARD", "16"))
+
+# Number of extraction worker processes
+EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+
+# Pages with fewer extractable characters than this have no usable text layer
+MIN_TEXT_CHARS_PER_PAGE = int(os.getenv("PDF_MIN_TEXT_CHARS_PER_PAGE", "50"))
+
+# Pages whose images cover at least this fraction of the page are treated as scanned
+SCANNED_IMAGE_COVERAGE = 0.5
+
+# Documents with a larger fraction of scanned pages are sent to the File API whole
+MAX_SCANNED_FRACTION = float(os.getenv("PDF_MAX_SCANNED_FRACTION", "0.2"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Return the shared extraction process pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn rather than fork: the Streamlit server is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, EXTRACTION_WORKERS),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def page_count(file_path):
+    """Return the number of pages in a PDF"""
+    import pymupdf
+
+    with pymupdf.open(file_path) as doc:
+        return doc.page_count
+
+
+def page_ranges(total_pages, pages_per_shard=PAGES_PER_SHARD):
+    """Split a page count into contiguous (start, stop) ranges"""
+    pages_per_shard = max(1, pages_per_shard)
+    return [(start, min(start + pages_per_shard, total_pages)) for start in range(0, total_pages, pages_per_shard)]
+
+
+def convert_page_range(file_path, start, stop):
+    """Convert pages [start, stop) of a PDF to markdown"""
+    import pymupdf4llm
+
+    return pymupdf4llm.to_markdown(file_path, pages=list(range(start, stop)), show_progress=False)
+
+
+def scan_page(page):
+    """Measure a page's text layer and image coverage without rendering markdown"""
+    import pymupdf
+
+    chars = len(page.get_text("text").strip())
+    page_area = abs(page.rect) or 1.0
+    image_area = sum(abs(pymupdf.Rect(image["bbox"]) & page.rect) for image in page.get_image_info())
+    coverage = min(1.0, image_area / page_area)
+
+    if chars >= MIN_TEXT_CHARS_PER_PAGE:
+        kind = "text"
+    elif coverage >= SCANNED_IMAGE_COVERAGE:
+        kind = "scanned"
+    else:
+        kind = "blank"
+    return {"page": page.number, "chars": chars, "image_coverage": round(coverage, 3), "kind": kind}
+
+
+def scan_text_layer(file_path):
+    """Return the pre-scan statistics of every page of a PDF"""
+    import pymupdf
+
+    with pymupdf.open(file_path) as doc:
+        return [scan_page(page) for page in doc]
+
+
+def _format_pages(pages):
+    """Format 0-based page numbers as a compact 1-based list such as '3-5, 9'"""
+    spans = []
+    for number in pages:
+        if spans and spans[-1][1] == number - 1:
+            spans[-1][1] = number
+        else:
+            spans.append([number, number])
+    return ", ".join(str(a + 1) if a == b else f"{a + 1}-{b + 1}" for a, b in spans)
+
+
+def format_page_range(start, stop):
+    """Format the 0-based page range [start, stop) as 1-based page numbers such as '4-5' or '20'"""
+    return str(start + 1) if stop == start + 1 else f"{start + 1}-{stop}"
+
+
+def _page_runs(pages, scanned):
+    """Return the contiguous (start, stop) runs of scanned pages, or of the other pages"""
+    runs = []
+    for page in pages:
+        if (page["kind"] == "scanned") != scanned:
+            continue
+        if runs and runs[-1][1] == page["page"]:
+            runs[-1][1] += 1
+        else:
+            runs.append([page["page"], page["page"] + 1])
+    return [tuple(run) for run in runs]
+
+
+def plan_extraction(file_path, max_scanned_fraction=MAX_SCANNED_FRACTION):
+    """Decide whether a PDF goes to text extraction or the File API, and which pages take each route
+
+    Returns a dict with the route ("text" or "file"), the human-readable reason,
+    the (start, stop) page ranges worth converting, the scanned page ranges to
+    transcribe through the File API and the per-page scan.
+    """
+    pages = scan_text_layer(file_path)
+    total = len(pages)
+    scanned = [page["page"] for page in pages if page["kind"] == "scanned"]
+    text_pages = sum(1 for page in pages if page["kind"] == "text")
+
+    if not scanned:
+        route, reason = "text", f"All {total} pages have a text layer"
+    elif text_pages == 0:
+        route, reason = "file", f"No page has a text layer ({len(scanned)} of {total} pages are scanned images)"
+    elif len(scanned) / total > max_scanned_fraction:
+        route = "file"
+        reason = (f"{len(scanned)} of {total} pages are scanned images (pages {_format_pages(scanned)}); "
+                  "text extraction would miss too much of the document")
+    else:
+        route = "text"
+        reason = (f"Scanned pages {_format_pages(scanned)} are transcribed through the File API; "
+                  f"the other {total - len(scanned)} pages have a text layer")
+
+    return {
+        "route": route,
+        "reason": reason,
+        "ranges": _page_runs(pages, scanned=False) if route == "text" else [],
+        "scanned_ranges": _page_runs(pages, scanned=True) if route == "text" else [],
+        "total_pages": total,
+        "scanned_pages": len(scanned),
+        "pages": pages
+    }
+
+
+def iter_markdown_shards(file_path, pages_per_shard=PAGES_PER_SHARD, ranges=None):
+    """Yield (pages_done, pages_total, markdown) per shard, in page order, as shards finish
+
+    ranges optionally restricts conversion to (start, stop) page spans; by
+    default the whole document is converted.
+    """
+    if ranges is None:
+        total_pages = page_count(file_path)
+        shards = page_ranges(total_pages, pages_per_shard)
+        whole_document = True
+    else:
+        shards = [
+            (start + shard_start, start + shard_stop)
+            for start, stop in ranges
+            for shard_start, shard_stop in page_ranges(stop - start, pages_per_shard)
+        ]
+        total_pages = sum(stop - start for start, stop in shards)
+        whole_document = False
+
+    if not shards:
+        return
+
+    # A single shard is cheaper to convert in-process than to ship to a worker
+    if len(shards) == 1:
+        start, stop = shards[0]
+        if whole_document:
+            import pymupdf4llm
+
+            markdown = pymupdf4llm.to_markdown(file_path, show_progress=False)
+        else:
+            markdown = convert_page_range(file_path, start, stop)
+        yield total_pages, total_pages, markdown
+        return
+
+    futures = [_get_pool().submit(convert_page_range, file_path, start, stop) for start, stop in shards]
+    try:
+        # Results are consumed in submission order so the stream stays page-ordered,
+        # while later shards keep converting in the background
+        done = 0
+        for (start, stop), future in zip(shards, futures):
+            done += stop - start
+            yield done, total_pages, future.result()
+    finally:
+        # Abandoned or failed streams should not leave queued shards running
+        for future in futures:
+            future.cancel()
+
+
+def convert_ranges_to_markdown(file_path, ranges, pages_per_shard=PAGES_PER_SHARD, on_progress=None):
+    """Convert each (start, stop) page range of a PDF to markdown using the shard pool; one string per range"""
+    parts = [[] for _ in ranges]
+    range_index = 0
+    converted = 0
+    for done, total, markdown in iter_markdown_shards(file_path, pages_per_shard, ranges):
+        # Shards are yielded range by range, so the pages done so far place each one
+        while done > converted + ranges[range_index][1] - ranges[range_index][0]:
+            converted += ranges[range_index][1] - ranges[range_index][0]
+            range_index += 1
+        parts[range_index].append(markdown)
+        if on_progress:
+            on_progress(done, total)
+    return ["\n".join(part) for part in parts]
+
+
+def write_page_range(file_path, start, stop, out_path):
+    """Write pages [start, stop) of a PDF to a new PDF file"""
+    import pymupdf
+
+    with pymupdf.open(file_path) as doc, pymupdf.open() as pages:
+        pages.insert_pdf(doc, from_page=start, to_page=stop - 1)
+        pages.save(out_path)
+
+
+def convert_to_markdown_parallel(file_path, pages_per_shard=PAGES_PER_SHARD, on_progress=None, ranges=None):
+    """Convert a PDF, or the given page ranges of it, to markdown using the shard pool and join the result"""
+    parts = []
+    for done, total, markdown in iter_markdown_shards(file_path, pages_per_shard, ranges):
+        parts.append(markdown)
+        if on_progress:
+            on_progress(done, total)
+    return "\n".join(parts)
@@ -0,0 +1,108 @@
+"""Typed feedback schema and tolerant parsing of model feedback.
+
+The schema is passed to Gemini as the response schema, so feedback calls
+return plain JSON in a fixed shape instead of prose with a ```json fence.
+Responses that are still not valid JSON (a stray fence, trailing commas,
+typographic quotes, output cut off mid-document) are repaired before
+validation, so a near-miss does not throw away a whole analysis.
+"""
+
+import json
+import re
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+from json_stream import IncrementalJSONParser
+
+FENCED_JSON = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL)
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"'})
+
+
+class FeedbackFormatError(ValueError):
+    """Raised when a response cannot be turned into valid feedback data"""
+
+
+def _round_score(value):
+    """Accept scores written as floats or numeric strings"""
+    if isinstance(value, str):
+        value = value.strip().rstrip("%")
+    try:
+        return round(float(value))
+    except (TypeError, ValueError):
+        return value
+
+
+class CategoryScores(BaseModel):
+    """Per-category scores between 0 and 100"""
+
+    Content: int
+    Structure: int
+    Analysis: int
+    Language: int
+    References: int
+
+    _round = field_validator("*", mode="before")(_round_score)
+
+
+class Feedback(BaseModel):
+    """Assessment returned by the short-document, final and File API prompts"""
+
+    title: str
+    grade: str
+    score: int
+    summary: str
+    strengths: list[str]
+    areas_for_improvement: list[str]
+    detailed_feedback: str
+    category_scores: CategoryScores
+
+    _round = field_validator("score", mode="before")(_round_score)
+
+
+def repair_json(text):
+    """Parse near-valid JSON, trying progressively more aggressive fixes"""
+    fenced = FENCED_JSON.search(text)
+    candidate = fenced.group(1) if fenced else text
+
+    start = candidate.find("{")
+    if start < 0:
+        raise FeedbackFormatError("Response contains no JSON object")
+    end = candidate.rfind("}")
+    body = candidate[start:end + 1] if end > start else candidate[start:]
+
+    attempts = [
+        body,
+        TRAILING_COMMA.sub(r"\1", body),
+        TRAILING_COMMA.sub(r"\1", body.translate(SMART_QUOTES)),
+    ]
+    for attempt in attempts:
+        try:
+            return json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+
+    # Truncated output: close open strings and brackets and keep what was written
+    parser = IncrementalJSONParser()
+    parser.feed(attempts[-1])
+    if parser.value is None:
+        raise FeedbackFormatError("Response JSON could not be repaired")
+    return parser.value
+
+
+def parse_feedback(text):
+    """Parse, repair if needed, and validate a feedback response; returns a plain dict"""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = repair_json(text)
+    return validate_feedback(data)
+
+
+def validate_feedback(data):
+    """Validate feedback data against the schema, raising FeedbackFormatError with the problems found"""
+    try:
+        return Feedback.model_validate(data).model_dump()
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(str(p) for p in error['loc'])}: {error['msg']}" for error in e.errors())
+        raise FeedbackFormatError(f"Feedback does not match the schema: {problems}") from e
@@ -0,0 +1,135 @@
+"""Persistent store of graded feedback for cohort analytics.
+
+Every completed analysis, from the app or from batch.py, is recorded here with
+its cohort, grade, overall score and category scores. Scores are kept in a
+narrow (record, category, score) table so custom assessment categories need
+no schema change; the dashboard pivots them into one column per category
+when it loads a cohort as a pandas DataFrame.
+"""
+
+import os
+import pathlib
+import sqlite3
+import time
+from contextlib import contextmanager
+
+FEEDBACK_STORE_PATH = os.getenv("FEEDBACK_STORE_PATH", ".cache/feedback.sqlite3")
+
+# Records are written in groups of this size when importing many at once
+IMPORT_BATCH_SIZE = 500
+
+
+class FeedbackStore:
+    """SQLite-backed store of feedback records and their category scores"""
+
+    def __init__(self, path=FEEDBACK_STORE_PATH):
+        """Initialize store and create the database if needed"""
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS feedback (
+                    id INTEGER PRIMARY KEY,
+                    cohort TEXT NOT NULL,
+                    record_key TEXT NOT NULL,
+                    submission TEXT,
+                    source TEXT NOT NULL,
+                    grade TEXT,
+                    score REAL,
+                    graded_at REAL NOT NULL,
+                    UNIQUE (cohort, record_key)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS scores (
+                    record_id INTEGER NOT NULL REFERENCES feedback (id) ON DELETE CASCADE,
+                    category TEXT NOT NULL,
+                    score REAL,
+                    PRIMARY KEY (record_id, category)
+                ) WITHOUT ROWID"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection; one per call keeps the store safe to share across threads"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA foreign_keys=ON")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _write(conn, record_key, feedback, cohort, submission, source, graded_at):
+        """Insert or replace one record and its category scores"""
+        record_id = conn.execute(
+            "INSERT INTO feedback (cohort, record_key, submission, source, grade, score, graded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (cohort, record_key) DO UPDATE SET submission = excluded.submission, "
+            "source = excluded.source, grade = excluded.grade, score = excluded.score, graded_at = excluded.graded_at "
+            "RETURNING id",
+            (cohort or "", record_key, submission, source, feedback.get("grade"), feedback.get("score"),
+             graded_at or time.time())
+        ).fetchone()[0]
+        conn.execute("DELETE FROM scores WHERE record_id = ?", (record_id,))
+        conn.executemany(
+            "INSERT INTO scores (record_id, category, score) VALUES (?, ?, ?)",
+            [(record_id, category, score) for category, score in (feedback.get("category_scores") or {}).items()]
+        )
+
+    def add(self, record_key, feedback, cohort=None, submission=None, source="app", graded_at=None):
+        """Record the feedback for one submission; re-grading the same key in a cohort replaces it"""
+        with self._connect() as conn:
+            self._write(conn, record_key, feedback, cohort, submission, source, graded_at)
+
+    def add_many(self, records):
+        """Record many (record_key, feedback, cohort, submission, source, graded_at) tuples in few transactions"""
+        records = list(records)
+        for start in range(0, len(records), IMPORT_BATCH_SIZE):
+            with self._connect() as conn:
+                for record in records[start:start + IMPORT_BATCH_SIZE]:
+                    self._write(conn, *record)
+        return len(records)
+
+    def cohorts(self):
+        """Return (cohort, record count) pairs, largest cohort first"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT cohort, COUNT(*) FROM feedback GROUP BY cohort ORDER BY COUNT(*) DESC, cohort"
+            ).fetchall()
+
+    def version(self, cohort=None):
+        """Return a cheap fingerprint of a cohort's contents, for invalidating derived results"""
+        query = "SELECT COUNT(*), MAX(graded_at), MAX(id) FROM feedback"
+        params = ()
+        if cohort is not None:
+            query += " WHERE cohort = ?"
+            params = (cohort,)
+        with self._connect() as conn:
+            return tuple(conn.execute(query, params).fetchone())
+
+    def load(self, cohort=None):
+        """Load a cohort, or every record, as a DataFrame with one column per category"""
+        import pandas as pd
+
+        where, params = ("WHERE f.cohort = ?", (cohort,)) if cohort is not None else ("", ())
+        with self._connect() as conn:
+            records = pd.read_sql_query(
+                f"SELECT f.id, f.cohort, f.submission, f.source, f.grade, f.score, f.graded_at "
+                f"FROM feedback f {where} ORDER BY f.id",
+                conn, params=params, index_col="id"
+            )
+            scores = pd.read_sql_query(
+                f"SELECT s.record_id, s.category, s.score FROM scores s JOIN feedback f ON f.id = s.record_id {where}",
+                conn, params=params
+            )
+
+        records["graded_at"] = pd.to_datetime(records["graded_at"], unit="s", utc=True)
+        if scores.empty:
+            return records
+        wide = scores.pivot(index="record_id", columns="category", values="score")
+        wide.columns.name = None
+        return records.join(wide)
@@ -0,0 +1,177 @@
+"""Reuse and lifecycle management for Gemini File API uploads.
+
+Scanned submissions are analyzed by uploading the whole PDF, which is the
+slowest request the app makes. The registry maps a PDF's content hash to the
+uploaded file's URI and expiry, so re-analyzing the same bytes references the
+existing upload instead of sending them again. Uploads that have not been
+used for a while are deleted from the File API by a background sweep rather
+than being left to pile up until they expire.
+"""
+
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_REGISTRY_PATH = os.getenv("FILE_UPLOAD_REGISTRY_PATH", ".cache/uploads.sqlite3")
+
+# Uploads not referenced for this long are deleted by the cleanup sweep
+UPLOAD_IDLE_SECONDS = int(os.getenv("FILE_UPLOAD_IDLE_SECONDS", str(6 * 3600)))
+
+# Seconds between background cleanup sweeps
+UPLOAD_CLEANUP_INTERVAL_SECONDS = 900
+
+# The File API keeps uploads for 48 hours; used when the response carries no expiry
+UPLOAD_DEFAULT_TTL_SECONDS = 48 * 3600
+
+# Uploads closer than this to their expiry are not reused
+UPLOAD_REFRESH_MARGIN_SECONDS = 600
+
+
+class FileUploadRegistry:
+    """SQLite-backed map from PDF content hash to a live File API upload"""
+
+    def __init__(self, path=UPLOAD_REGISTRY_PATH, idle_seconds=UPLOAD_IDLE_SECONDS):
+        """Initialize registry"""
+        self.path = pathlib.Path(path)
+        self.idle_seconds = idle_seconds
+        self._locks = {}  # content hash -> lock held while uploading it
+        self._locks_guard = threading.Lock()
+        self._cleanup_thread = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS uploads (
+                    content_hash TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    uri TEXT NOT NULL,
+                    mime_type TEXT,
+                    expires_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection; one per call keeps the registry safe to share across threads"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lock(self, content_hash):
+        """Return the lock serializing uploads of one content hash"""
+        with self._locks_guard:
+            return self._locks.setdefault(content_hash, threading.Lock())
+
+    def get(self, content_hash):
+        """Return a Part referencing the live upload for this hash, or None if it must be uploaded"""
+        from google.genai import types
+
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT uri, mime_type FROM uploads WHERE content_hash = ? AND expires_at > ?",
+                (content_hash, now + UPLOAD_REFRESH_MARGIN_SECONDS)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE uploads SET used_at = ? WHERE content_hash = ?", (now, content_hash))
+        return types.Part.from_uri(file_uri=row["uri"], mime_type=row["mime_type"])
+
+    def register(self, content_hash, uploaded_file):
+        """Record a fresh upload and return a Part referencing it"""
+        from google.genai import types
+
+        now = time.time()
+        expiration = getattr(uploaded_file, "expiration_time", None)
+        expires_at = expiration.timestamp() if expiration else now + UPLOAD_DEFAULT_TTL_SECONDS
+        mime_type = getattr(uploaded_file, "mime_type", None) or "application/pdf"
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (content_hash, name, uri, mime_type, expires_at, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, uploaded_file.name, uploaded_file.uri, mime_type, expires_at, now, now)
+            )
+        return types.Part.from_uri(file_uri=uploaded_file.uri, mime_type=mime_type)
+
+    def invalidate(self, content_hash, name=None):
+        """Forget the upload for this hash, e.g. after the File API reported it missing; with a name, only that upload"""
+        with self._connect() as conn:
+            if name is None:
+                conn.execute("DELETE FROM uploads WHERE content_hash = ?", (content_hash,))
+            else:
+                conn.execute("DELETE FROM uploads WHERE content_hash = ? AND name = ?", (content_hash, name))
+
+    def _is_stale(self, content_hash, name, now):
+        """Check whether this upload is still registered for the hash and still idle or expired"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM uploads WHERE content_hash = ? AND name = ? AND (used_at < ? OR expires_at < ?)",
+                (content_hash, name, now - self.idle_seconds, now)
+            ).fetchone()
+        return row is not None
+
+    def cleanup(self, client):
+        """Delete idle uploads from the File API and drop expired entries; return how many were removed
+
+        client may also be a function returning the client, called only when
+        there is an upload to delete.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT content_hash, name, expires_at FROM uploads WHERE used_at < ? OR expires_at < ?",
+                (now - self.idle_seconds, now)
+            ).fetchall()
+
+        if rows and callable(client):
+            client = client()
+
+        removed = 0
+        for row in rows:
+            # Under the upload lock, so an entry re-registered or reused since the query above is kept
+            with self.lock(row["content_hash"]):
+                if not self._is_stale(row["content_hash"], row["name"], now):
+                    continue
+                if row["expires_at"] > now:
+                    try:
+                        client.files.delete(name=row["name"])
+                    except Exception as e:
+                        # Already gone on the server side, or a transient error: retried on the next sweep
+                        logger.warning("Could not delete uploaded file %s: %s", row["name"], e)
+                        if getattr(e, "code", None) != 404:
+                            continue
+                self.invalidate(row["content_hash"], row["name"])
+                removed += 1
+        return removed
+
+    def start_cleanup(self, client, interval=UPLOAD_CLEANUP_INTERVAL_SECONDS):
+        """Run cleanup periodically on a daemon thread"""
+        if self._cleanup_thread is not None:
+            return self
+
+        def loop():
+            while True:
+                try:
+                    removed = self.cleanup(client)
+                    if removed:
+                        logger.info("Removed %d stale File API uploads", removed)
+                except Exception as e:
+                    logger.warning("Upload cleanup failed: %s", e)
+                time.sleep(interval)
+
+        self._cleanup_thread = threading.Thread(target=loop, name="upload-cleanup", daemon=True)
+        self._cleanup_thread.start()
+        return self
@@ -0,0 +1,301 @@
+"""Durable background job queue for long-running analyses.
+
+Jobs are stored in a job store (SQLite by default) and executed by a pool of
+worker threads, so an analysis keeps running when the Streamlit script reruns
+or the browser disconnects. Each job has an ID the UI can poll for status, per-chunk
+progress, partial output and the final result. A running job holds a lease
+that a heartbeat thread renews for as long as its handler runs; a job whose
+lease expires (because its process died or stalled) is picked up again by
+any worker. Every claim has its own owner token, and progress and the final
+result are only recorded by the current lease owner, so a worker that lost
+its lease cannot overwrite the job.
+
+When several replicas share a job store, a job can be pinned to the replica
+that submitted it, for work that reads files only that replica has.
+"""
+
+import json
+import logging
+import os
+import pathlib
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", ".cache/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+# Identifies this replica to pinned jobs; processes on one host share its local files, so the host name by default
+REPLICA_ID = os.getenv("REPLICA_ID") or socket.gethostname()
+
+# Seconds a running job may go without a heartbeat before another worker reclaims it
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+# Seconds between lease renewals of a running job
+JOB_HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 4
+
+# Seconds an idle worker waits before polling the queue again
+JOB_POLL_SECONDS = 1.0
+
+# Finished jobs older than this are deleted
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Statuses of jobs that are still useful to attach to instead of submitting again
+ACTIVE_STATUSES = ("queued", "running", "done")
+
+
+class JobReporter:
+    """Handle passed to job handlers for reporting progress and partial output"""
+
+    def __init__(self, queue, job_id, owner):
+        """Initialize reporter for one claim of a job"""
+        self.queue = queue
+        self.job_id = job_id
+        self.owner = owner
+        self.partial = {}
+
+    def progress(self, done, total):
+        """Record per-step progress and renew the job's lease"""
+        self.queue._update(self.job_id, self.owner, progress_done=done, progress_total=total)
+
+    def update_partial(self, **fields):
+        """Merge fields into the job's partial output and persist it"""
+        self.partial.update(fields)
+        self.queue._update(self.job_id, self.owner, partial=json.dumps(self.partial, ensure_ascii=False))
+
+
+class SQLiteJobStore:
+    """Job records in a SQLite database, shared by every process that opens the same file"""
+
+    def __init__(self, path=JOBS_DB_PATH):
+        """Initialize store and create the database if needed"""
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    dedupe_key TEXT,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    progress_done INTEGER NOT NULL DEFAULT 0,
+                    progress_total INTEGER NOT NULL DEFAULT 0,
+                    partial TEXT,
+                    result TEXT,
+                    usage TEXT,
+                    error TEXT,
+                    lease_until REAL,
+                    lease_owner TEXT,
+                    replica TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            # Databases created before lease owners and pinned replicas were recorded
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("lease_owner", "replica"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key)")
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection; one per call keeps the store safe to share across threads"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def find_active(self, dedupe_key):
+        """Return the ID of the newest job with this dedupe key that is still worth attaching to"""
+        placeholders = ", ".join("?" for _ in ACTIVE_STATUSES)
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ({placeholders}) ORDER BY created_at DESC LIMIT 1",
+                (dedupe_key, *ACTIVE_STATUSES)
+            ).fetchone()
+        return row["id"] if row else None
+
+    def insert(self, job_id, kind, dedupe_key, payload, now, replica=None):
+        """Add a queued job with a JSON-encoded payload, optionally pinned to a replica, and delete finished jobs past retention"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, dedupe_key, status, payload, replica, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, dedupe_key, payload, replica, now, now)
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (now - JOB_RETENTION_SECONDS,)
+            )
+
+    def get(self, job_id):
+        """Return a job's columns, with JSON fields still encoded, or None if unknown"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, now, lease_seconds, owner, replica=REPLICA_ID):
+        """Atomically take the oldest queued job, or a running job whose lease expired, under an owner token
+
+        Jobs pinned to another replica are left for that replica.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """SELECT id, kind, payload FROM jobs
+                   WHERE (status = 'queued' OR (status = 'running' AND lease_until < ?))
+                     AND (replica IS NULL OR replica = ?)
+                   ORDER BY created_at LIMIT 1""",
+                (now, replica)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', lease_until = ?, lease_owner = ?, updated_at = ? WHERE id = ?",
+                (now + lease_seconds, owner, now, row["id"])
+            )
+            return row["id"], row["kind"], row["payload"]
+
+    def update(self, job_id, fields, owner=None):
+        """Set job columns; with an owner, only while that claim still holds the lease. Return whether it was set"""
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        condition = "id = ?" if owner is None else "id = ? AND lease_owner = ?"
+        params = (job_id,) if owner is None else (job_id, owner)
+        with self._connect() as conn:
+            cursor = conn.execute(f"UPDATE jobs SET {assignments} WHERE {condition}", (*fields.values(), *params))
+            return cursor.rowcount > 0
+
+
+class JobQueue:
+    """Job queue with an in-process worker pool over a job store
+    
+    The store is SQLite by default; a shared store (see shared_state.py) lets
+    the workers of several processes or replicas drain one queue.
+    """
+
+    def __init__(self, handlers, path=JOBS_DB_PATH, workers=JOB_WORKERS, store=None, replica=REPLICA_ID):
+        """Initialize queue; handlers maps a job kind to fn(payload, reporter) -> (result, usage)"""
+        self.handlers = handlers
+        self.store = store or SQLiteJobStore(path)
+        self.workers = max(1, workers)
+        self.replica = replica
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, kind, payload, dedupe_key=None, pinned=False):
+        """Queue a job and return its ID, reusing an existing job with the same dedupe key
+
+        A pinned job only runs on this replica, for jobs that read local files.
+        """
+        if dedupe_key:
+            job_id = self.store.find_active(dedupe_key)
+            if job_id:
+                return job_id
+
+        job_id = uuid.uuid4().hex
+        self.store.insert(
+            job_id, kind, dedupe_key, json.dumps(payload, ensure_ascii=False), time.time(),
+            self.replica if pinned else None
+        )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Return a job's status, progress, partial output and result, or None if unknown"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        for field in ("payload", "partial", "result", "usage"):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def _claim(self):
+        """Take the next job to run under a new owner token, decoding its payload"""
+        owner = uuid.uuid4().hex
+        claimed = self.store.claim(time.time(), JOB_LEASE_SECONDS, owner, self.replica)
+        if claimed is None:
+            return None
+        job_id, kind, payload = claimed
+        return job_id, owner, kind, json.loads(payload)
+
+    def _update(self, job_id, owner, **fields):
+        """Update job columns and renew its lease if the claim still owns it; return whether it did"""
+        now = time.time()
+        fields["updated_at"] = now
+        if "status" not in fields:
+            fields["lease_until"] = now + JOB_LEASE_SECONDS
+        return self.store.update(job_id, fields, owner)
+
+    def _heartbeat(self, job_id, owner, stop):
+        """Renew a running job's lease until stop is set or the lease is lost"""
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                if not self.store.update(job_id, {"lease_until": time.time() + JOB_LEASE_SECONDS}, owner):
+                    logger.warning("Job %s lost its lease to another worker", job_id)
+                    return
+            except Exception as e:
+                logger.warning("Could not renew lease of job %s: %s", job_id, e)
+
+    def _run(self, job_id, owner, kind, payload):
+        """Run a claimed job's handler with its lease kept alive and record the outcome"""
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job_id, owner, stop), name=f"job-heartbeat-{job_id[:8]}", daemon=True
+        )
+        heartbeat.start()
+        try:
+            result, usage = self.handlers[kind](payload, JobReporter(self, job_id, owner))
+            fields = {
+                "status": "done",
+                "result": json.dumps(result, ensure_ascii=False),
+                "usage": json.dumps(usage) if usage is not None else None
+            }
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            fields = {"status": "failed", "error": str(e)}
+        finally:
+            stop.set()
+        heartbeat.join()
+
+        if not self._update(job_id, owner, lease_until=None, lease_owner=None, **fields):
+            logger.warning("Job %s was reclaimed by another worker; discarding this run's outcome", job_id)
+
+    def _worker_loop(self):
+        """Claim and run jobs until the process exits"""
+        while True:
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                logger.warning("Could not claim job: %s", e)
+                claimed = None
+
+            if claimed is None:
+                self._wakeup.wait(JOB_POLL_SECONDS)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._run(*claimed)
+            except Exception as e:
+                logger.warning("Could not record outcome of job %s: %s", claimed[0], e)
@@ -0,0 +1,127 @@
+"""Incremental parsing of JSON that is still being streamed from the model.
+
+The parser is fed text deltas as they arrive. It tracks string and bracket
+state incrementally, so at any point it can close the open document and
+return the best-effort value parsed so far: completed fields, lists with the
+items received so far, and strings that are still being written. Text
+before the first "{" (such as a ```json fence) and after the matching "}"
+is ignored.
+"""
+
+import json
+
+# Trailing characters that cannot end a valid value and are dropped before closing
+DANGLING = " \t\r\n,:"
+
+
+class _ScanState:
+    """String/bracket state of a scanned JSON prefix"""
+
+    def __init__(self):
+        """Initialize state for an empty prefix"""
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+
+    def advance(self, text):
+        """Scan text; return the offset just past the top-level closing bracket, or None"""
+        for offset, ch in enumerate(text):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.stack.append("}" if ch == "{" else "]")
+            elif ch in "}]" and self.stack:
+                self.stack.pop()
+                if not self.stack:
+                    return offset + 1
+        return None
+
+    def close(self, text):
+        """Return text with any open string and brackets closed"""
+        if self.in_string:
+            if self.escape:
+                text = text[:-1]
+            return text + '"' + "".join(reversed(self.stack))
+        return text.rstrip(DANGLING) + "".join(reversed(self.stack))
+
+
+class IncrementalJSONParser:
+    """Accumulates streamed JSON text and exposes the partially parsed value"""
+
+    def __init__(self):
+        """Initialize empty parser state"""
+        self.text = ""
+        self.value = None
+        self._start = None  # offset of the opening "{"
+        self._end = None  # offset just past the matching "}"
+        self._scanned = 0
+        self._state = _ScanState()
+
+    @property
+    def complete(self):
+        """Whether the top-level object has been closed"""
+        return self._end is not None
+
+    def feed(self, delta):
+        """Add a text delta; return the updated partial value if it changed, else None"""
+        self.text += delta
+        if self.complete:
+            return None
+
+        if self._start is None:
+            start = self.text.find("{", self._scanned)
+            if start < 0:
+                self._scanned = len(self.text)
+                return None
+            self._start = self._scanned = start
+
+        end = self._state.advance(self.text[self._scanned:])
+        if end is not None:
+            self._end = self._scanned + end
+        self._scanned = len(self.text) if end is None else self._end
+
+        partial = self._parse_partial()
+        if partial is not None and partial != self.value:
+            self.value = partial
+            return partial
+        return None
+
+    def _parse_partial(self):
+        """Parse the document so far, backing off to the last complete member if needed"""
+        body = self.text[self._start:self._end]
+        if self.complete:
+            try:
+                return json.loads(body)
+            except json.JSONDecodeError:
+                return None
+
+        try:
+            return json.loads(self._state.close(body))
+        except json.JSONDecodeError:
+            pass
+
+        # A key or literal is only half written: drop the incomplete member. The
+        # candidate is re-scanned from scratch, which only happens on this slow path.
+        cut = max(body.rfind(","), body.rfind("{"), body.rfind("["))
+        while cut > 0:
+            candidate = body[:cut + 1] if body[cut] in "{[" else body[:cut]
+            state = _ScanState()
+            state.advance(candidate)
+            try:
+                return json.loads(state.close(candidate))
+            except json.JSONDecodeError:
+                cut = max(body.rfind(",", 0, cut), body.rfind("{", 0, cut), body.rfind("[", 0, cut))
+        return None
+
+    def result(self):
+        """Parse the complete document, raising json.JSONDecodeError if it is invalid"""
+        if self._start is None:
+            raise json.JSONDecodeError("No JSON object in response", self.text, 0)
+        return json.loads(self.text[self._start:self._end])
@@ -1,195 +1,1239 @@
 import streamlit as st
 import os
-import tempfile
 import time
-import pymupdf4llm
-import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.express as px
-import plotly.graph_objects as go
-import re
-import io
-import json
 import pathlib
-import httpx
-from google import genai
+import hashlib
+import json
+import threading
+import asyncio
+import contextvars
+import tempfile
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from backends import create_client, requires_api_key
+from cache import hash_bytes, hash_file, make_key
+from chunking import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, STABLE_BOUNDARIES, estimate_tokens, iter_chunks
+from context_cache import SYSTEM_PREAMBLE, RequirementsContextCache
+from file_uploads import FileUploadRegistry
+from feedback_store import FeedbackStore
+from revisions import RevisionStore, feedback_changes
+from temp_files import TempFileManager
+from speculation import SPECULATIVE_ANALYSIS_ENABLED, SpeculationRegistry
+from tracing import Tracer, current_span, span, use as use_tracer
+from rate_limit import call_with_retries, call_with_retries_async, get_shared_limiter
+from routing import get_shared_router, routing_fingerprint, stage_fingerprint
+from json_stream import IncrementalJSONParser
+from jobs import JobQueue
+from shared_state import get_shared_backend
+from extraction import (
+    MAX_SCANNED_FRACTION, MIN_TEXT_CHARS_PER_PAGE, convert_ranges_to_markdown, convert_to_markdown_parallel,
+    format_page_range, plan_extraction, write_page_range
+)
+
 # Import prompts from separate file
 from assets.prompt import (
     LONG_CHUNK_ANALYSIS_PROMPT, 
     SHORT_DOCUMENT_ANALYSIS_PROMPT,
+    GROUP_SUMMARY_PROMPT,
     FINAL_ASSESSMENT_PROMPT,
-    FILE_API_ANALYSIS_PROMPT
+    FILE_API_ANALYSIS_PROMPT,
+    PAGE_TRANSCRIPTION_PROMPT
 )
 
 # Load environment variables
 load_dotenv()
 
+# HTTP connections kept open to the Gemini API by the shared client
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "32"))
+
+# Maximum number of chunk analysis requests in flight at once
+MAX_CONCURRENT_CHUNKS = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+
+# Stream model output and render feedback progressively while it is generated
+STREAMING_ENABLED = os.getenv("GEMINI_STREAMING", "1") != "0"
+
+# Constrain feedback calls to the typed feedback schema instead of prompting for a ```json block
+STRUCTURED_OUTPUT_ENABLED = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1") != "0"
+
+# Regenerations of the final step after its response fails to parse
+FEEDBACK_REPAIR_ATTEMPTS = 1
+
+# Seconds between attempts to take an upload lock held by another analysis
+UPLOAD_LOCK_POLL_SECONDS = 0.05
+
+# Minimum seconds between progressive re-renders of streamed feedback
+STREAM_RENDER_INTERVAL = 0.25
+
+# Run analyses as durable background jobs instead of inline in the script thread
+BACKGROUND_JOBS_ENABLED = os.getenv("ANALYSIS_BACKGROUND_JOBS", "1") != "0"
+
+# Seconds between status polls while a background analysis is running
+JOB_POLL_INTERVAL = 1.0
+
+# Documents longer than this many model tokens are analyzed in chunks
+LONG_DOCUMENT_TOKENS = int(os.getenv("LONG_DOCUMENT_TOKENS", "30000"))
+
+# Chunk summaries are merged level by level until they fit this many tokens
+REDUCE_TARGET_TOKENS = int(os.getenv("GEMINI_REDUCE_TARGET_TOKENS", "24000"))
+
+# Number of consecutive summaries merged by one call at each reduce level
+REDUCE_GROUP_SIZE = max(2, int(os.getenv("GEMINI_REDUCE_GROUP_SIZE", "8")))
+
+# Map chunks without the requirements, which are then applied by the reduce and final
+# stages; chunk summaries become reusable across requirements, including speculative ones
+REQUIREMENT_NEUTRAL_MAP = os.getenv("GEMINI_REQUIREMENT_NEUTRAL_MAP", "0") == "1"
+
+# Distinct reports whose prepared charts are kept in memory
+REPORT_CACHE_ENTRIES = int(os.getenv("REPORT_CACHE_ENTRIES", "64"))
+
+# Fingerprint of the prompt templates, so cached feedback is invalidated when prompts change
+PROMPT_FINGERPRINT = hashlib.sha256("".join([
+    SYSTEM_PREAMBLE,
+    LONG_CHUNK_ANALYSIS_PROMPT,
+    SHORT_DOCUMENT_ANALYSIS_PROMPT,
+    GROUP_SUMMARY_PROMPT,
+    FINAL_ASSESSMENT_PROMPT,
+    FILE_API_ANALYSIS_PROMPT
+]).encode("utf-8")).hexdigest()
+
+
+@st.cache_resource
+def get_result_cache():
+    """Return the result cache shared by all sessions and, through the shared backend, all replicas"""
+    return get_shared_backend().result_cache()
+
+
+def get_api_key():
+    """Return the Gemini API key, stopping the app with an error if none is configured"""
+    if not requires_api_key():
+        return ""
+    api_key = os.getenv("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY", None)
+    if not api_key:
+        st.error("No Gemini API key found. Please set it in .env file or Streamlit secrets.")
+        st.stop()
+    return api_key
+
+
+@st.cache_resource
+def get_gemini_client(api_key):
+    """Return one Gemini client per API key, shared by all sessions and reruns.
+    
+    Reusing the client keeps its HTTP connection pool warm, so concurrent sessions
+    share keep-alive connections instead of doing a TLS handshake per interaction.
+    """
+    # MODEL_BACKEND=fake swaps in a local deterministic client that needs no key
+    return create_client(api_key=api_key, max_connections=GEMINI_MAX_CONNECTIONS)
+
+
+@st.cache_resource
+def get_context_cache():
+    """Return the process-wide registry of cached requirements contexts"""
+    return RequirementsContextCache()
+
+
+@st.cache_resource
+def get_upload_registry(api_key):
+    """Return the process-wide File API upload registry with its cleanup sweep started"""
+    # The sweep only creates the client once it has an upload to delete
+    return FileUploadRegistry().start_cleanup(lambda: get_gemini_client(api_key))
+
+
+@st.cache_resource(max_entries=REPORT_CACHE_ENTRIES, show_spinner=False)
+def get_report_views(feedback_key, _feedback_data):
+    """Return the prepared charts and exports of a report, built once per feedback content hash
+    
+    A resource cache hands back the prepared figures themselves; a data cache would
+    copy them through pickle on every hit, which costs more than building them.
+    """
+    return ReportGenerator.prepare_views(_feedback_data)
+
+
+def current_session_id():
+    """Return the ID of the Streamlit session running this script"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "headless"
+
+
+def is_active_session(session_id):
+    """Check whether a Streamlit session is still connected"""
+    from streamlit.runtime import Runtime
+    
+    # Owners that are not sessions, and scripts run without a server, count as alive
+    if not Runtime.exists():
+        return True
+    return Runtime.instance().is_active_session(session_id.split("/")[0])
+
+
+@st.cache_resource
+def get_temp_files():
+    """Return the process-wide manager of uploaded files on disk with its cleanup sweep started"""
+    return TempFileManager().start_cleanup(is_active=is_active_session)
+
+
+@st.cache_resource
+def get_revision_store():
+    """Return the store of graded revisions shared by every session"""
+    return RevisionStore()
+
+
+@st.cache_resource
+def get_speculation():
+    """Return the process-wide registry of speculative chunk analyses"""
+    return SpeculationRegistry()
+
+
+@st.cache_resource
+def get_feedback_store():
+    """Return the process-wide store of graded feedback used by the cohort dashboard"""
+    return FeedbackStore()
+
+
+@st.cache_resource
+def get_job_queue(api_key):
+    """Return the process-wide background job queue with its worker pool started"""
+    context_cache = get_context_cache()
+    result_cache = get_result_cache()
+    upload_registry = get_upload_registry(api_key)
+    speculation = get_speculation()
+    revisions = get_revision_store()
+    feedback_store = get_feedback_store()
+    
+    def run_analysis(payload, reporter):
+        # A processor per job keeps token accounting separate for each analysis
+        gemini = GeminiProcessor(
+            client=get_gemini_client(api_key), context_cache=context_cache, result_cache=result_cache,
+            upload_registry=upload_registry, speculation=speculation, revisions=revisions
+        )
+        tracer = Tracer()
+        details = {}
+        with use_tracer(tracer):
+            feedback_data = gemini.run_analysis_job(payload, reporter, details)
+        
+        # Spans travel back with the usage so the session can merge them into its trace
+        usage = {**gemini.token_savings(), **details}
+        usage["spans"] = tracer.spans
+        
+        # Recorded here rather than by the session, which may have reconnected without the submission's details
+        try:
+            feedback_store.add(
+                payload["analysis_key"], feedback_data,
+                cohort=payload.get("cohort", ""), submission=payload.get("submission")
+            )
+        except Exception as e:
+            # Analytics are secondary: a store failure must not fail the analysis
+            usage["feedback_store_error"] = str(e)
+        return feedback_data, usage
+    
+    # Jobs live in the shared backend, so any replica can report on them and every replica's workers run them
+    return JobQueue({"analysis": run_analysis}, store=get_shared_backend().job_store()).start()
+
+
+class FeedbackParseError(Exception):
+    """Raised when a model response cannot be parsed into feedback data"""
+    
+    def __init__(self, response_text, reason=None):
+        super().__init__(reason or "Could not parse JSON feedback from the model response")
+        self.response_text = response_text
+
+
 class PDFProcessor:
     """Handles all PDF processing functionality"""
     
     @staticmethod
-    def extract_text_from_pdf(file_path):
-        """Extract text from PDF using pymupdf4llm"""
+    def cache_key(file_hash):
+        """Build the extraction cache key for a PDF content hash"""
+        import pymupdf4llm
+
+        # Routing thresholds are part of the key: they decide which pages are converted or transcribed
+        return make_key(
+            "extraction", file_hash, pymupdf4llm.__version__, MIN_TEXT_CHARS_PER_PAGE, MAX_SCANNED_FRACTION,
+            PAGE_TRANSCRIPTION_PROMPT, stage_fingerprint("transcribe")
+        )
+    
+    @staticmethod
+    def plan_extraction(file_path):
+        """Pre-scan the text layer and decide between text extraction and the File API"""
+        with span("extract.prescan") as prescan:
+            plan = plan_extraction(file_path)
+            prescan.set(route=plan["route"], total_pages=plan["total_pages"], scanned_pages=plan["scanned_pages"])
+            return plan
+    
+    @staticmethod
+    def convert_to_markdown(file_path, on_progress=None, ranges=None):
+        """Convert a PDF, or the given page ranges of it, to markdown with pymupdf4llm, raising on failure"""
+        # Page ranges are converted in a process pool and joined in page order
+        with span("extract.markdown") as extract:
+            markdown = convert_to_markdown_parallel(file_path, on_progress=on_progress, ranges=ranges)
+            extract.set(characters=len(markdown))
+            return markdown
+    
+    @staticmethod
+    def convert_planned(file_path, plan, transcribe=None, on_progress=None):
+        """Convert a PDF following a pre-scan plan, raising on failure
+
+        Scanned page ranges of a text-based document are transcribed with
+        transcribe(file_path, ranges) and merged with the converted ranges in
+        page order. Without a transcriber they are marked as unavailable, so
+        the model knows which pages it is not seeing.
+        """
+        # Scanned documents are left to the File API without a wasted conversion
+        if plan["route"] == "file":
+            return ""
+        if not plan["scanned_ranges"]:
+            return PDFProcessor.convert_to_markdown(file_path, on_progress, plan["ranges"])
+        
+        with span("extract.markdown") as extract:
+            text_parts = convert_ranges_to_markdown(file_path, plan["ranges"], on_progress=on_progress)
+            extract.set(characters=sum(len(part) for part in text_parts))
+        if transcribe is not None:
+            transcripts = transcribe(file_path, plan["scanned_ranges"])
+            scanned_parts = [
+                f"[Pages {format_page_range(start, stop)}: transcribed from scanned page images]\n\n{transcript}"
+                for (start, stop), transcript in zip(plan["scanned_ranges"], transcripts)
+            ]
+        else:
+            scanned_parts = [
+                f"[Pages {format_page_range(start, stop)} are scanned images and were not available for this assessment]"
+                for start, stop in plan["scanned_ranges"]
+            ]
+        
+        parts = sorted(zip(plan["ranges"] + plan["scanned_ranges"], text_parts + scanned_parts))
+        return "\n\n".join(part for _, part in parts)
+    
+    @staticmethod
+    def extract_text_from_pdf(file_path, on_progress=None, plan=None, transcribe=None):
+        """Extract text from PDF using pymupdf4llm, following a pre-scan plan if one is given"""
         try:
-            md_text = pymupdf4llm.to_markdown(file_path)
-            return md_text
+            if plan is None:
+                return PDFProcessor.convert_to_markdown(file_path, on_progress)
+            return PDFProcessor.convert_planned(file_path, plan, transcribe, on_progress)
         except Exception as e:
             st.error(f"Error extracting text from PDF: {e}")
             return None
     
     @staticmethod
-    def chunk_text(text, max_chunk_size=8000):
+    def chunk_text(text, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
         """Split text into manageable chunks for processing"""
-        words = text.split()
-        chunks = []
-        current_chunk = []
-        current_size = 0
-        
-        for word in words:
-            if current_size + len(word) + 1 > max_chunk_size:
-                chunks.append(" ".join(current_chunk))
-                current_chunk = [word]
-                current_size = len(word)
-            else:
-                current_chunk.append(word)
-                current_size += len(word) + 1  # +1 for the space
-                
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
-            
-        return chunks
+        with span("chunk") as chunking:
+            chunks = list(iter_chunks(text, max_tokens, overlap_tokens))
+            chunking.set(chunks=len(chunks))
+            return chunks
 
 
 class GeminiProcessor:
     """Handles all Gemini AI processing"""
     
-    def __init__(self):
+    def __init__(self, max_concurrency=None, client=None, context_cache=None, limiter=None, result_cache=None,
+                 upload_registry=None, speculation=None, revisions=None, router=None):
         """Initialize Gemini client"""
-        self.client = self._initialize_client()
+        # Without an injected client, the shared one is created on the first model call
+        self._client = client
+        self.max_concurrency = max(1, max_concurrency or MAX_CONCURRENT_CHUNKS)
+        self.context_cache = context_cache or RequirementsContextCache()
+        self.limiter = limiter or get_shared_limiter()
+        
+        # Picks the model tier of each call by stage, prompt size and load, falling back across tiers
+        self.router = router or get_shared_router()
+        
+        # Completed chunk summaries are persisted here, so a failed analysis can be
+        # restarted without paying again for the chunks that already succeeded
+        self.result_cache = result_cache
+        
+        # Scanned PDFs already uploaded through the File API are referenced instead of re-sent
+        self.upload_registry = upload_registry or FileUploadRegistry()
+        
+        # Chunk analyses started speculatively before the requirements were chosen
+        self.speculation = speculation
+        
+        # Earlier drafts of each submitter and their feedback, for comparing revisions
+        self.revisions = revisions
+        
+        # Token accounting across all calls made by this processor
+        self.usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "retries": 0, "repairs": 0,
+                      "registered_context_tokens": 0}
+        self._usage_lock = threading.Lock()
+        
+        # Calls answered per "stage:model", to compare how each stage was routed
+        self.routes = {}
         
     def _initialize_client(self):
         """Initialize and return Gemini client"""
-        api_key = os.getenv("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY", None)
-        if not api_key:
-            st.error("No Gemini API key found. Please set it in .env file or Streamlit secrets.")
-            st.stop()
-        return genai.Client(api_key=api_key)
+        return get_gemini_client(get_api_key())
+    
+    @property
+    def client(self):
+        """Return the model client, creating the shared one on first use"""
+        if self._client is None:
+            self._client = self._initialize_client()
+        return self._client
+    
+    @staticmethod
+    def cache_key(file_hash, requirements_text=None):
+        """Build the analysis cache key for a PDF content hash and requirements"""
+        # Every setting that changes the feedback is part of the key: output mode, chunking and reduce shape
+        return make_key(
+            "analysis", file_hash, requirements_text, PROMPT_FINGERPRINT, routing_fingerprint(),
+            STRUCTURED_OUTPUT_ENABLED, LONG_DOCUMENT_TOKENS, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS,
+            STABLE_BOUNDARIES, REDUCE_TARGET_TOKENS, REDUCE_GROUP_SIZE, REQUIREMENT_NEUTRAL_MAP
+        )
+    
+    @staticmethod
+    def map_requirements(requirements_text):
+        """Return the requirements the chunk map stage is prompted with"""
+        return None if REQUIREMENT_NEUTRAL_MAP else requirements_text
+    
+    @staticmethod
+    def _speculation_key(assignment_text, map_requirements):
+        """Identify a document's chunk map by its text and the requirements its prompts use"""
+        return make_key(
+            "speculative_map", assignment_text, map_requirements, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS,
+            LONG_CHUNK_ANALYSIS_PROMPT, stage_fingerprint("map")
+        )
+    
+    def speculate(self, owner, assignment_text):
+        """Start mapping a long document's chunks in the background before the requirements are known
+        
+        Returns the run, or None if the document is short or speculation is off.
+        Speculation needs the requirement-neutral map: otherwise chunk prompts
+        include the requirements, and any requirements the user then supplies
+        would cancel the run and map every chunk a second time.
+        """
+        if not (SPECULATIVE_ANALYSIS_ENABLED and REQUIREMENT_NEUTRAL_MAP and self.speculation and assignment_text
+                and self.is_long_document(assignment_text)):
+            return None
+        chunks = PDFProcessor.chunk_text(assignment_text)
+        return self.speculation.start(
+            owner, self._speculation_key(assignment_text, None), chunks, self._speculate_chunk, self.max_concurrency
+        )
+    
+    def _speculate_chunk(self, chunk):
+        """Map one chunk with the requirement-independent prompt"""
+        with span("speculative.chunk"):
+            return self._analyze_chunk(chunk, None)
+    
+    def _await_speculative(self, future, chunk, map_requirements):
+        """Return a speculative chunk summary, analyzing the chunk again if it was cancelled or failed"""
+        try:
+            return future.result()
+        except (Exception, CancelledError):
+            return self._analyze_chunk(chunk, map_requirements)
+    
+    @staticmethod
+    def submitter_key(submitter, requirements_text=None):
+        """Identify who is revising which assignment: a student or session, and the requirements graded against"""
+        return make_key("submitter", submitter, requirements_text)
+    
+    @staticmethod
+    def is_long_document(assignment_text):
+        """Check whether a document needs to be analyzed in chunks"""
+        return estimate_tokens(assignment_text) > LONG_DOCUMENT_TOKENS
+    
+    def _cached_context(self, requirements_text, model):
+        """Return the registered cached context of a model for the requirements, if any"""
+        return self.context_cache.get(self.client, model, requirements_text, on_registered=self._record_registration)
+    
+    @staticmethod
+    def _requirements_context(requirements_text, cached_context, instruction, default):
+        """Build the requirements preamble, referencing the cached context instead of inlining it"""
+        if not requirements_text:
+            return default
+        if cached_context:
+            return f"The assignment is based on the requirements/questions provided in the context above.\n\n{instruction}"
+        return f"The assignment is based on these requirements/questions:\n\n{requirements_text}\n\n{instruction}"
+    
+    @staticmethod
+    def _generation_config(cached_context, structured=False, requirements_text=None):
+        """Build the request config, referencing the cached context and feedback schema as needed"""
+        # The model SDK and schema are loaded on the first model call, not at app start-up
+        from google.genai import types
+        from feedback_schema import Feedback
+
+        options = {}
+        if cached_context:
+            options["cached_content"] = cached_context
+        elif requirements_text:
+            # The cached context carries the preamble; inline requirements get it as a system instruction
+            options["system_instruction"] = SYSTEM_PREAMBLE
+        if structured and STRUCTURED_OUTPUT_ENABLED:
+            options["response_mime_type"] = "application/json"
+            options["response_schema"] = Feedback
+        return types.GenerateContentConfig(**options) if options else None
+    
+    @staticmethod
+    def _prompt_tokens(contents):
+        """Estimate the input tokens of the text parts of a request"""
+        parts = [contents] if isinstance(contents, str) else contents
+        return sum(estimate_tokens(part) for part in parts if isinstance(part, str))
+    
+    def _generate_content(self, stage, build_contents, requirements_text=None, structured=False):
+        """Call the model routed for a stage through the shared rate limiter, retrying transient errors
+        
+        build_contents(cached_context) formats the request once the model, and
+        so its cached requirements context, is known.
+        """
+        prompt_tokens = self._prompt_tokens(build_contents(None))
+        
+        def send(model):
+            cached_context = self._cached_context(requirements_text, model)
+            contents = build_contents(cached_context)
+            self.limiter.acquire(self._prompt_tokens(contents))
+            response = self.client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=self._generation_config(cached_context, structured, requirements_text)
+            )
+            self._record_route(stage, model)
+            return response
+        
+        with span("model.generate", structured=structured):
+            response = call_with_retries(
+                lambda: self.router.call(stage, prompt_tokens, send), on_retry=self._record_retry
+            )
+            self._record_usage(response)
+            return response
+    
+    async def _generate_content_async(self, stage, build_contents, requirements_text=None, structured=False):
+        """Async variant of _generate_content using the client's async transport"""
+        prompt_tokens = self._prompt_tokens(build_contents(None))
+        
+        async def send(model):
+            cached_context = await asyncio.to_thread(self._cached_context, requirements_text, model)
+            contents = build_contents(cached_context)
+            await self.limiter.acquire_async(self._prompt_tokens(contents))
+            response = await self.client.aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=self._generation_config(cached_context, structured, requirements_text)
+            )
+            self._record_route(stage, model)
+            return response
+        
+        with span("model.generate", structured=structured):
+            response = await call_with_retries_async(
+                lambda: self.router.call_async(stage, prompt_tokens, send), on_retry=self._record_retry
+            )
+            self._record_usage(response)
+            return response
+    
+    def _generate_feedback(self, stage, build_contents, requirements_text=None, on_partial=None):
+        """Generate and parse JSON feedback, streaming partial results to on_partial if given"""
+        if on_partial is None:
+            response = self._generate_content(stage, build_contents, requirements_text, structured=True)
+            return self._parse_feedback_or_repair(response.text, stage, build_contents, requirements_text)
+        
+        prompt_tokens = self._prompt_tokens(build_contents(None))
+        
+        def send(model):
+            cached_context = self._cached_context(requirements_text, model)
+            contents = build_contents(cached_context)
+            self.limiter.acquire(self._prompt_tokens(contents))
+            started = time.perf_counter()
+            # A fresh parser per attempt: a retried stream starts over from the beginning
+            parser = IncrementalJSONParser()
+            last_chunk = None
+            for last_chunk in self.client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=self._generation_config(cached_context, True, requirements_text)
+            ):
+                if not parser.text:
+                    stream.set(first_chunk_seconds=round(time.perf_counter() - started, 4))
+                partial = parser.feed(last_chunk.text or "")
+                if partial is not None:
+                    on_partial(partial)
+            self._record_route(stage, model)
+            return parser, last_chunk
+        
+        with span("model.stream", structured=True) as stream:
+            parser, last_chunk = call_with_retries(
+                lambda: self.router.call(stage, prompt_tokens, send), on_retry=self._record_retry
+            )
+            if last_chunk is not None:
+                self._record_usage(last_chunk)
+        
+        return self._parse_feedback_or_repair(parser.text, stage, build_contents, requirements_text)
+    
+    def _parse_feedback_or_repair(self, response_text, stage, build_contents, requirements_text=None):
+        """Parse feedback, regenerating only the final step if it cannot be repaired locally
+
+        The final prompt is sent again with its summary or document and the
+        requirements, so missing fields are graded from the work itself; the
+        chunk summaries behind it are reused.
+        """
+        try:
+            return self._parse_json_response(response_text)
+        except FeedbackParseError as e:
+            error = e
+        
+        for _ in range(FEEDBACK_REPAIR_ATTEMPTS):
+            with self._usage_lock:
+                self.usage["repairs"] += 1
+            with span("repair", error=str(error)):
+                response = self._generate_content(stage, build_contents, requirements_text, structured=True)
+            try:
+                return self._parse_json_response(response.text)
+            except FeedbackParseError as e:
+                error = e
+        raise error
+    
+    async def _generate_feedback_async(self, stage, build_contents, requirements_text=None):
+        """Async variant of _generate_feedback without streaming"""
+        response = await self._generate_content_async(stage, build_contents, requirements_text, structured=True)
+        try:
+            return self._parse_json_response(response.text)
+        except FeedbackParseError as e:
+            error = e
+        
+        for _ in range(FEEDBACK_REPAIR_ATTEMPTS):
+            with self._usage_lock:
+                self.usage["repairs"] += 1
+            with span("repair", error=str(error)):
+                response = await self._generate_content_async(stage, build_contents, requirements_text,
+                                                              structured=True)
+            try:
+                return self._parse_json_response(response.text)
+            except FeedbackParseError as e:
+                error = e
+        raise error
+    
+    def _record_usage(self, response):
+        """Add a response's token counts to the usage totals"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            with self._usage_lock:
+                self.usage["calls"] += 1
+                self.usage["prompt_tokens"] += usage.prompt_token_count or 0
+                self.usage["cached_tokens"] += usage.cached_content_token_count or 0
+                self.usage["output_tokens"] += usage.candidates_token_count or 0
+            current_span().set(
+                input_tokens=usage.prompt_token_count or 0,
+                cached_tokens=usage.cached_content_token_count or 0,
+                output_tokens=usage.candidates_token_count or 0
+            )
+    
+    def _record_route(self, stage, model):
+        """Count a call answered by a model for a stage"""
+        with self._usage_lock:
+            route = f"{stage}:{model}"
+            self.routes[route] = self.routes.get(route, 0) + 1
+    
+    def _record_registration(self, tokens):
+        """Count requirements tokens registered as a cached context by this processor"""
+        with self._usage_lock:
+            self.usage["registered_context_tokens"] += tokens
+    
+    def _record_retry(self, attempt, error):
+        """Count a retried model call"""
+        with self._usage_lock:
+            self.usage["retries"] += 1
+        current_span().add("retries")
     
-    def analyze_with_extracted_text(self, assignment_text, requirements_text=None):
+    def token_savings(self):
+        """Report input tokens served from cached context instead of being re-sent"""
+        with self._usage_lock:
+            usage = dict(self.usage)
+        usage["input_tokens_saved"] = usage["cached_tokens"]
+        with self._usage_lock:
+            usage["routes"] = dict(self.routes)
+        return usage
+    
+    @staticmethod
+    def _streaming_callbacks():
+        """Create Streamlit placeholders and callbacks that render streamed output"""
+        if not STREAMING_ENABLED:
+            return None, None
+        
+        summaries_box = st.container()
+        feedback_placeholder = st.empty()
+        last_render = [0.0]
+        
+        def on_chunk_summary(index, summary):
+            with summaries_box.expander(f"Part {index + 1} reviewed", expanded=False):
+                st.markdown(summary)
+        
+        def on_partial(partial_feedback):
+            # Throttle re-renders; the complete report is shown in step 4 anyway
+            now = time.monotonic()
+            if now - last_render[0] < STREAM_RENDER_INTERVAL:
+                return
+            last_render[0] = now
+            with feedback_placeholder.container():
+                ReportGenerator.display_partial_report(partial_feedback)
+        
+        return on_chunk_summary, on_partial
+    
+    def run_analysis_job(self, payload, reporter, details=None):
+        """Run a queued analysis, persisting progress and partial output through the job reporter
+        
+        details, if given, is filled with information about this analysis as in analyze_text.
+        """
+        chunk_summaries = {}
+        last_partial = [0.0]
+        
+        def on_chunk_summary(index, summary):
+            chunk_summaries[str(index)] = summary
+            reporter.update_partial(chunk_summaries=chunk_summaries)
+        
+        def on_partial(partial_feedback):
+            # Throttle database writes while the final answer streams in
+            now = time.monotonic()
+            if now - last_partial[0] >= STREAM_RENDER_INTERVAL:
+                last_partial[0] = now
+                reporter.update_partial(feedback=partial_feedback)
+        
+        if payload["assignment_text"]:
+            feedback_data = self.analyze_text(
+                payload["assignment_text"], payload["requirements_text"],
+                on_progress=reporter.progress, on_partial=on_partial, on_chunk_summary=on_chunk_summary,
+                speculation_owner=payload.get("speculation_owner"), submitter=payload.get("submitter"), details=details
+            )
+        else:
+            feedback_data = self.analyze_file(payload["file_path"], payload["requirements_text"], on_partial)
+        
+        # Cache the result even if the user never comes back for it
+        if self.result_cache and payload.get("analysis_key"):
+            self.result_cache.set_json(payload["analysis_key"], feedback_data, kind="feedback")
+        return feedback_data
+    
+    def analyze_with_extracted_text(self, assignment_text, requirements_text=None, speculation_owner=None, submitter=None,
+                                    details=None):
         """Analyze PDF with Gemini using extracted text"""
         try:
             with st.spinner("Analyzing", show_time=True):
-                # For long documents, chunk and analyze separately
-                if len(assignment_text) > 30000:
-                    return self._analyze_long_document(assignment_text, requirements_text)
-                else:
-                    # For shorter documents, analyze directly
-                    return self._analyze_short_document(assignment_text, requirements_text)
+                on_progress = None
+                if self.is_long_document(assignment_text):
+                    st.info("Document is large. Processing in chunks...")
+                    progress_bar = st.progress(0)
+                    on_progress = lambda done, total: progress_bar.progress(done/total)
+                
+                on_chunk_summary, on_partial = self._streaming_callbacks()
+                return self.analyze_text(
+                    assignment_text, requirements_text, on_progress,
+                    on_partial=on_partial, on_chunk_summary=on_chunk_summary, speculation_owner=speculation_owner,
+                    submitter=submitter, details=details
+                )
                     
+        except FeedbackParseError as e:
+            st.error("Error parsing AI response. Please try again.")
+            st.code(e.response_text)
+            return None
         except Exception as e:
             st.error(f"Error analyzing assignment: {e}")
             return None
     
-    def _analyze_long_document(self, assignment_text, requirements_text=None):
+    def analyze_text(self, assignment_text, requirements_text=None, on_progress=None, on_partial=None, on_chunk_summary=None,
+                     speculation_owner=None, submitter=None, details=None):
+        """Analyze extracted assignment text without any UI, raising on failure.
+        
+        on_partial receives the partially parsed feedback while the final answer
+        streams in; on_chunk_summary receives (index, summary) as chunks finish.
+        speculation_owner names the speculative run to reuse or cancel, if any.
+        submitter identifies who is revising which assignment (see
+        submitter_key); a long document is recorded as a revision of it and
+        compared only with its earlier drafts.
+        details, if given, is filled with information about this analysis only,
+        so a processor can be shared by concurrent analyses: ``reduce_levels``
+        of a long document and, when it is recorded as a revision, ``revision``
+        with its chunk counts and the feedback of the previous draft.
+        """
+        details = {} if details is None else details
+        # For long documents, chunk and analyze separately
+        if self.is_long_document(assignment_text):
+            with span("analysis", mode="long"):
+                return self._analyze_long_document(
+                    assignment_text, requirements_text, on_progress, on_partial, on_chunk_summary, speculation_owner,
+                    submitter, details
+                )
+        else:
+            # For shorter documents, analyze directly
+            with span("analysis", mode="short"):
+                return self._analyze_short_document(assignment_text, requirements_text, on_partial)
+    
+    def _analyze_long_document(self, assignment_text, requirements_text=None, on_progress=None, on_partial=None, on_chunk_summary=None,
+                               speculation_owner=None, submitter=None, details=None):
         """Process long documents by chunking"""
-        st.info("Document is large. Processing in chunks...")
         chunks = PDFProcessor.chunk_text(assignment_text)
-        summaries = []
+        map_requirements = self.map_requirements(requirements_text)
+        chunk_keys = [self._chunk_key(chunk, map_requirements) for chunk in chunks]
         
-        progress_bar = st.progress(0)
-        for i, chunk in enumerate(chunks):
-            progress_bar.progress((i+1)/len(chunks))
-            
-            # Format the prompt with requirements if available
-            prompt = LONG_CHUNK_ANALYSIS_PROMPT.format(
-                requirements_context=f"The assignment is based on these requirements/questions:\n\n{requirements_text}\n\nWith the above requirements in mind, analyze this portion of the student's assignment:" if requirements_text else "Analyze this portion of an academic assignment:",
-                chunk=chunk
-            )
-            
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=prompt
+        # Chunks unchanged since an earlier draft already have cached summaries; only the rest are analyzed
+        with span("revision") as stage:
+            summaries = [self.result_cache.get(key) if self.result_cache else None for key in chunk_keys]
+            previous = None
+            if self.revisions and submitter:
+                previous = self.revisions.find_previous(submitter, chunk_keys)
+            stage.set(chunks_reused=sum(summary is not None for summary in summaries), previous=bool(previous))
+        pending = [i for i, summary in enumerate(summaries) if summary is None]
+        
+        # A speculative map of the same chunks with the same prompts is waited on instead of
+        # repeated; one whose prompts no longer match is cancelled
+        speculative = None
+        if self.speculation and speculation_owner:
+            speculative = self.speculation.claim(
+                speculation_owner, self._speculation_key(assignment_text, map_requirements)
             )
-            
-            summaries.append(response.text)
+        with span("speculation", reused=speculative is not None) as stage:
+            if speculative:
+                stage.set(chunks_done=speculative.progress()[0])
         
+        reused = len(chunks) - len(pending)
+        for index, summary in enumerate(summaries):
+            if summary is not None and on_chunk_summary:
+                on_chunk_summary(index, summary)
+        if reused and on_progress:
+            on_progress(reused, len(chunks))
+        
+        # Analyze chunks concurrently on a bounded pool. Progress is reported from
+        # the calling thread as each chunk finishes, so UI callbacks stay safe.
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(pending))))
+        try:
+            # Each task runs in a copy of this context so its spans join the current trace
+            futures = {}
+            for i in pending:
+                if speculative:
+                    task = (self._await_speculative, speculative.futures[i], chunks[i], map_requirements)
+                else:
+                    task = (self._analyze_chunk, chunks[i], map_requirements)
+                futures[executor.submit(contextvars.copy_context().run, *task)] = i
+            for completed, future in enumerate(as_completed(futures), start=reused + 1):
+                # Put each summary back in its original chunk position
+                index = futures[future]
+                summaries[index] = future.result()
+                if on_chunk_summary:
+                    on_chunk_summary(index, summaries[index])
+                if on_progress:
+                    on_progress(completed, len(chunks))
+        finally:
+            # Drop queued chunks if one of them failed
+            executor.shutdown(cancel_futures=True)
+        
+        summaries, details["reduce_levels"] = self._reduce_summaries(summaries, requirements_text)
         combined_summary = "\n\n".join(summaries)
         
         # Final analysis of the combined summaries
-        return self._generate_final_assessment(combined_summary, requirements_text)
+        feedback_data = self._generate_final_assessment(combined_summary, requirements_text, on_partial)
+        
+        if self.revisions and submitter:
+            self.revisions.add(submitter, chunk_keys, feedback_data)
+            details["revision"] = {
+                "chunks": len(chunks),
+                "reanalyzed": len(pending),
+                "previous_feedback": previous["feedback"] if previous else None
+            }
+        return feedback_data
     
-    def _analyze_short_document(self, assignment_text, requirements_text=None):
-        """Process shorter documents directly"""
-        # Format the prompt with requirements if available
-        prompt = SHORT_DOCUMENT_ANALYSIS_PROMPT.format(
-            requirements_context=f"The assignment is based on these requirements/questions:\n\n{requirements_text}\n\nWith the above requirements in mind, analyze this student assignment:" if requirements_text else "Analyze this student assignment:",
+    @staticmethod
+    def _summary_groups(summaries):
+        """Split summaries into consecutive groups for one reduce level"""
+        return [summaries[i:i + REDUCE_GROUP_SIZE] for i in range(0, len(summaries), REDUCE_GROUP_SIZE)]
+    
+    @staticmethod
+    def _needs_reduce(summaries):
+        """Check whether the combined summaries are still over the final prompt budget"""
+        return len(summaries) > 1 and estimate_tokens("\n\n".join(summaries)) > REDUCE_TARGET_TOKENS
+    
+    @staticmethod
+    def _reduce_level(level, inputs, outputs, started):
+        """Describe the size and wall time of one reduce level"""
+        return {
+            "level": level,
+            "inputs": inputs,
+            "outputs": outputs,
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+    
+    def _reduce_summaries(self, summaries, requirements_text=None):
+        """Merge groups of summaries in parallel, level by level, until they fit the final prompt budget
+        
+        Returns the merged summaries and a description of each reduce level.
+        """
+        levels = []
+        level = 0
+        while self._needs_reduce(summaries):
+            level += 1
+            started = time.perf_counter()
+            groups = self._summary_groups(summaries)
+            with span("reduce.level", level=level, inputs=len(summaries)), \
+                    ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(groups))) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._summarize_group, group, requirements_text)
+                    for group in groups
+                ]
+                merged = [future.result() for future in futures]
+            levels.append(self._reduce_level(level, len(summaries), len(merged), started))
+            summaries = merged
+        return summaries, levels
+    
+    def _group_prompt(self, group, requirements_text, cached_context):
+        """Format the group summary prompt"""
+        return GROUP_SUMMARY_PROMPT.format(
+            summaries="\n\n".join(group),
+            requirements_context=self._requirements_context(
+                requirements_text, cached_context,
+                "Keep the above requirements in mind when deciding what to keep.",
+                ""
+            )
+        )
+    
+    def _summarize_group(self, group, requirements_text=None):
+        """Merge one group of summaries into a single summary"""
+        with span("reduce.group", inputs=len(group)) as stage:
+            if len(group) == 1:
+                return group[0]
+            
+            group_key = make_key("group", *group, requirements_text, GROUP_SUMMARY_PROMPT, stage_fingerprint("reduce"))
+            if self.result_cache:
+                summary = self.result_cache.get(group_key)
+                if summary is not None:
+                    stage.set(cache_hit=True)
+                    return summary
+            
+            response = self._generate_content(
+                "reduce", lambda cached_context: self._group_prompt(group, requirements_text, cached_context),
+                requirements_text
+            )
+            
+            if self.result_cache:
+                self.result_cache.set(group_key, response.text, kind="group_summary")
+            return response.text
+    
+    def _chunk_prompt(self, chunk, requirements_text, cached_context):
+        """Format the chunk analysis prompt"""
+        return LONG_CHUNK_ANALYSIS_PROMPT.format(
+            requirements_context=self._requirements_context(
+                requirements_text, cached_context,
+                "With the above requirements in mind, analyze this portion of the student's assignment:",
+                "Analyze this portion of an academic assignment:"
+            ),
+            chunk=chunk
+        )
+    
+    @staticmethod
+    def _chunk_key(chunk, requirements_text):
+        """Build the cache key for a chunk summary"""
+        return make_key(
+            "chunk", chunk, requirements_text, SYSTEM_PREAMBLE, LONG_CHUNK_ANALYSIS_PROMPT, stage_fingerprint("map")
+        )
+    
+    def _analyze_chunk(self, chunk, requirements_text=None):
+        """Analyze a single chunk of a long document and return its summary"""
+        with span("map.chunk", chunk_tokens=estimate_tokens(chunk)) as stage:
+            chunk_key = self._chunk_key(chunk, requirements_text)
+            if self.result_cache:
+                summary = self.result_cache.get(chunk_key)
+                if summary is not None:
+                    stage.set(cache_hit=True)
+                    return summary
+            
+            response = self._generate_content(
+                "map", lambda cached_context: self._chunk_prompt(chunk, requirements_text, cached_context),
+                requirements_text
+            )
+            
+            if self.result_cache:
+                self.result_cache.set(chunk_key, response.text, kind="chunk_summary")
+            return response.text
+    
+    def _short_document_prompt(self, assignment_text, requirements_text, cached_context):
+        """Format the short document analysis prompt"""
+        return SHORT_DOCUMENT_ANALYSIS_PROMPT.format(
+            requirements_context=self._requirements_context(
+                requirements_text, cached_context,
+                "With the above requirements in mind, analyze this student assignment:",
+                "Analyze this student assignment:"
+            ),
             assignment_text=assignment_text
         )
-        
-        response = self.client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
+    
+    def _analyze_short_document(self, assignment_text, requirements_text=None, on_partial=None):
+        """Process shorter documents directly"""
+        return self._generate_feedback(
+            "short", lambda cached_context: self._short_document_prompt(assignment_text, requirements_text, cached_context),
+            requirements_text, on_partial
         )
-        
-        return self._parse_json_response(response.text)
     
-    def _generate_final_assessment(self, combined_summary, requirements_text=None):
-        """Generate final assessment from combined summaries"""
-        # Format the prompt with requirements if available
-        prompt = FINAL_ASSESSMENT_PROMPT.format(
+    def _final_assessment_prompt(self, combined_summary, requirements_text, cached_context):
+        """Format the final assessment prompt"""
+        return FINAL_ASSESSMENT_PROMPT.format(
             combined_summary=combined_summary,
-            requirements_context=f"The assignment is based on these requirements/questions:\n\n{requirements_text}\n\nWith the above requirements in mind and based on these summaries, provide a comprehensive assessment:" if requirements_text else "Based on these summaries, provide a comprehensive assessment:"
+            requirements_context=self._requirements_context(
+                requirements_text, cached_context,
+                "With the above requirements in mind and based on these summaries, provide a comprehensive assessment:",
+                "Based on these summaries, provide a comprehensive assessment:"
+            )
         )
+    
+    def _generate_final_assessment(self, combined_summary, requirements_text=None, on_partial=None):
+        """Generate final assessment from combined summaries"""
+        with span("final", summary_tokens=estimate_tokens(combined_summary)):
+            return self._generate_feedback(
+                "final", lambda cached_context: self._final_assessment_prompt(combined_summary, requirements_text, cached_context),
+                requirements_text, on_partial
+            )
+    
+    async def analyze_text_async(self, assignment_text, requirements_text=None, on_progress=None, details=None):
+        """Async variant of analyze_text; chunk calls are fanned out on the event loop"""
+        details = {} if details is None else details
+        if self.is_long_document(assignment_text):
+            with span("analysis", mode="long"):
+                return await self._analyze_long_document_async(assignment_text, requirements_text, on_progress, details)
+        else:
+            with span("analysis", mode="short"):
+                return await self._analyze_short_document_async(assignment_text, requirements_text)
+    
+    async def _analyze_long_document_async(self, assignment_text, requirements_text=None, on_progress=None, details=None):
+        """Async variant of _analyze_long_document bounded by a semaphore"""
+        chunks = PDFProcessor.chunk_text(assignment_text)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def analyze(chunk):
+            async with semaphore:
+                return await self._analyze_chunk_async(chunk, self.map_requirements(requirements_text))
+        
+        tasks = [asyncio.ensure_future(analyze(chunk)) for chunk in chunks]
+        try:
+            completed = 0
+            for next_done in asyncio.as_completed(tasks):
+                await next_done
+                completed += 1
+                if on_progress:
+                    on_progress(completed, len(chunks))
+        finally:
+            # Cancel outstanding chunks if one of them failed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
         
-        response = self.client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
+        # Tasks keep their chunk order, so summaries come back in document order
+        summaries, details["reduce_levels"] = await self._reduce_summaries_async(
+            [task.result() for task in tasks], requirements_text
         )
+        return await self._generate_final_assessment_async("\n\n".join(summaries), requirements_text)
+    
+    async def _reduce_summaries_async(self, summaries, requirements_text=None):
+        """Async variant of _reduce_summaries"""
+        levels = []
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def summarize(group):
+            async with semaphore:
+                return await self._summarize_group_async(group, requirements_text)
         
-        return self._parse_json_response(response.text)
+        level = 0
+        while self._needs_reduce(summaries):
+            level += 1
+            started = time.perf_counter()
+            with span("reduce.level", level=level, inputs=len(summaries)):
+                merged = await asyncio.gather(*(summarize(group) for group in self._summary_groups(summaries)))
+            levels.append(self._reduce_level(level, len(summaries), len(merged), started))
+            summaries = list(merged)
+        return summaries, levels
+    
+    async def _summarize_group_async(self, group, requirements_text=None):
+        """Async variant of _summarize_group"""
+        with span("reduce.group", inputs=len(group)) as stage:
+            if len(group) == 1:
+                return group[0]
+            
+            group_key = make_key("group", *group, requirements_text, GROUP_SUMMARY_PROMPT, stage_fingerprint("reduce"))
+            if self.result_cache:
+                summary = await asyncio.to_thread(self.result_cache.get, group_key)
+                if summary is not None:
+                    stage.set(cache_hit=True)
+                    return summary
+            
+            response = await self._generate_content_async(
+                "reduce", lambda cached_context: self._group_prompt(group, requirements_text, cached_context),
+                requirements_text
+            )
+            
+            if self.result_cache:
+                await asyncio.to_thread(self.result_cache.set, group_key, response.text, kind="group_summary")
+            return response.text
+    
+    async def _analyze_chunk_async(self, chunk, requirements_text=None):
+        """Async variant of _analyze_chunk"""
+        with span("map.chunk", chunk_tokens=estimate_tokens(chunk)) as stage:
+            chunk_key = self._chunk_key(chunk, requirements_text)
+            if self.result_cache:
+                summary = await asyncio.to_thread(self.result_cache.get, chunk_key)
+                if summary is not None:
+                    stage.set(cache_hit=True)
+                    return summary
+            
+            response = await self._generate_content_async(
+                "map", lambda cached_context: self._chunk_prompt(chunk, requirements_text, cached_context),
+                requirements_text
+            )
+            
+            if self.result_cache:
+                await asyncio.to_thread(self.result_cache.set, chunk_key, response.text, kind="chunk_summary")
+            return response.text
+    
+    async def _analyze_short_document_async(self, assignment_text, requirements_text=None):
+        """Async variant of _analyze_short_document"""
+        return await self._generate_feedback_async(
+            "short", lambda cached_context: self._short_document_prompt(assignment_text, requirements_text, cached_context),
+            requirements_text
+        )
+    
+    async def _generate_final_assessment_async(self, combined_summary, requirements_text=None):
+        """Async variant of _generate_final_assessment"""
+        with span("final", summary_tokens=estimate_tokens(combined_summary)):
+            return await self._generate_feedback_async(
+                "final", lambda cached_context: self._final_assessment_prompt(combined_summary, requirements_text, cached_context),
+                requirements_text
+            )
     
     def _parse_json_response(self, response_text):
-        """Extract and parse JSON from response"""
-        json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-        if json_match:
-            json_string = json_match.group(1)
-        else:
-            json_string = response_text
-        
+        """Parse and validate feedback JSON, repairing near-valid responses"""
+        from feedback_schema import FeedbackFormatError, parse_feedback
+
         try:
-            result = json.loads(json_string)
-            return result
-        except json.JSONDecodeError:
-            st.error("Error parsing AI response. Please try again.")
-            st.code(response_text)
-            return None
+            with span("parse", characters=len(response_text)):
+                return parse_feedback(response_text)
+        except FeedbackFormatError as e:
+            raise FeedbackParseError(response_text, str(e))
     
     def analyze_with_file_api(self, assignment_file_path, requirements_text=None):
         """Analyze PDF with Gemini using File API for non-extractable PDFs"""
         try:
             with st.spinner("Analyzing using advanced methods...", show_time=True):
-                # Upload the PDF using the File API
-                sample_file = self.client.files.upload(
-                    file=assignment_file_path,
-                )
-                
-                # Format prompt with requirements if available
-                prompt = FILE_API_ANALYSIS_PROMPT.format(
-                    requirements_context=f"The assignment is based on these requirements/questions:\n\n{requirements_text}\n\nWith these requirements in mind, analyze the attached student assignment PDF." if requirements_text else "Analyze the attached student assignment PDF."
-                )
-                
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=[sample_file, prompt]
-                )
-                
-                return self._parse_json_response(response.text)
+                _, on_partial = self._streaming_callbacks()
+                return self.analyze_file(assignment_file_path, requirements_text, on_partial)
                 
+        except FeedbackParseError as e:
+            st.error("Error parsing AI response. Please try again.")
+            st.code(e.response_text)
+            return None
         except Exception as e:
             st.error(f"Error analyzing PDF with File API: {e}")
             return None
+    
+    def _file_prompt(self, requirements_text, cached_context):
+        """Format the File API analysis prompt"""
+        return FILE_API_ANALYSIS_PROMPT.format(
+            requirements_context=self._requirements_context(
+                requirements_text, cached_context,
+                "With these requirements in mind, analyze the attached student assignment PDF.",
+                "Analyze the attached student assignment PDF."
+            )
+        )
+    
+    def _uploaded_file(self, assignment_file_path, refresh=False):
+        """Return a File API reference for a PDF, uploading it only if no live upload of the same bytes exists"""
+        content_hash = hash_file(assignment_file_path)
+        with self.upload_registry.lock(content_hash):
+            if refresh:
+                self.upload_registry.invalidate(content_hash)
+            uploaded = self.upload_registry.get(content_hash)
+            if uploaded is not None:
+                return uploaded, True
+            
+            sample_file = call_with_retries(
+                lambda: self.client.files.upload(file=assignment_file_path),
+                on_retry=self._record_retry
+            )
+            return self.upload_registry.register(content_hash, sample_file), False
+    
+    async def _uploaded_file_async(self, assignment_file_path, refresh=False):
+        """Async variant of _uploaded_file"""
+        content_hash = await asyncio.to_thread(hash_file, assignment_file_path)
+        # The same per-hash lock as the sync path, polled so waiting for it does not block the event loop
+        lock = self.upload_registry.lock(content_hash)
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(UPLOAD_LOCK_POLL_SECONDS)
+        try:
+            if refresh:
+                await asyncio.to_thread(self.upload_registry.invalidate, content_hash)
+            uploaded = await asyncio.to_thread(self.upload_registry.get, content_hash)
+            if uploaded is not None:
+                return uploaded, True
+            
+            sample_file = await call_with_retries_async(
+                lambda: self.client.aio.files.upload(file=assignment_file_path),
+                on_retry=self._record_retry
+            )
+            return await asyncio.to_thread(self.upload_registry.register, content_hash, sample_file), False
+        finally:
+            lock.release()
+    
+    @staticmethod
+    def _is_missing_upload(error):
+        """Check whether a request failed because a referenced upload no longer exists"""
+        from google.genai import errors
+
+        return isinstance(error, errors.APIError) and error.code in (403, 404)
+    
+    def analyze_file(self, assignment_file_path, requirements_text=None, on_partial=None):
+        """Analyze a PDF through the File API without any UI, raising on failure"""
+        # Upload the PDF using the File API, or reuse an earlier upload of the same bytes
+        with span("file.upload") as upload:
+            sample_file, reused = self._uploaded_file(assignment_file_path)
+            upload.set(reused=reused)
+        
+        def contents(file):
+            return lambda cached_context: [file, self._file_prompt(requirements_text, cached_context)]
+        
+        try:
+            return self._generate_feedback("file", contents(sample_file), requirements_text, on_partial)
+        except Exception as e:
+            # The reused upload was deleted or expired early: upload again once
+            if not reused or not self._is_missing_upload(e):
+                raise
+            sample_file, _ = self._uploaded_file(assignment_file_path, refresh=True)
+            return self._generate_feedback("file", contents(sample_file), requirements_text, on_partial)
+    
+    def transcribe_pages(self, file_path, ranges):
+        """Transcribe (start, stop) page ranges of a PDF through the File API; one markdown string per range"""
+        def transcribe(start, stop, directory):
+            pages = format_page_range(start, stop)
+            pages_path = os.path.join(directory, f"pages-{pages}.pdf")
+            write_page_range(file_path, start, stop, pages_path)
+            sample_file, reused = self._uploaded_file(pages_path)
+            
+            def contents(file):
+                return lambda cached_context: [file, PAGE_TRANSCRIPTION_PROMPT.format(pages=pages)]
+            
+            try:
+                response = self._generate_content("transcribe", contents(sample_file))
+            except Exception as e:
+                # The reused upload was deleted or expired early: upload again once
+                if not reused or not self._is_missing_upload(e):
+                    raise
+                sample_file, _ = self._uploaded_file(pages_path, refresh=True)
+                response = self._generate_content("transcribe", contents(sample_file))
+            return response.text or ""
+        
+        with span("extract.transcribe", ranges=len(ranges), pages=sum(stop - start for start, stop in ranges)):
+            with tempfile.TemporaryDirectory() as directory, \
+                    ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(ranges)))) as executor:
+                # Each task runs in a copy of this context so its spans join the current trace
+                futures = [
+                    executor.submit(contextvars.copy_context().run, transcribe, start, stop, directory)
+                    for start, stop in ranges
+                ]
+                return [future.result() for future in futures]
+    
+    async def analyze_file_async(self, assignment_file_path, requirements_text=None):
+        """Async variant of analyze_file"""
+        with span("file.upload") as upload:
+            sample_file, reused = await self._uploaded_file_async(assignment_file_path)
+            upload.set(reused=reused)
+        
+        def contents(file):
+            return lambda cached_context: [file, self._file_prompt(requirements_text, cached_context)]
+        
+        try:
+            return await self._generate_feedback_async("file", contents(sample_file), requirements_text)
+        except Exception as e:
+            if not reused or not self._is_missing_upload(e):
+                raise
+            sample_file, _ = await self._uploaded_file_async(assignment_file_path, refresh=True)
+            return await self._generate_feedback_async("file", contents(sample_file), requirements_text)
 
 
 class ReportGenerator:
@@ -221,9 +1265,188 @@ class ReportGenerator:
 """
         return md
     
+    @staticmethod
+    def create_pdf_report(feedback_data):
+        """Create a PDF report, including the category score chart, from feedback data"""
+        from pdf_report import build_pdf_report
+        
+        return build_pdf_report(feedback_data)
+    
+    @staticmethod
+    def display_partial_report(partial_feedback):
+        """Display the fields of feedback that is still being generated"""
+        if partial_feedback.get('title'):
+            st.subheader(partial_feedback['title'])
+        
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            if partial_feedback.get('grade'):
+                st.metric(label="Grade", value=partial_feedback['grade'])
+        with col2:
+            if isinstance(partial_feedback.get('score'), (int, float)):
+                st.metric(label="Score", value=f"{partial_feedback['score']}/100")
+        
+        if partial_feedback.get('summary'):
+            st.info(partial_feedback['summary'])
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            for strength in partial_feedback.get('strengths') or []:
+                st.success(strength)
+        with col2:
+            for area in partial_feedback.get('areas_for_improvement') or []:
+                st.warning(area)
+        
+        if partial_feedback.get('detailed_feedback'):
+            st.write(partial_feedback['detailed_feedback'])
+    
+    @staticmethod
+    def display_feedback_changes(previous_feedback, feedback_data):
+        """Display how feedback changed from the previous draft of a submission"""
+        changes = feedback_changes(previous_feedback, feedback_data)
+        
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            previous_grade, grade = changes["grade"]
+            st.metric(label="Grade", value=grade, delta=None if grade == previous_grade else f"was {previous_grade}",
+                      delta_color="off")
+        with col2:
+            previous_score, score = changes["score"]
+            st.metric(label="Score", value=f"{score}/100", delta=score - previous_score)
+        
+        st.dataframe(
+            [
+                {"Category": category, "Previous": previous, "Current": current,
+                 "Change": None if previous is None or current is None else current - previous}
+                for category, (previous, current) in changes["category_scores"].items()
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            for strength in changes["strengths_added"]:
+                st.success(f"New strength: {strength}")
+            for strength in changes["strengths_removed"]:
+                st.caption(f"No longer listed: {strength}")
+        with col2:
+            for area in changes["improvements_resolved"]:
+                st.success(f"Addressed: {area}")
+            for area in changes["improvements_added"]:
+                st.warning(f"New: {area}")
+    
+    @staticmethod
+    def feedback_fingerprint(feedback_data):
+        """Return a content hash of feedback data, used to key its prepared views"""
+        return hash_bytes(json.dumps(feedback_data, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    
+    @staticmethod
+    def prepare_views(feedback_data):
+        """Build every chart and the markdown and PDF exports of a report
+        
+        Both visualization types are built up front, so switching between
+        them only re-renders figures that already exist.
+        """
+        # Plotly is only needed once there is a report to chart
+        import plotly.graph_objects as go
+        
+        categories = list(feedback_data['category_scores'].keys())
+        scores = list(feedback_data['category_scores'].values())
+        
+        # Bar chart
+        bar_chart = go.Figure()
+        
+        bar_chart.add_trace(go.Bar(
+            x=categories,
+            y=scores,
+            marker=dict(
+                color='rgba(32, 156, 238, 0.8)',
+                line=dict(color='rgba(32, 156, 238, 1.0)', width=1)
+            ),
+            text=scores,
+            textposition='auto'
+        ))
+        
+        bar_chart.update_layout(
+            title="Category Performance",
+            yaxis=dict(
+                title="Score",
+                range=[0, 100]
+            ),
+            xaxis_title="Categories",
+            height=400,
+            margin=dict(l=20, r=20, t=40, b=20),
+            plot_bgcolor='rgba(0,0,0,0.02)'
+        )
+        
+        # Pie chart
+        pie_chart = go.Figure()
+        
+        pie_chart.add_trace(go.Pie(
+            labels=categories,
+            values=scores,
+            textinfo='label+percent',
+            insidetextorientation='radial',
+            marker=dict(
+                line=dict(color='#FFFFFF', width=1)
+            ),
+            pull=[0.05 if score == max(scores) else 0 for score in scores]  # Pull out the highest score slice
+        ))
+        
+        pie_chart.update_layout(
+            title="Score Distribution by Category",
+            height=400,
+            margin=dict(l=20, r=20, t=40, b=20),
+            legend=dict(orientation="h", yanchor="bottom", y=0, xanchor="center", x=0.5)
+        )
+        
+        # Score comparison chart (horizontal bar) shown with the pie chart
+        comparison_chart = go.Figure()
+        
+        # Sort categories and scores for better visualization
+        sorted_pairs = sorted(zip(categories, scores), key=lambda x: x[1])
+        sorted_categories, sorted_scores = zip(*sorted_pairs)
+        
+        comparison_chart.add_trace(go.Bar(
+            y=sorted_categories,
+            x=sorted_scores,
+            orientation='h',
+            marker=dict(
+                color=['rgba(255,80,80,0.7)' if score < 60 else 
+                       'rgba(255,200,0,0.7)' if score < 75 else 
+                       'rgba(46,204,113,0.7)' for score in sorted_scores],
+                line=dict(width=1)
+            ),
+            text=[f"{score}/100" for score in sorted_scores],
+            textposition='auto'
+        ))
+        
+        comparison_chart.update_layout(
+            title="Performance Comparison",
+            xaxis=dict(
+                title="Score",
+                range=[0, 100]
+            ),
+            height=300,
+            margin=dict(l=20, r=20, t=40, b=20),
+            plot_bgcolor='rgba(0,0,0,0.02)'
+        )
+        
+        return {
+            "bar_chart": bar_chart,
+            "pie_chart": pie_chart,
+            "comparison_chart": comparison_chart,
+            "markdown": ReportGenerator.create_markdown_report(feedback_data),
+            "pdf": ReportGenerator.create_pdf_report(feedback_data)
+        }
+    
     @staticmethod
     def display_report(feedback_data):
         """Display report in Streamlit UI"""
+        # Charts and markdown are built once per distinct feedback, not on every rerun
+        views = get_report_views(ReportGenerator.feedback_fingerprint(feedback_data), feedback_data)
+        
         # Title and Grade Display
         st.header(feedback_data['title'])
         
@@ -254,12 +1477,8 @@ class ReportGenerator:
         # Category Scores with Charts
         st.subheader("Category Scores")
         
-        # Create flexible column layout based on number of categories
-        categories = list(feedback_data['category_scores'].keys())
-        scores = list(feedback_data['category_scores'].values())
-        
         # Display individual category scores with progress bars
-        cols = st.columns(len(categories))
+        cols = st.columns(len(feedback_data['category_scores']))
         for i, (category, score) in enumerate(feedback_data['category_scores'].items()):
             with cols[i]:
                 st.metric(label=category, value=f"{score}/100")
@@ -271,95 +1490,10 @@ class ReportGenerator:
                            horizontal=True)
         
         if viz_type == "Bar Chart":
-            # Create bar chart with Plotly
-            fig = go.Figure()
-            
-            fig.add_trace(go.Bar(
-                x=categories,
-                y=scores,
-                marker=dict(
-                    color='rgba(32, 156, 238, 0.8)',
-                    line=dict(color='rgba(32, 156, 238, 1.0)', width=1)
-                ),
-                text=scores,
-                textposition='auto'
-            ))
-            
-            fig.update_layout(
-                title="Category Performance",
-                yaxis=dict(
-                    title="Score",
-                    range=[0, 100]
-                ),
-                xaxis_title="Categories",
-                height=400,
-                margin=dict(l=20, r=20, t=40, b=20),
-                plot_bgcolor='rgba(0,0,0,0.02)'
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
-            
+            st.plotly_chart(views["bar_chart"], use_container_width=True)
         else:  # Pie Chart
-            # Calculate percentages for better pie chart representation
-            total = sum(scores)
-            percentages = [score/total * 100 for score in scores]
-            
-            # Create pie chart with Plotly
-            fig = go.Figure()
-            
-            fig.add_trace(go.Pie(
-                labels=categories,
-                values=scores,
-                textinfo='label+percent',
-                insidetextorientation='radial',
-                marker=dict(
-                    line=dict(color='#FFFFFF', width=1)
-                ),
-                pull=[0.05 if score == max(scores) else 0 for score in scores]  # Pull out the highest score slice
-            ))
-            
-            fig.update_layout(
-                title="Score Distribution by Category",
-                height=400,
-                margin=dict(l=20, r=20, t=40, b=20),
-                legend=dict(orientation="h", yanchor="bottom", y=0, xanchor="center", x=0.5)
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
-            
-            # Add score comparison chart (horizontal bar)
-            fig = go.Figure()
-            
-            # Sort categories and scores for better visualization
-            sorted_pairs = sorted(zip(categories, scores), key=lambda x: x[1])
-            sorted_categories, sorted_scores = zip(*sorted_pairs)
-            
-            fig.add_trace(go.Bar(
-                y=sorted_categories,
-                x=sorted_scores,
-                orientation='h',
-                marker=dict(
-                    color=['rgba(255,80,80,0.7)' if score < 60 else 
-                           'rgba(255,200,0,0.7)' if score < 75 else 
-                           'rgba(46,204,113,0.7)' for score in sorted_scores],
-                    line=dict(width=1)
-                ),
-                text=[f"{score}/100" for score in sorted_scores],
-                textposition='auto'
-            ))
-            
-            fig.update_layout(
-                title="Performance Comparison",
-                xaxis=dict(
-                    title="Score",
-                    range=[0, 100]
-                ),
-                height=300,
-                margin=dict(l=20, r=20, t=40, b=20),
-                plot_bgcolor='rgba(0,0,0,0.02)'
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(views["pie_chart"], use_container_width=True)
+            st.plotly_chart(views["comparison_chart"], use_container_width=True)
         
         # Detailed Feedback
         st.subheader("Detailed Feedback")
@@ -368,13 +1502,21 @@ class ReportGenerator:
         # Download options
         st.subheader("Download Report")
         
-        md_content = ReportGenerator.create_markdown_report(feedback_data)
-        st.download_button(
-            label="Download as Markdown",
-            data=md_content,
-            file_name="assignment_feedback.md",
-            mime="text/markdown"
-        )
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                label="Download as Markdown",
+                data=views["markdown"],
+                file_name="assignment_feedback.md",
+                mime="text/markdown"
+            )
+        with col2:
+            st.download_button(
+                label="Download as PDF",
+                data=views["pdf"],
+                file_name="assignment_feedback.pdf",
+                mime="application/pdf"
+            )
 
 
 class PDFFeedbackApp:
@@ -392,10 +1534,10 @@ class PDFFeedbackApp:
         # Initialize session state
         if 'step' not in st.session_state:
             st.session_state.step = 1
-        if 'assignment_file' not in st.session_state:
-            st.session_state.assignment_file = None
-        if 'requirements_file' not in st.session_state:
-            st.session_state.requirements_file = None
+        if 'assignment_name' not in st.session_state:
+            st.session_state.assignment_name = None
+        if 'requirements_upload_id' not in st.session_state:
+            st.session_state.requirements_upload_id = None
         if 'assignment_text' not in st.session_state:
             st.session_state.assignment_text = None
         if 'requirements_text' not in st.session_state:
@@ -404,9 +1546,34 @@ class PDFFeedbackApp:
             st.session_state.feedback_data = None
         if 'temp_file_path' not in st.session_state:
             st.session_state.temp_file_path = None
+        if 'assignment_hash' not in st.session_state:
+            st.session_state.assignment_hash = None
+        if 'speculated_hash' not in st.session_state:
+            st.session_state.speculated_hash = None
+        if 'extraction_plan' not in st.session_state:
+            st.session_state.extraction_plan = None
+        if 'cohort' not in st.session_state:
+            st.session_state.cohort = ""
+        if 'tracer' not in st.session_state:
+            st.session_state.tracer = Tracer()
+            st.session_state.trace_exported = False
+        if 'job_id' not in st.session_state:
+            # A reconnecting user picks up the analysis job named in the URL
+            st.session_state.job_id = st.query_params.get("job")
+            if st.session_state.job_id:
+                st.session_state.step = 3
         
         # Initialize components
-        self.gemini = GeminiProcessor()
+        self.cache = get_result_cache()
+        self.temp_files = get_temp_files()
+        self.gemini = GeminiProcessor(
+            context_cache=get_context_cache(),
+            result_cache=self.cache,
+            upload_registry=get_upload_registry(get_api_key()),
+            speculation=get_speculation(),
+            revisions=get_revision_store()
+        )
+        self.jobs = get_job_queue(get_api_key()) if BACKGROUND_JOBS_ENABLED else None
     
     def run(self):
         """Run the application"""
@@ -437,23 +1604,56 @@ class PDFFeedbackApp:
         uploaded_file = st.file_uploader("Choose a PDF file", type="pdf", key="assignment_uploader")
         
         if uploaded_file is not None:
-            # Save the uploaded file to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
-                st.session_state.temp_file_path = tmp_path
-            
-            st.session_state.assignment_file = uploaded_file
+            # Stream the upload to disk once; reruns and identical uploads reuse the same file
+            tmp_path, file_hash = self.temp_files.save_upload(uploaded_file, owner=current_session_id())
+            st.session_state.temp_file_path = tmp_path
+            st.session_state.assignment_name = uploaded_file.name
+            if file_hash != st.session_state.assignment_hash:
+                # A new document starts a new trace
+                st.session_state.tracer = Tracer()
+                st.session_state.trace_exported = False
+            st.session_state.assignment_hash = file_hash
             
-            # Extract text from PDF
-            with st.spinner("Processing PDF...", show_time=True):
-                st.session_state.assignment_text = PDFProcessor.extract_text_from_pdf(tmp_path)
+            # Extract text from PDF, reusing the cached markdown for identical files
+            with st.spinner("Processing PDF...", show_time=True), use_tracer(st.session_state.tracer):
+                extraction_key = PDFProcessor.cache_key(st.session_state.assignment_hash)
+                st.session_state.assignment_text = self.cache.get(extraction_key)
+                st.session_state.extraction_plan = None
+                if st.session_state.assignment_text is None:
+                    try:
+                        plan = PDFProcessor.plan_extraction(tmp_path)
+                        st.session_state.extraction_plan = {
+                            key: plan[key] for key in ("route", "reason", "total_pages", "scanned_pages")
+                        }
+                    except Exception:
+                        # Unreadable PDFs fall through to a full conversion, which reports the error
+                        plan = None
+                    
+                    progress_bar = st.progress(0)
+                    st.session_state.assignment_text = PDFProcessor.extract_text_from_pdf(
+                        tmp_path,
+                        on_progress=lambda done, total: progress_bar.progress(done/total, text=f"Converted {done}/{total} pages"),
+                        plan=plan,
+                        transcribe=self.gemini.transcribe_pages
+                    )
+                    if st.session_state.assignment_text is not None:
+                        self.cache.set(extraction_key, st.session_state.assignment_text, kind="extraction")
                 
                 if st.session_state.assignment_text:
                     word_count = len(st.session_state.assignment_text.split())
                     st.success(f"✅ PDF uploaded and processed successfully! Word count: {word_count}")
                 else:
                     st.warning("⚠️ Could not extract text from this PDF. We'll use advanced methods to analyze it.")
+                
+                # Explain how the pre-scan routed this document
+                if st.session_state.extraction_plan:
+                    st.caption(st.session_state.extraction_plan["reason"])
+                
+                # Start mapping a long document's chunks while requirements are chosen; once per
+                # document, so reruns do not chunk the text again
+                if st.session_state.assignment_text and st.session_state.speculated_hash != file_hash:
+                    self.gemini.speculate(current_session_id(), st.session_state.assignment_text)
+                    st.session_state.speculated_hash = file_hash
             
             # Proceed to next step
             if st.button("Continue to Step 2", type="primary"):
@@ -479,22 +1679,22 @@ class PDFFeedbackApp:
             uploaded_requirements = st.file_uploader("Choose a PDF file", type="pdf", key="requirements_uploader")
             
             if uploaded_requirements is not None:
-                # Save the uploaded file to a temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                    tmp_file.write(uploaded_requirements.getvalue())
-                    tmp_req_path = tmp_file.name
-                
-                # Extract text from PDF
-                with st.spinner("Processing requirements PDF...", show_time=True):
-                    st.session_state.requirements_text = PDFProcessor.extract_text_from_pdf(tmp_req_path)
+                # Extract text once per upload, not on every rerun
+                if uploaded_requirements.file_id != st.session_state.requirements_upload_id:
+                    owner = f"{current_session_id()}/requirements"
+                    tmp_req_path, _ = self.temp_files.save_upload(uploaded_requirements, owner=owner)
                     
-                    if st.session_state.requirements_text:
-                        st.success("✅ Requirements PDF processed successfully!")
-                    else:
-                        st.error("❌ Could not extract text from the requirements PDF.")
+                    with st.spinner("Processing requirements PDF...", show_time=True):
+                        st.session_state.requirements_text = PDFProcessor.extract_text_from_pdf(tmp_req_path)
+                    st.session_state.requirements_upload_id = uploaded_requirements.file_id
+                    
+                    # Only the text is needed from here on
+                    self.temp_files.release(owner)
                 
-                # Clean up temporary file
-                os.unlink(tmp_req_path)
+                if st.session_state.requirements_text:
+                    st.success("✅ Requirements PDF processed successfully!")
+                else:
+                    st.error("❌ Could not extract text from the requirements PDF.")
         
         elif requirements_option == "Yes, enter requirements as text":
             st.session_state.requirements_text = st.text_area(
@@ -505,6 +1705,22 @@ class PDFFeedbackApp:
         else:
             st.session_state.requirements_text = None
         
+        # Requirements typed or skipped replace any extracted ones: a re-selected upload is extracted again
+        if requirements_option != "Yes, upload requirements":
+            st.session_state.requirements_upload_id = None
+        
+        # Graded submissions are grouped by cohort on the analytics page
+        st.session_state.cohort = st.text_input(
+            "Cohort or class (optional)",
+            value=st.session_state.cohort,
+            help="Feedback is collected per cohort on the Cohort Analytics page."
+        ).strip()
+        
+        run = self.gemini.speculation.get(current_session_id())
+        if run is not None:
+            done, total = run.progress()
+            st.caption(f"Pre-analyzing your assignment in the background: {done}/{total} sections done")
+        
         # Navigation buttons
         col1, col2 = st.columns([1, 1])
         
@@ -522,26 +1738,69 @@ class PDFFeedbackApp:
         """Handle Step 3: Analysis"""
         st.header("Step 3: Analyzing Your Assignment")
         
-        if st.session_state.feedback_data is None:
+        if st.session_state.feedback_data is None and st.session_state.job_id:
+            self._poll_analysis_job()
+        elif st.session_state.feedback_data is None:
             # Show analysis information
             st.info("Our AI is analyzing your assignment. This may take a minute...")
             
-            # Perform analysis based on text extraction success
-            if st.session_state.assignment_text:
-                # Process with extracted text
-                st.session_state.feedback_data = self.gemini.analyze_with_extracted_text(
-                    st.session_state.assignment_text,
-                    st.session_state.requirements_text
-                )
-            else:
-                # Process with file API
-                st.session_state.feedback_data = self.gemini.analyze_with_file_api(
-                    st.session_state.temp_file_path,
-                    st.session_state.requirements_text
+            # Identical file and requirements were already graded: reuse the feedback
+            analysis_key = GeminiProcessor.cache_key(
+                st.session_state.assignment_hash,
+                st.session_state.requirements_text
+            )
+            st.session_state.feedback_data = self.cache.get_json(analysis_key)
+            # Drafts are compared only with earlier drafts graded in this session against the same requirements
+            submitter = GeminiProcessor.submitter_key(current_session_id(), st.session_state.requirements_text)
+            
+            if st.session_state.feedback_data is None and self.jobs:
+                # Hand the analysis to a background worker and follow it by job ID. Jobs are not
+                # shared across sessions, whose revision comparisons must stay their own. File API
+                # jobs read the upload from this replica's disk, so they run on this replica
+                st.session_state.job_id = self.jobs.submit(
+                    "analysis",
+                    {
+                        "assignment_text": st.session_state.assignment_text,
+                        "requirements_text": st.session_state.requirements_text,
+                        "file_path": st.session_state.temp_file_path,
+                        "analysis_key": analysis_key,
+                        "speculation_owner": current_session_id(),
+                        "submitter": submitter,
+                        "cohort": st.session_state.cohort,
+                        "submission": st.session_state.assignment_name
+                    },
+                    dedupe_key=make_key(analysis_key, submitter),
+                    pinned=not st.session_state.assignment_text
                 )
+                st.query_params["job"] = st.session_state.job_id
+                st.rerun()
+            elif st.session_state.feedback_data is None:
+                # Perform analysis based on text extraction success
+                details = {}
+                with use_tracer(st.session_state.tracer):
+                    if st.session_state.assignment_text:
+                        # Process with extracted text
+                        st.session_state.feedback_data = self.gemini.analyze_with_extracted_text(
+                            st.session_state.assignment_text,
+                            st.session_state.requirements_text,
+                            speculation_owner=current_session_id(),
+                            submitter=submitter,
+                            details=details
+                        )
+                    else:
+                        # Process with file API
+                        st.session_state.feedback_data = self.gemini.analyze_with_file_api(
+                            st.session_state.temp_file_path,
+                            st.session_state.requirements_text
+                        )
+                
+                if st.session_state.feedback_data:
+                    self.cache.set_json(analysis_key, st.session_state.feedback_data, kind="feedback")
+                    st.session_state.token_usage = {**self.gemini.token_savings(), **details}
             
             # Move to results
             if st.session_state.feedback_data:
+                self._record_feedback()
                 st.session_state.step = 4
                 st.rerun()
             else:
@@ -556,25 +1815,137 @@ class PDFFeedbackApp:
                 st.session_state.step = 4
                 st.rerun()
     
+    def _poll_analysis_job(self):
+        """Show the state of the background analysis job and rerun until it finishes"""
+        job = self.jobs.get(st.session_state.job_id) if self.jobs else None
+        
+        if job is None or job["status"] == "failed":
+            st.error(f"❌ Analysis failed: {job['error'] if job else 'job not found'}")
+            st.session_state.job_id = None
+            st.query_params.clear()
+            if st.button("← Back to Step 1"):
+                st.session_state.step = 1
+                st.rerun()
+            return
+        
+        if job["status"] == "done":
+            st.session_state.feedback_data = job["result"]
+            st.session_state.token_usage = job["usage"]
+            st.session_state.tracer.extend(job["usage"].pop("spans", None) or [])
+            # The job handler recorded the feedback for cohort analytics
+            store_error = job["usage"].pop("feedback_store_error", None)
+            if store_error:
+                st.warning(f"Could not save feedback for cohort analytics: {store_error}")
+            st.session_state.step = 4
+            st.rerun()
+        
+        st.info("Our AI is analyzing your assignment. You can close this page and come back to the same link later.")
+        if job["status"] == "queued":
+            st.caption("Waiting for a free worker...")
+        
+        partial = job["partial"] or {}
+        if job["progress_total"]:
+            st.progress(
+                job["progress_done"] / job["progress_total"],
+                text=f"Reviewed {job['progress_done']}/{job['progress_total']} parts"
+            )
+        for index, summary in sorted((partial.get("chunk_summaries") or {}).items(), key=lambda item: int(item[0])):
+            with st.expander(f"Part {int(index) + 1} reviewed", expanded=False):
+                st.markdown(summary)
+        if partial.get("feedback"):
+            ReportGenerator.display_partial_report(partial["feedback"])
+        
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+    
+    def _record_feedback(self):
+        """Add this submission's feedback to its cohort in the feedback store"""
+        analysis_key = GeminiProcessor.cache_key(st.session_state.assignment_hash, st.session_state.requirements_text)
+        try:
+            get_feedback_store().add(
+                analysis_key,
+                st.session_state.feedback_data,
+                cohort=st.session_state.cohort,
+                submission=st.session_state.assignment_name
+            )
+        except Exception as e:
+            # Analytics are secondary: a store failure must not hide the feedback itself
+            st.warning(f"Could not save feedback for cohort analytics: {e}")
+    
+    def _display_timing_panel(self):
+        """Show per-stage timings of this analysis and export its trace once"""
+        tracer = st.session_state.tracer
+        if not st.session_state.trace_exported:
+            tracer.export()
+            st.session_state.trace_exported = True
+        
+        with st.expander("⏱️ Timing breakdown", expanded=False):
+            st.dataframe(tracer.summary(), hide_index=True, use_container_width=True)
+            st.download_button(
+                label="Download trace (JSONL)",
+                data=tracer.to_jsonl(),
+                file_name="analysis_trace.jsonl",
+                mime="application/jsonl"
+            )
+    
     def _handle_step_4(self):
         """Handle Step 4: Results"""
         st.header("Step 4: Feedback Results")
         
         if st.session_state.feedback_data:
             # Display report
-            ReportGenerator.display_report(st.session_state.feedback_data)
+            with use_tracer(st.session_state.tracer), span("report.render"):
+                ReportGenerator.display_report(st.session_state.feedback_data)
+            
+            # Input tokens served from the cached requirements context
+            token_usage = st.session_state.get("token_usage")
+            if token_usage and token_usage["input_tokens_saved"]:
+                st.caption(
+                    f"Cached requirements context saved {token_usage['input_tokens_saved']:,} input tokens "
+                    f"across {token_usage['calls']} model calls."
+                )
+            
+            # Time spent merging chunk summaries of very long documents
+            if token_usage and token_usage.get("reduce_levels"):
+                st.caption("Summary reduce: " + ", ".join(
+                    f"level {level['level']} merged {level['inputs']}→{level['outputs']} in {level['seconds']:.1f}s"
+                    for level in token_usage["reduce_levels"]
+                ))
+            
+            # Models that answered each stage, to tune the routing of calls across tiers
+            if token_usage and token_usage.get("routes"):
+                st.caption("Models used: " + ", ".join(
+                    f"{route.replace(':', ' → ')} ×{count}" for route, count in sorted(token_usage["routes"].items())
+                ))
+            
+            # Feedback of a revised draft, compared with the previous draft's
+            revision = token_usage.get("revision") if token_usage else None
+            if revision and revision["previous_feedback"]:
+                st.caption(
+                    f"Revised draft: {revision['reanalyzed']} of {revision['chunks']} parts re-analyzed, "
+                    "the rest reused from the previous draft."
+                )
+                with st.expander("🔀 Changes since the previous draft", expanded=False):
+                    ReportGenerator.display_feedback_changes(
+                        revision["previous_feedback"], st.session_state.feedback_data
+                    )
+            
+            self._display_timing_panel()
             
             # Start new analysis button
             if st.button("Start New Analysis", type="primary"):
-                # Clean up temporary file if it exists
-                if st.session_state.temp_file_path and os.path.exists(st.session_state.temp_file_path):
-                    os.unlink(st.session_state.temp_file_path)
+                # Delete this session's uploaded files unless another session is using them
+                self.temp_files.release(current_session_id())
+                self.gemini.speculation.cancel(current_session_id())
                 
-                # Reset session state
+                # Reset session state, keeping the cohort for the next submission
+                cohort = st.session_state.cohort
                 for key in list(st.session_state.keys()):
                     del st.session_state[key]
+                st.query_params.clear()
                 
                 st.session_state.step = 1
+                st.session_state.cohort = cohort
                 st.rerun()
         else:
             st.error("❌ No feedback data available. Please start over.")
@@ -0,0 +1,174 @@
+import streamlit as st
+
+import cohort_analytics
+from feedback_store import FeedbackStore
+
+# Label for records graded without a cohort
+UNASSIGNED_COHORT = "Unassigned"
+
+# Loaded cohorts kept in memory across reruns and sessions
+MAX_CACHED_COHORTS = 8
+
+
+@st.cache_resource
+def get_feedback_store():
+    """Return the process-wide feedback store"""
+    return FeedbackStore()
+
+
+@st.cache_data(max_entries=MAX_CACHED_COHORTS, show_spinner=False)
+def load_cohort(cohort, version):
+    """Load a cohort's records; version is the store fingerprint, so new grades invalidate the entry"""
+    return get_feedback_store().load(cohort)
+
+
+class CohortDashboard:
+    """Class-level analytics over all stored feedback of a cohort"""
+
+    def __init__(self):
+        """Initialize the dashboard page"""
+        st.set_page_config(
+            page_title="Cohort Analytics",
+            page_icon="📊",
+            layout="wide"
+        )
+        self.store = get_feedback_store()
+
+    def run(self):
+        """Run the dashboard"""
+        st.title("📊 Cohort Analytics")
+
+        cohorts = self.store.cohorts()
+        if not cohorts:
+            st.info("No graded submissions yet. Feedback from the app and from batch.py is collected here.")
+            return
+
+        labels = {cohort: f"{cohort or UNASSIGNED_COHORT} ({count})" for cohort, count in cohorts}
+        options = [None] + list(labels)
+        cohort = st.selectbox(
+            "Cohort",
+            options,
+            format_func=lambda option: f"All cohorts ({sum(count for _, count in cohorts)})" if option is None else labels[option]
+        )
+
+        with st.spinner("Loading feedback..."):
+            frame = load_cohort(cohort, self.store.version(cohort))
+        if frame.empty:
+            st.info("This cohort has no graded submissions.")
+            return
+
+        self._display_overview(frame)
+        self._display_grades(frame)
+        self._display_categories(frame)
+        self._display_outliers(frame)
+
+        st.download_button(
+            label="Download cohort data (CSV)",
+            data=frame.to_csv(index=False),
+            file_name=f"cohort_{cohort or 'all'}.csv",
+            mime="text/csv"
+        )
+
+    @staticmethod
+    def _display_overview(frame):
+        """Show headline numbers for the cohort"""
+        scores = frame["score"]
+        cols = st.columns(4)
+        cols[0].metric("Submissions", f"{len(frame):,}")
+        cols[1].metric("Mean score", f"{scores.mean():.1f}")
+        cols[2].metric("Median score", f"{scores.median():.0f}")
+        cols[3].metric("Std. deviation", f"{scores.std():.1f}" if len(frame) > 1 else "–")
+
+    @staticmethod
+    def _display_grades(frame):
+        """Show the grade distribution and the overall score histogram"""
+        import plotly.graph_objects as go
+
+        grades = cohort_analytics.grade_distribution(frame)
+        histogram = cohort_analytics.score_histogram(frame)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            fig = go.Figure(go.Bar(
+                x=grades["grade"],
+                y=grades["count"],
+                text=[f"{share:.0%}" for share in grades["share"]],
+                textposition='auto',
+                marker=dict(color='rgba(32, 156, 238, 0.8)')
+            ))
+            fig.update_layout(
+                title="Grade Distribution",
+                xaxis_title="Grade",
+                yaxis_title="Submissions",
+                height=400,
+                margin=dict(l=20, r=20, t=40, b=20)
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+        with col2:
+            fig = go.Figure(go.Bar(
+                x=(histogram["bin_start"] + histogram["bin_end"]) / 2,
+                y=histogram["count"],
+                width=histogram["bin_end"] - histogram["bin_start"],
+                marker=dict(color='rgba(46, 204, 113, 0.7)', line=dict(color='#FFFFFF', width=1))
+            ))
+            fig.update_layout(
+                title="Overall Score Distribution",
+                xaxis=dict(title="Score", range=[0, 100]),
+                yaxis_title="Submissions",
+                height=400,
+                margin=dict(l=20, r=20, t=40, b=20)
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+    @staticmethod
+    def _display_categories(frame):
+        """Show per-category spread as box plots drawn from precomputed percentiles"""
+        import plotly.graph_objects as go
+
+        st.subheader("Category Scores")
+        summary = cohort_analytics.category_summary(frame)
+
+        # One trace for every category: the box statistics are computed once per column,
+        # so the chart stays the same size however many submissions the cohort has
+        fig = go.Figure(go.Box(
+            x=summary["category"],
+            q1=summary["p25"],
+            median=summary["p50"],
+            q3=summary["p75"],
+            lowerfence=summary["lower_fence"],
+            upperfence=summary["upper_fence"],
+            mean=summary["mean"],
+            marker=dict(color='rgba(32, 156, 238, 0.8)')
+        ))
+        fig.update_layout(
+            yaxis=dict(title="Score", range=[0, 100]),
+            height=400,
+            margin=dict(l=20, r=20, t=20, b=20)
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        st.dataframe(summary.round(1), hide_index=True, use_container_width=True)
+
+    @staticmethod
+    def _display_outliers(frame):
+        """List submissions whose scores are far from the cohort median"""
+        st.subheader("Outliers")
+        threshold = st.slider(
+            "Robust z-score threshold",
+            min_value=2.0,
+            max_value=6.0,
+            value=cohort_analytics.OUTLIER_THRESHOLD,
+            step=0.5,
+            help="Scores further than this many (MAD-based) deviations from the cohort median are flagged."
+        )
+        flagged = cohort_analytics.outliers(frame, threshold)
+        if flagged.empty:
+            st.success("No outliers at this threshold.")
+        else:
+            st.caption(f"{len(flagged):,} of {len(frame):,} submissions flagged.")
+            st.dataframe(flagged, hide_index=True, use_container_width=True)
+
+
+# Page entry point
+if __name__ == "__main__":
+    CohortDashboard().run()
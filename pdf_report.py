@@ -0,0 +1,205 @@
+"""PDF feedback reports built directly with reportlab.
+
+A report holds the same sections as the markdown export, plus a category
+score chart drawn as vector shapes, so no browser, image renderer or
+matplotlib figure is involved. Fonts, paragraph styles and the page template
+are loaded once per process and reused for every report. Bulk export renders
+many reports in a process pool whose workers load them on start-up.
+"""
+
+import io
+import multiprocessing
+import os
+import pathlib
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+from reportlab.graphics.shapes import Drawing, Line, Rect, String
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import ListFlowable, ListItem, Paragraph, SimpleDocTemplate, Spacer
+
+from cache import hash_bytes
+
+# Optional TrueType fonts for text outside Latin-1; the built-in Helvetica is used otherwise
+REPORT_FONT_PATH = os.getenv("REPORT_PDF_FONT", "")
+REPORT_BOLD_FONT_PATH = os.getenv("REPORT_PDF_BOLD_FONT", "")
+
+# Number of processes used by bulk export
+REPORT_EXPORT_WORKERS = int(os.getenv("REPORT_EXPORT_WORKERS", str(os.cpu_count() or 1)))
+
+# Reports handed to a worker per task in bulk export
+EXPORT_BATCH_SIZE = 16
+
+# Chart geometry, in points
+CHART_WIDTH = 170 * mm
+CHART_ROW_HEIGHT = 16
+CHART_LABEL_WIDTH = 30 * mm
+
+# Score colors, matching the performance comparison chart in the app
+LOW_SCORE_COLOR = colors.Color(1, 80 / 255, 80 / 255)
+MID_SCORE_COLOR = colors.Color(1, 200 / 255, 0)
+HIGH_SCORE_COLOR = colors.Color(46 / 255, 204 / 255, 113 / 255)
+
+UNSAFE_FILE_NAME = re.compile(r"[^\w.-]+")
+
+_templates = None
+_templates_lock = threading.Lock()
+
+
+def load_templates(font_path=REPORT_FONT_PATH, bold_font_path=REPORT_BOLD_FONT_PATH):
+    """Register fonts and build paragraph styles once per process, returning them"""
+    global _templates
+    with _templates_lock:
+        if _templates is not None:
+            return _templates
+
+        font, bold_font = "Helvetica", "Helvetica-Bold"
+        if font_path:
+            pdfmetrics.registerFont(TTFont("ReportFont", font_path))
+            font = bold_font = "ReportFont"
+        if bold_font_path:
+            pdfmetrics.registerFont(TTFont("ReportFont-Bold", bold_font_path))
+            bold_font = "ReportFont-Bold"
+
+        body = ParagraphStyle("Body", fontName=font, fontSize=10, leading=14, spaceAfter=6)
+        _templates = {
+            "font": font,
+            "bold_font": bold_font,
+            "title": ParagraphStyle("Title", parent=body, fontName=bold_font, fontSize=18, leading=22, spaceAfter=4),
+            "subtitle": ParagraphStyle("Subtitle", parent=body, fontSize=11, textColor=colors.grey, spaceAfter=10),
+            "grade": ParagraphStyle("Grade", parent=body, fontName=bold_font, fontSize=14, leading=18,
+                                    alignment=TA_CENTER, spaceBefore=4, spaceAfter=10),
+            "heading": ParagraphStyle("Heading", parent=body, fontName=bold_font, fontSize=13, leading=16,
+                                      spaceBefore=10, spaceAfter=6),
+            "body": body,
+        }
+        return _templates
+
+
+def _text(value):
+    """Escape model text for reportlab's paragraph markup, keeping line breaks"""
+    return escape(str(value)).replace("\n", "<br/>")
+
+
+def _score_color(score):
+    """Traffic-light color of a category score"""
+    if score < 60:
+        return LOW_SCORE_COLOR
+    if score < 75:
+        return MID_SCORE_COLOR
+    return HIGH_SCORE_COLOR
+
+
+def category_chart(category_scores, templates):
+    """Draw the category scores as a horizontal bar chart"""
+    rows = list(category_scores.items())
+    height = CHART_ROW_HEIGHT * len(rows) + 14
+    bar_span = CHART_WIDTH - CHART_LABEL_WIDTH - 30
+    drawing = Drawing(CHART_WIDTH, height)
+
+    for index, (category, score) in enumerate(rows):
+        y = height - (index + 1) * CHART_ROW_HEIGHT
+        width = bar_span * max(0, min(score, 100)) / 100
+        drawing.add(String(0, y + 4, str(category), fontName=templates["font"], fontSize=9))
+        drawing.add(Rect(CHART_LABEL_WIDTH, y + 1, width, CHART_ROW_HEIGHT - 4,
+                         fillColor=_score_color(score), strokeColor=None))
+        drawing.add(String(CHART_LABEL_WIDTH + width + 4, y + 4, f"{score}/100",
+                           fontName=templates["font"], fontSize=9))
+
+    # Axis with 0/50/100 ticks under the bars
+    drawing.add(Line(CHART_LABEL_WIDTH, 10, CHART_LABEL_WIDTH + bar_span, 10, strokeColor=colors.grey))
+    for tick in (0, 50, 100):
+        x = CHART_LABEL_WIDTH + bar_span * tick / 100
+        drawing.add(String(x, 0, str(tick), fontName=templates["font"], fontSize=7,
+                           fillColor=colors.grey, textAnchor="middle"))
+    return drawing
+
+
+def _bullets(items, style):
+    """Build a bulleted list of model text"""
+    return ListFlowable(
+        [ListItem(Paragraph(_text(item), style), leftIndent=12) for item in items],
+        bulletType="bullet", start="•", leftIndent=12
+    )
+
+
+def build_pdf_report(feedback_data, templates=None):
+    """Build a PDF report of feedback data and return its bytes"""
+    templates = templates or load_templates()
+    body = templates["body"]
+
+    story = [
+        Paragraph("Assignment Feedback Report", templates["subtitle"]),
+        Paragraph(_text(feedback_data["title"]), templates["title"]),
+        Paragraph(f"Grade: {_text(feedback_data['grade'])} ({_text(feedback_data['score'])}/100)", templates["grade"]),
+        Paragraph("Summary", templates["heading"]),
+        Paragraph(_text(feedback_data["summary"]), body),
+        Paragraph("Strengths", templates["heading"]),
+        _bullets(feedback_data["strengths"], body),
+        Paragraph("Areas for Improvement", templates["heading"]),
+        _bullets(feedback_data["areas_for_improvement"], body),
+        Paragraph("Category Scores", templates["heading"]),
+        category_chart(feedback_data["category_scores"], templates),
+        Spacer(1, 6),
+        Paragraph("Detailed Feedback", templates["heading"]),
+    ]
+    story.extend(Paragraph(_text(part), body) for part in str(feedback_data["detailed_feedback"]).split("\n\n"))
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer, pagesize=A4, leftMargin=20 * mm, rightMargin=20 * mm, topMargin=18 * mm, bottomMargin=18 * mm,
+        title=str(feedback_data["title"]), author="AI PDF Feedback System"
+    )
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def report_file_name(name):
+    """Build a filesystem-safe PDF file name for a report"""
+    name = str(name)
+    safe_name = UNSAFE_FILE_NAME.sub("_", name).strip("_") or "report"
+    if safe_name != name:
+        # A short hash of the original name keeps "a b" and "a_b" from sharing a file
+        safe_name += "-" + hash_bytes(name.encode("utf-8"))[:8]
+    return f"{safe_name}.pdf"
+
+
+def _write_reports(output_dir, batch):
+    """Worker task: write a batch of (name, feedback_data) reports and return their paths"""
+    templates = load_templates()
+    paths = []
+    for name, feedback_data in batch:
+        path = pathlib.Path(output_dir) / report_file_name(name)
+        path.write_bytes(build_pdf_report(feedback_data, templates))
+        paths.append(str(path))
+    return paths
+
+
+def export_pdf_reports(reports, output_dir, workers=REPORT_EXPORT_WORKERS, batch_size=EXPORT_BATCH_SIZE):
+    """Write one PDF per (name, feedback_data) pair into output_dir, in parallel; return the paths in order"""
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    reports = list(reports)
+    batches = [reports[start:start + batch_size] for start in range(0, len(reports), batch_size)]
+
+    # Small exports are not worth starting worker processes for
+    if workers <= 1 or len(batches) <= 1:
+        return [path for batch in batches for path in _write_reports(output_dir, batch)]
+
+    # Spawn rather than fork: the Streamlit server is multi-threaded. Each worker
+    # loads fonts and styles once, when it starts, instead of once per report.
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(batches)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=load_templates
+    ) as executor:
+        results = executor.map(_write_reports, [output_dir] * len(batches), batches)
+        return [path for paths in results for path in paths]
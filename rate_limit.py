@@ -0,0 +1,237 @@
+"""Client-side rate limiting and retry with backoff for Gemini calls.
+
+A token-bucket limiter sized in requests/min and tokens/min is shared by
+every GeminiProcessor, so parallel chunks and parallel batch workers run at
+the configured quota instead of stampeding into 429s. The shared limiter
+comes from the shared state backend (see shared_state.py), so the budget
+also covers other processes and replicas: by default the bucket is kept in a
+SQLite file that every process on the host updates atomically.
+Transient failures (429, 5xx, timeouts, dropped connections) are retried
+with jittered exponential backoff.
+"""
+
+import asyncio
+import logging
+import os
+import pathlib
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Quota the limiter enforces; 0 disables the corresponding bucket
+REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "1000"))
+TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000"))
+
+# SQLite file holding the bucket shared by the processes of the local backend
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", ".cache/rate_limit.sqlite3")
+
+# Retry policy for transient errors
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Base of the limiters: subclasses implement reserve()"""
+
+    def reserve(self, tokens=0):
+        """Reserve capacity for one request and return how long the caller must wait before sending it"""
+        raise NotImplementedError
+
+    def acquire(self, tokens=0):
+        """Block until a request of the given size may be sent"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=0):
+        """Wait without blocking the event loop until a request of the given size may be sent"""
+        # Shared limiters reserve through a database or Redis round trip, which may wait on a lock
+        wait = await asyncio.to_thread(self.reserve, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class TokenBucketLimiter(RateLimiter):
+    """Thread-safe limiter with one bucket for requests and one for tokens"""
+
+    # Clock the buckets refill by
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        """Initialize both buckets full"""
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = self.clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """Add capacity accrued since the last update, up to one minute's worth"""
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def reserve(self, tokens=0):
+        """Reserve capacity for one request and return how long the caller must wait before sending it"""
+        with self._lock:
+            self._refill(self.clock())
+            wait = 0.0
+
+            # Buckets may go negative: later callers queue up behind earlier reservations
+            if self.requests_per_minute:
+                self._requests -= 1
+                if self._requests < 0:
+                    wait = max(wait, -self._requests * 60 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                self._tokens -= min(tokens, self.tokens_per_minute)
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens * 60 / self.tokens_per_minute)
+            return wait
+
+
+class SQLiteTokenBucketLimiter(TokenBucketLimiter):
+    """Token buckets kept in a SQLite file, so every process using the file draws on one budget"""
+
+    # Wall-clock time, comparable between processes
+    clock = staticmethod(time.time)
+
+    def __init__(self, path=RATE_LIMIT_DB_PATH, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, name="gemini"):
+        """Initialize limiter and create the database if needed"""
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self.path = pathlib.Path(path)
+        self.name = name
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection; one per call keeps the limiter safe to share across threads"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def reserve(self, tokens=0):
+        """Reserve capacity from the shared buckets, holding the database write lock while they change"""
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return 0.0
+        with self._connect() as conn:
+            # Serializes reservations across threads and processes; the buckets are
+            # loaded, updated by the in-memory algorithm and written back under the lock
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT requests, tokens, updated_at FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is not None:
+                self._requests, self._tokens, self._updated = row
+            wait = super().reserve(tokens)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, requests, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                (self.name, self._requests, self._tokens, self._updated)
+            )
+        return wait
+
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_shared_limiter():
+    """Return the limiter shared by all Gemini callers, drawing on the budget of the shared state backend"""
+    from shared_state import get_shared_backend
+
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = get_shared_backend().limiter()
+        return _shared_limiter
+
+
+def is_retryable(error):
+    """Check whether an error is transient and worth retrying"""
+    import httpx
+    from google.genai import errors
+
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def server_retry_delay(error):
+    """Return the server-suggested retry delay in seconds from a RetryInfo detail, if any"""
+    details = getattr(error, "details", None)
+    if not isinstance(details, dict):
+        return None
+    for detail in details.get("error", {}).get("details", []) or []:
+        match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def backoff_delay(attempt, error=None):
+    """Return a full-jitter exponential backoff delay, respecting any server hint"""
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+    hint = server_retry_delay(error) if error is not None else None
+    return max(delay, hint) if hint else delay
+
+
+def call_with_retries(fn, max_retries=MAX_RETRIES, on_retry=None):
+    """Call fn(), retrying transient errors with jittered exponential backoff"""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            logger.warning("Transient Gemini error (%s); retry %d/%d in %.1fs", e, attempt + 1, max_retries, delay)
+            if on_retry:
+                on_retry(attempt + 1, e)
+            time.sleep(delay)
+            attempt += 1
+
+
+async def call_with_retries_async(fn, max_retries=MAX_RETRIES, on_retry=None):
+    """Await fn(), retrying transient errors with jittered exponential backoff"""
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            logger.warning("Transient Gemini error (%s); retry %d/%d in %.1fs", e, attempt + 1, max_retries, delay)
+            if on_retry:
+                on_retry(attempt + 1, e)
+            await asyncio.sleep(delay)
+            attempt += 1
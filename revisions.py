@@ -0,0 +1,167 @@
+"""Revision history of long submissions for comparing re-graded drafts.
+
+Every long document graded is recorded as a revision of its submitter (a
+student or session together with the assignment): the keys of its chunks
+(hashes of the chunk text, the requirements and the prompt) and the feedback
+it received. When a revised draft is graded, the earlier revision of the
+same submitter sharing the most chunks is taken to be the previous draft,
+and its feedback is compared with the new one. Drafts of other submitters
+are never matched, so no one is shown another student's feedback.
+
+The chunk summaries themselves live in the result cache under the same
+chunk keys, which is what lets a revised draft re-analyze only the chunks
+that changed.
+"""
+
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from contextlib import contextmanager
+
+REVISION_STORE_PATH = os.getenv("REVISION_STORE_PATH", ".cache/revisions.sqlite3")
+
+# Share of chunks an earlier revision must have in common to count as the previous draft
+REVISION_MIN_SHARED_FRACTION = float(os.getenv("REVISION_MIN_SHARED_FRACTION", "0.5"))
+
+# Revisions older than this are deleted
+REVISION_MAX_AGE_SECONDS = int(float(os.getenv("REVISION_MAX_AGE_DAYS", "90")) * 24 * 3600)
+
+
+class RevisionStore:
+    """SQLite-backed store of graded revisions and the chunks they consist of"""
+
+    def __init__(self, path=REVISION_STORE_PATH, max_age_seconds=REVISION_MAX_AGE_SECONDS):
+        """Initialize store and create the database if needed"""
+        self.path = pathlib.Path(path)
+        self.max_age_seconds = max_age_seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Chunk summaries were once duplicated here; the result cache holds them
+            conn.execute("DROP TABLE IF EXISTS summaries")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS revisions (
+                    id INTEGER PRIMARY KEY,
+                    submitter TEXT,
+                    chunk_count INTEGER NOT NULL,
+                    feedback TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS revision_chunks (
+                    chunk_key TEXT NOT NULL,
+                    revision_id INTEGER NOT NULL REFERENCES revisions (id) ON DELETE CASCADE,
+                    PRIMARY KEY (chunk_key, revision_id)
+                ) WITHOUT ROWID"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS revision_chunks_revision ON revision_chunks (revision_id)")
+            # Databases created before revisions were recorded per submitter; their revisions never match
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(revisions)")}
+            if "submitter" not in columns:
+                conn.execute("ALTER TABLE revisions ADD COLUMN submitter TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS revisions_submitter ON revisions (submitter)")
+
+    @contextmanager
+    def _connect(self):
+        """Open a short-lived connection; one per call keeps the store safe to share across threads"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA foreign_keys=ON")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def find_previous(self, submitter, chunk_keys):
+        """Return the submitter's earlier revision sharing the most chunks, or None if none shares enough
+
+        The result is a dict with the revision ``id``, its ``feedback`` and
+        the number of ``shared`` chunks.
+        """
+        keys = list(set(chunk_keys))
+        if not keys:
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT r.id, r.feedback, r.chunk_count, COUNT(*) AS shared "
+                "FROM revision_chunks c JOIN revisions r ON r.id = c.revision_id "
+                f"WHERE r.submitter = ? AND c.chunk_key IN ({','.join('?' * len(keys))}) "
+                "GROUP BY r.id ORDER BY shared DESC, r.created_at DESC LIMIT 1",
+                [submitter, *keys]
+            ).fetchone()
+        if row is None:
+            return None
+        revision_id, feedback, chunk_count, shared = row
+        # Relative to the larger draft, so a shared cover page does not link unrelated submissions
+        if shared < REVISION_MIN_SHARED_FRACTION * max(len(keys), chunk_count):
+            return None
+        return {"id": revision_id, "feedback": json.loads(feedback), "shared": shared}
+
+    def add(self, submitter, chunk_keys, feedback):
+        """Record a graded revision of a submitter; return its ID"""
+        now = time.time()
+        keys = list(dict.fromkeys(chunk_keys))
+        with self._connect() as conn:
+            revision_id = conn.execute(
+                "INSERT INTO revisions (submitter, chunk_count, feedback, created_at) VALUES (?, ?, ?, ?) RETURNING id",
+                (submitter, len(keys), json.dumps(feedback, ensure_ascii=False), now)
+            ).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO revision_chunks (chunk_key, revision_id) VALUES (?, ?)",
+                [(key, revision_id) for key in keys]
+            )
+        self.prune()
+        return revision_id
+
+    def prune(self):
+        """Delete revisions older than the maximum age"""
+        if not self.max_age_seconds:
+            return
+        cutoff = time.time() - self.max_age_seconds
+        with self._connect() as conn:
+            conn.execute("DELETE FROM revisions WHERE created_at < ?", (cutoff,))
+
+
+def _normalize(item):
+    """Normalize a feedback bullet for comparison"""
+    return " ".join(str(item).casefold().split()).rstrip(".")
+
+
+def _list_changes(previous, current):
+    """Return (added, removed) items between two feedback lists"""
+    previous_items = {_normalize(item) for item in previous or []}
+    current_items = {_normalize(item) for item in current or []}
+    added = [item for item in current or [] if _normalize(item) not in previous_items]
+    removed = [item for item in previous or [] if _normalize(item) not in current_items]
+    return added, removed
+
+
+def feedback_changes(previous, current):
+    """Compare the feedback of two drafts
+
+    Scores are returned as (previous, current) pairs, with None for a
+    category only one draft has; strengths and areas for improvement as the
+    items added to and dropped from each list.
+    """
+    previous_categories = previous.get("category_scores") or {}
+    current_categories = current.get("category_scores") or {}
+    strengths_added, strengths_removed = _list_changes(previous.get("strengths"), current.get("strengths"))
+    improvements_added, improvements_resolved = _list_changes(
+        previous.get("areas_for_improvement"), current.get("areas_for_improvement")
+    )
+    return {
+        "grade": (previous.get("grade"), current.get("grade")),
+        "score": (previous.get("score"), current.get("score")),
+        "category_scores": {
+            category: (previous_categories.get(category), current_categories.get(category))
+            for category in dict.fromkeys([*previous_categories, *current_categories])
+        },
+        "strengths_added": strengths_added,
+        "strengths_removed": strengths_removed,
+        "improvements_added": improvements_added,
+        "improvements_resolved": improvements_resolved,
+    }
@@ -0,0 +1,226 @@
+"""Per-stage model tiers and adaptive routing of Gemini calls.
+
+Every model call belongs to a pipeline stage: ``map`` (chunk summaries),
+``reduce`` (merged group summaries), ``final`` (graded feedback of a long
+document), ``short`` (graded feedback of a short document), ``file`` (File
+API analysis) or ``transcribe`` (scanned pages of a text-based document).
+Each stage has an ordered chain of model tiers, and a call goes to the first
+tier in the chain that can take it:
+
+- a prompt larger than a tier's token limit skips it, so big chunks go to the
+  stronger model
+- a tier already running its maximum number of requests overflows to the
+  next tier in the chain, if there is one
+- a tier that answered with quota exhaustion or timed out is cooled down,
+  and the call falls back to the next tier at once instead of backing off
+
+Every decision is logged and recorded on the current trace span, so the
+throughput and quality of each stage's tiers can be compared and tuned.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+# Model of each tier
+STANDARD_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.0-flash-lite")
+
+# Prompts above this size skip the fast tier; 0 means no limit
+FAST_MAX_PROMPT_TOKENS = int(os.getenv("GEMINI_FAST_MAX_PROMPT_TOKENS", "12000"))
+
+# Requests the fast tier runs at once before later ones overflow to the next tier; 0 means no limit
+FAST_MAX_IN_FLIGHT = int(os.getenv("GEMINI_FAST_MAX_IN_FLIGHT", "8"))
+
+# How long a tier is skipped after quota exhaustion or a timeout
+TIER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_TIER_COOLDOWN_SECONDS", "30"))
+
+# Tier chain of each stage, in order of preference
+DEFAULT_STAGE_TIERS = {
+    "map": ["fast", "standard"],
+    "reduce": ["standard", "fast"],
+    "final": ["standard", "fast"],
+    "short": ["standard", "fast"],
+    "file": ["standard", "fast"],
+    "transcribe": ["fast", "standard"],
+}
+
+# Status codes that mean a tier is out of quota or too slow to wait for
+FALLBACK_STATUS_CODES = {408, 429, 504}
+
+
+def parse_stage_tiers(spec):
+    """Parse overrides like "map=fast,standard;reduce=fast" into stage tier chains"""
+    stage_tiers = {stage: list(tiers) for stage, tiers in DEFAULT_STAGE_TIERS.items()}
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        stage, _, tiers = entry.partition("=")
+        stage_tiers[stage.strip()] = [tier.strip() for tier in tiers.split(",") if tier.strip()]
+    return stage_tiers
+
+
+STAGE_TIERS = parse_stage_tiers(os.getenv("GEMINI_STAGE_TIERS", ""))
+
+
+def should_fall_back(error):
+    """Check whether an error means another tier should be tried: quota exhaustion or a timeout"""
+    import httpx
+    from google.genai import errors
+
+    if isinstance(error, errors.APIError):
+        return error.code in FALLBACK_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, TimeoutError))
+
+
+class Tier:
+    """A model and the limits of the requests routed to it"""
+
+    def __init__(self, name, model, max_prompt_tokens=0, max_in_flight=0):
+        """Initialize tier; a limit of 0 means unlimited"""
+        self.name = name
+        self.model = model
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_in_flight = max_in_flight
+
+
+DEFAULT_TIERS = {
+    "standard": Tier("standard", STANDARD_MODEL),
+    "fast": Tier("fast", FAST_MODEL, FAST_MAX_PROMPT_TOKENS, FAST_MAX_IN_FLIGHT),
+}
+
+
+def stage_fingerprint(stage, stage_tiers=STAGE_TIERS, tiers=DEFAULT_TIERS):
+    """Return the models a stage may use, for cache keys of its results"""
+    return ",".join(tiers[tier].model for tier in stage_tiers[stage])
+
+
+def routing_fingerprint(stage_tiers=STAGE_TIERS, tiers=DEFAULT_TIERS):
+    """Return the models every stage may use, for cache keys of whole analyses"""
+    return ";".join(f"{stage}={stage_fingerprint(stage, stage_tiers, tiers)}" for stage in sorted(stage_tiers))
+
+
+class Route:
+    """The tier chosen for one model call and why"""
+
+    def __init__(self, stage, tier, reason):
+        """Initialize route"""
+        self.stage = stage
+        self.tier = tier
+        self.reason = reason
+
+    @property
+    def model(self):
+        """Model the call is sent to"""
+        return self.tier.model
+
+
+class ModelRouter:
+    """Chooses a tier for each model call and falls back across tiers; safe to share across threads"""
+
+    def __init__(self, tiers=None, stage_tiers=None, cooldown_seconds=TIER_COOLDOWN_SECONDS):
+        """Initialize router with no calls in flight"""
+        self.tiers = tiers or DEFAULT_TIERS
+        self.stage_tiers = stage_tiers or STAGE_TIERS
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._in_flight = {name: 0 for name in self.tiers}
+        self._cooling_until = {}  # tier name -> time before which it is skipped
+
+    def route(self, stage, prompt_tokens, exclude=()):
+        """Choose the tier for a call, or None if every tier of the stage is excluded"""
+        chain = [self.tiers[name] for name in self.stage_tiers[stage] if name not in exclude]
+        if not chain:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            skipped = []
+            for index, tier in enumerate(chain):
+                has_next = index < len(chain) - 1
+                if self._cooling_until.get(tier.name, 0) > now:
+                    skipped.append(f"{tier.name} cooling down")
+                elif tier.max_prompt_tokens and prompt_tokens > tier.max_prompt_tokens:
+                    skipped.append(f"{tier.name} prompt over {tier.max_prompt_tokens} tokens")
+                elif has_next and tier.max_in_flight and self._in_flight[tier.name] >= tier.max_in_flight:
+                    skipped.append(f"{tier.name} has {self._in_flight[tier.name]} calls in flight")
+                else:
+                    return Route(stage, tier, "; ".join(skipped) or "preferred")
+            # Nothing fits: cooling and size limits are preferences, so use the stage's first choice
+            return Route(stage, chain[0], "; ".join(skipped) + "; no tier fits, using first choice")
+
+    def call(self, stage, prompt_tokens, send):
+        """Call send(model) on the routed tier, falling back to the next tier on quota exhaustion or timeouts
+
+        The error of the last tier tried is raised once none is left, so the
+        caller's retry policy applies to it.
+        """
+        tried = []
+        while True:
+            route = self.route(stage, prompt_tokens, exclude=tried)
+            logger.info("Routing %s call (%d prompt tokens) to %s [%s]: %s",
+                        stage, prompt_tokens, route.tier.name, route.model, route.reason)
+            current_span().set(stage=stage, tier=route.tier.name, model=route.model, route_reason=route.reason)
+
+            with self._lock:
+                self._in_flight[route.tier.name] += 1
+            try:
+                return send(route.model)
+            except Exception as e:
+                if not should_fall_back(e):
+                    raise
+                self._cool_down(route.tier)
+                tried.append(route.tier.name)
+                if self.route(stage, prompt_tokens, exclude=tried) is None:
+                    raise
+                logger.warning("Tier %s failed for %s call (%s); falling back", route.tier.name, stage, e)
+                current_span().add("fallbacks")
+            finally:
+                with self._lock:
+                    self._in_flight[route.tier.name] -= 1
+
+    async def call_async(self, stage, prompt_tokens, send):
+        """Async variant of call; send(model) returns an awaitable"""
+        tried = []
+        while True:
+            route = self.route(stage, prompt_tokens, exclude=tried)
+            logger.info("Routing %s call (%d prompt tokens) to %s [%s]: %s",
+                        stage, prompt_tokens, route.tier.name, route.model, route.reason)
+            current_span().set(stage=stage, tier=route.tier.name, model=route.model, route_reason=route.reason)
+
+            with self._lock:
+                self._in_flight[route.tier.name] += 1
+            try:
+                return await send(route.model)
+            except Exception as e:
+                if not should_fall_back(e):
+                    raise
+                self._cool_down(route.tier)
+                tried.append(route.tier.name)
+                if self.route(stage, prompt_tokens, exclude=tried) is None:
+                    raise
+                logger.warning("Tier %s failed for %s call (%s); falling back", route.tier.name, stage, e)
+                current_span().add("fallbacks")
+            finally:
+                with self._lock:
+                    self._in_flight[route.tier.name] -= 1
+
+    def _cool_down(self, tier):
+        """Skip a tier for the cooldown period"""
+        with self._lock:
+            self._cooling_until[tier.name] = time.monotonic() + self.cooldown_seconds
+
+
+_shared_router = None
+_shared_router_lock = threading.Lock()
+
+
+def get_shared_router():
+    """Return the process-wide router, so in-flight counts and cooldowns cover every caller"""
+    global _shared_router
+    with _shared_router_lock:
+        if _shared_router is None:
+            _shared_router = ModelRouter()
+        return _shared_router
@@ -0,0 +1,511 @@
+"""Pluggable shared state for running the app as several processes or replicas.
+
+Everything that must be shared between replicas behind a load balancer is
+created through a shared state backend:
+
+- ``result_cache()``: the extraction and analysis cache (``get``, ``set``,
+  ``get_json`` and ``set_json`` as in cache.ResultCache)
+- ``job_store()``: the records of background jobs, so a reconnect routed to
+  any replica finds the job by the ID in its URL, and the workers of every
+  replica drain one queue (see jobs.SQLiteJobStore for the interface)
+- ``limiter()``: the Gemini rate-limit budget, so N replicas together stay
+  within the configured quota instead of each using all of it
+
+Backends are registered by name and selected with ``SHARED_BACKEND``:
+
+- ``local`` (default) keeps everything in SQLite files under ``.cache``,
+  which every process on the host, or on hosts mounting the same volume,
+  shares
+- ``redis`` keeps everything in Redis at ``REDIS_URL``; it uses only basic
+  string, hash, list and sorted-set commands, so any Redis-compatible server
+  works
+- ``memory`` runs the Redis backend against an in-process stub of those
+  commands, to exercise it without a server
+"""
+
+import json
+import os
+import threading
+import time
+
+from cache import CACHE_MAX_AGE_SECONDS, ResultCache
+from jobs import ACTIVE_STATUSES, JOB_RETENTION_SECONDS, SQLiteJobStore
+from rate_limit import REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, RateLimiter, SQLiteTokenBucketLimiter
+
+# Name of the shared state backend
+SHARED_BACKEND = os.getenv("SHARED_BACKEND", "local")
+
+# Redis connection and the prefix of every key the app writes
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SHARED_KEY_PREFIX = os.getenv("SHARED_KEY_PREFIX", "feedback:")
+
+# Length of the windows the Redis rate limiter counts requests and tokens in
+RATE_WINDOW_SECONDS = 10
+
+# Job fields stored as numbers
+_INT_FIELDS = ("progress_done", "progress_total")
+_FLOAT_FIELDS = ("lease_until", "created_at", "updated_at")
+_JOB_FIELDS = ("id", "kind", "dedupe_key", "status", "payload", "progress_done", "progress_total",
+               "partial", "result", "usage", "error", "lease_until", "lease_owner", "replica", "created_at", "updated_at")
+
+
+class LocalBackend:
+    """Shared state in SQLite files on the local filesystem"""
+
+    def result_cache(self):
+        """Return the extraction and analysis cache"""
+        return ResultCache()
+
+    def job_store(self):
+        """Return the job store"""
+        return SQLiteJobStore()
+
+    def limiter(self):
+        """Return the rate limiter drawing on the shared budget"""
+        return SQLiteTokenBucketLimiter()
+
+
+class RedisResultCache:
+    """Result cache in Redis; entries expire after the maximum age and Redis evicts under memory pressure"""
+
+    def __init__(self, client, prefix=SHARED_KEY_PREFIX, max_age_seconds=CACHE_MAX_AGE_SECONDS):
+        """Initialize cache"""
+        self.client = client
+        self.prefix = f"{prefix}cache:"
+        self.max_age_seconds = max_age_seconds
+
+    def get(self, key):
+        """Return the cached string for a key, or None on a miss"""
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, kind="text"):
+        """Store a string under a key"""
+        self.client.set(self.prefix + key, value, ex=self.max_age_seconds or None)
+
+    def get_json(self, key):
+        """Return a cached JSON value, or None on a miss"""
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key, value, kind="json"):
+        """Store a JSON-serializable value"""
+        self.set(key, json.dumps(value, ensure_ascii=False), kind=kind)
+
+
+class RedisJobStore:
+    """Job records in Redis
+
+    Each job is a hash. Queued IDs wait in a list and are moved atomically
+    (LMOVE) to a processing list when claimed; running jobs' leases are kept
+    in a sorted set by expiry time. Jobs pinned to a replica have their own
+    queue, processing list and leases, which only that replica claims from.
+    """
+
+    def __init__(self, client, prefix=SHARED_KEY_PREFIX):
+        """Initialize store"""
+        self.client = client
+        self.prefix = f"{prefix}jobs:"
+
+    def _job_key(self, job_id):
+        """Return the key of a job's hash"""
+        return f"{self.prefix}job:{job_id}"
+
+    def _queue_keys(self, replica=None):
+        """Return the queued list, processing list and leases keys of the shared queue or a replica's own"""
+        base = f"{self.prefix}replica:{replica}:" if replica else self.prefix
+        return f"{base}queued", f"{base}processing", f"{base}leases"
+
+    def find_active(self, dedupe_key):
+        """Return the ID of the newest job with this dedupe key that is still worth attaching to"""
+        job_id = self.client.get(f"{self.prefix}dedupe:{dedupe_key}")
+        if job_id is None:
+            return None
+        status = (self.client.hgetall(self._job_key(job_id)) or {}).get("status")
+        return job_id if status in ACTIVE_STATUSES else None
+
+    def insert(self, job_id, kind, dedupe_key, payload, now, replica=None):
+        """Add a queued job with a JSON-encoded payload, optionally pinned to a replica"""
+        fields = {"id": job_id, "kind": kind, "status": "queued", "payload": payload,
+                  "progress_done": 0, "progress_total": 0, "created_at": now, "updated_at": now}
+        if dedupe_key:
+            fields["dedupe_key"] = dedupe_key
+        if replica:
+            fields["replica"] = replica
+        self.client.hset(self._job_key(job_id), mapping=fields)
+        if dedupe_key:
+            self.client.set(f"{self.prefix}dedupe:{dedupe_key}", job_id, ex=JOB_RETENTION_SECONDS)
+        self.client.rpush(self._queue_keys(replica)[0], job_id)
+
+    def get(self, job_id):
+        """Return a job's fields, with JSON fields still encoded, or None if unknown"""
+        stored = self.client.hgetall(self._job_key(job_id))
+        if not stored:
+            return None
+        job = {field: stored.get(field) for field in _JOB_FIELDS}
+        for field in _INT_FIELDS:
+            job[field] = int(job[field] or 0)
+        for field in _FLOAT_FIELDS:
+            job[field] = float(job[field]) if job[field] is not None else None
+        return job
+
+    def claim(self, now, lease_seconds, owner, replica=None):
+        """Take a running job whose lease expired, or else the oldest queued job, under an owner token
+
+        Jobs pinned to this replica are tried before the shared queue. Both
+        paths hand a job to exactly one worker: only the worker whose ZREM
+        removes an expired lease reclaims that job, and LMOVE takes a queued
+        job into the processing list in one step, so no job is lost between
+        the queue and its lease.
+        """
+        for queue_replica in ([replica] if replica else []) + [None]:
+            claimed = self._claim_from(queue_replica, now, lease_seconds, owner)
+            if claimed:
+                return claimed
+        return None
+
+    def _claim_from(self, replica, now, lease_seconds, owner):
+        """Claim from the shared queue or one replica's own"""
+        queued_key, processing_key, leases_key = self._queue_keys(replica)
+        self._lease_orphans(processing_key, leases_key, now, lease_seconds)
+        for job_id in self.client.zrangebyscore(leases_key, "-inf", now, start=0, num=1):
+            if self.client.zrem(leases_key, job_id):
+                claimed = self._start(job_id, replica, now, lease_seconds, owner)
+                if claimed:
+                    return claimed
+        while True:
+            job_id = self.client.lmove(queued_key, processing_key, "LEFT", "RIGHT")
+            if job_id is None:
+                return None
+            claimed = self._start(job_id, replica, now, lease_seconds, owner)
+            if claimed:
+                return claimed
+
+    def _lease_orphans(self, processing_key, leases_key, now, lease_seconds):
+        """Give a lease to processing jobs that have none because their worker died right after LMOVE
+
+        NX leaves a lease the claiming worker sets first in place; otherwise the
+        job is reclaimed once this lease expires.
+        """
+        for job_id in self.client.lrange(processing_key, 0, -1):
+            if self.client.zscore(leases_key, job_id) is None:
+                self.client.zadd(leases_key, {job_id: now + lease_seconds}, nx=True)
+
+    def _start(self, job_id, replica, now, lease_seconds, owner):
+        """Mark a claimed job running under a new lease; None if its record has expired"""
+        job = self.client.hgetall(self._job_key(job_id))
+        if not job:
+            self._finish(job_id, replica)
+            return None
+        self.update(job_id, {"status": "running", "lease_until": now + lease_seconds, "lease_owner": owner,
+                             "updated_at": now})
+        return job_id, job["kind"], job["payload"]
+
+    def _finish(self, job_id, replica=None):
+        """Drop a job from its queue's processing list and leases"""
+        _, processing_key, leases_key = self._queue_keys(replica)
+        self.client.lrem(processing_key, 0, job_id)
+        self.client.zrem(leases_key, job_id)
+
+    def update(self, job_id, fields, owner=None):
+        """Set job fields; with an owner, only while that claim still holds the lease. Return whether they were set
+
+        Finished jobs expire after the retention period.
+        """
+        key = self._job_key(job_id)
+        # The heartbeat keeps a live claim's lease from expiring, so the owner cannot change between check and write
+        if owner is not None and self.client.hget(key, "lease_owner") != owner:
+            return False
+        values = {field: value for field, value in fields.items() if value is not None}
+        if values:
+            self.client.hset(key, mapping=values)
+        cleared = [field for field, value in fields.items() if value is None]
+        if cleared:
+            self.client.hdel(key, *cleared)
+
+        if fields.get("status") in ("done", "failed"):
+            self._finish(job_id, self.client.hget(key, "replica"))
+            self.client.expire(key, JOB_RETENTION_SECONDS)
+        elif fields.get("lease_until") is not None:
+            leases_key = self._queue_keys(self.client.hget(key, "replica"))[2]
+            self.client.zadd(leases_key, {job_id: fields["lease_until"]})
+        return True
+
+
+class RedisRateLimiter(RateLimiter):
+    """Rate limiter counting requests and tokens per fixed window in Redis, shared by every replica
+
+    A request takes the earliest window, starting with the current one, that
+    still has room for it, and waits until that window starts. Each window
+    holds its share of the per-minute budget.
+    """
+
+    def __init__(self, client, prefix=SHARED_KEY_PREFIX, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, window_seconds=RATE_WINDOW_SECONDS):
+        """Initialize limiter; windows are widened so each one admits at least one request"""
+        self.client = client
+        self.prefix = f"{prefix}rate:"
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        if requests_per_minute:
+            window_seconds = max(window_seconds, 60 / requests_per_minute)
+        self.window_seconds = window_seconds
+        self.request_budget = requests_per_minute * window_seconds / 60
+        self.token_budget = tokens_per_minute * window_seconds / 60
+
+    def _take(self, key, amount, budget, expires_in):
+        """Count amount against a window's budget; return whether it fits, undoing the count if not"""
+        used = self.client.incrby(key, amount)
+        self.client.expire(key, expires_in)
+        if used <= budget:
+            return True
+        self.client.incrby(key, -amount)
+        return False
+
+    def reserve(self, tokens=0):
+        """Reserve room in the earliest window that has it and return how long to wait for that window"""
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return 0.0
+        # A request larger than a window's token budget takes a whole window
+        cost = int(min(tokens, self.token_budget)) if self.tokens_per_minute else 0
+        now = time.time()
+        window = int(now // self.window_seconds)
+        while True:
+            starts_at = window * self.window_seconds
+            expires_in = int(starts_at + self.window_seconds - now) + 1
+            request_key = f"{self.prefix}{window}:requests"
+            token_key = f"{self.prefix}{window}:tokens"
+
+            if not self.requests_per_minute or self._take(request_key, 1, self.request_budget, expires_in):
+                if not self.tokens_per_minute or self._take(token_key, cost, self.token_budget, expires_in):
+                    return max(0.0, starts_at - now)
+                if self.requests_per_minute:
+                    self.client.incrby(request_key, -1)
+            window += 1
+
+
+class RedisBackend:
+    """Shared state in a Redis-compatible server"""
+
+    def __init__(self, client, prefix=SHARED_KEY_PREFIX):
+        """Initialize backend with a client whose responses are decoded to str"""
+        self.client = client
+        self.prefix = prefix
+
+    def result_cache(self):
+        """Return the extraction and analysis cache"""
+        return RedisResultCache(self.client, self.prefix)
+
+    def job_store(self):
+        """Return the job store"""
+        return RedisJobStore(self.client, self.prefix)
+
+    def limiter(self):
+        """Return the rate limiter drawing on the shared budget"""
+        return RedisRateLimiter(self.client, self.prefix)
+
+
+class MemoryRedis:
+    """Thread-safe in-process stand-in for the Redis commands the Redis backend uses"""
+
+    def __init__(self):
+        """Initialize an empty keyspace"""
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    def _live(self, name):
+        """Drop a key if it has expired; called with the lock held"""
+        if name in self._expires and self._expires[name] <= time.time():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return self._data.get(name)
+
+    def get(self, name):
+        """Return a string value, or None"""
+        with self._lock:
+            return self._live(name)
+
+    def set(self, name, value, ex=None, nx=False):
+        """Set a string value; with nx, only if the key does not exist"""
+        with self._lock:
+            if nx and self._live(name) is not None:
+                return None
+            self._data[name] = str(value)
+            self._expires.pop(name, None)
+            if ex:
+                self._expires[name] = time.time() + ex
+            return True
+
+    def delete(self, *names):
+        """Delete keys and return how many existed"""
+        with self._lock:
+            deleted = 0
+            for name in names:
+                deleted += self._live(name) is not None
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+            return deleted
+
+    def expire(self, name, time_seconds):
+        """Set a key's time to live"""
+        with self._lock:
+            if self._live(name) is None:
+                return False
+            self._expires[name] = time.time() + time_seconds
+            return True
+
+    def incrby(self, name, amount=1):
+        """Add to an integer value and return the result"""
+        with self._lock:
+            value = int(self._live(name) or 0) + amount
+            self._data[name] = str(value)
+            return value
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        """Set hash fields and return how many were new"""
+        with self._lock:
+            fields = dict(mapping or {})
+            if key is not None:
+                fields[key] = value
+            stored = self._live(name)
+            if stored is None:
+                stored = self._data[name] = {}
+            added = sum(field not in stored for field in fields)
+            stored.update({field: str(value) for field, value in fields.items()})
+            return added
+
+    def hget(self, name, key):
+        """Return one field of a hash, or None"""
+        with self._lock:
+            return (self._live(name) or {}).get(key)
+
+    def hgetall(self, name):
+        """Return all fields of a hash"""
+        with self._lock:
+            return dict(self._live(name) or {})
+
+    def hdel(self, name, *keys):
+        """Delete hash fields and return how many existed"""
+        with self._lock:
+            stored = self._live(name) or {}
+            return sum(stored.pop(key, None) is not None for key in keys)
+
+    def rpush(self, name, *values):
+        """Append to a list and return its length"""
+        with self._lock:
+            stored = self._live(name)
+            if stored is None:
+                stored = self._data[name] = []
+            stored.extend(str(value) for value in values)
+            return len(stored)
+
+    def lpop(self, name):
+        """Remove and return the first element of a list, or None"""
+        with self._lock:
+            stored = self._live(name)
+            return stored.pop(0) if stored else None
+
+    def lmove(self, first_list, second_list, src="LEFT", dest="RIGHT"):
+        """Atomically pop an element from one end of a list and push it onto an end of another"""
+        with self._lock:
+            source = self._live(first_list)
+            if not source:
+                return None
+            value = source.pop(0 if src == "LEFT" else -1)
+            target = self._live(second_list)
+            if target is None:
+                target = self._data[second_list] = []
+            target.insert(0 if dest == "LEFT" else len(target), value)
+            return value
+
+    def lrange(self, name, start, end):
+        """Return list elements from start to end inclusive; negative indexes count from the end"""
+        with self._lock:
+            stored = self._live(name) or []
+            return list(stored[start:None if end == -1 else end + 1])
+
+    def lrem(self, name, count, value):
+        """Remove occurrences of a value from a list (all of them when count is 0); return how many"""
+        with self._lock:
+            stored = self._live(name) or []
+            removed = 0
+            for index in [i for i, item in enumerate(stored) if item == str(value)][:count or None]:
+                del stored[index - removed]
+                removed += 1
+            return removed
+
+    def zadd(self, name, mapping, nx=False):
+        """Set sorted-set scores and return how many members were new; with nx, only add new members"""
+        with self._lock:
+            stored = self._live(name)
+            if stored is None:
+                stored = self._data[name] = {}
+            added = sum(str(member) not in stored for member in mapping)
+            stored.update({str(member): float(score) for member, score in mapping.items()
+                           if not (nx and str(member) in stored)})
+            return added
+
+    def zscore(self, name, value):
+        """Return a member's score, or None"""
+        with self._lock:
+            return (self._live(name) or {}).get(str(value))
+
+    def zrem(self, name, *values):
+        """Remove sorted-set members and return how many existed"""
+        with self._lock:
+            stored = self._live(name) or {}
+            return sum(stored.pop(str(value), None) is not None for value in values)
+
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        """Return members with scores between min and max, lowest first"""
+        with self._lock:
+            low, high = float(min), float(max)
+            members = sorted((score, member) for member, score in (self._live(name) or {}).items()
+                             if low <= score <= high)
+            members = [member for _, member in members]
+            if start is not None and num is not None:
+                members = members[start:start + num]
+            return members
+
+
+_shared_backends = {}
+
+
+def register_shared_backend(name, factory):
+    """Register a shared state backend factory; it is called without arguments"""
+    _shared_backends[name] = factory
+
+
+def create_shared_backend(backend=None):
+    """Create the named shared state backend, or the one selected by SHARED_BACKEND"""
+    name = backend or SHARED_BACKEND
+    if name not in _shared_backends:
+        raise ValueError(f"Unknown shared backend {name!r}; choose one of {', '.join(sorted(_shared_backends))}")
+    return _shared_backends[name]()
+
+
+def _create_redis_backend():
+    """Connect to the Redis server at REDIS_URL"""
+    try:
+        import redis
+    except ImportError as e:
+        raise RuntimeError("SHARED_BACKEND=redis requires the redis package (pip install redis)") from e
+    return RedisBackend(redis.Redis.from_url(REDIS_URL, decode_responses=True))
+
+
+register_shared_backend("local", LocalBackend)
+register_shared_backend("redis", _create_redis_backend)
+register_shared_backend("memory", lambda: RedisBackend(MemoryRedis()))
+
+
+_shared_backend = None
+_shared_backend_lock = threading.Lock()
+
+
+def get_shared_backend():
+    """Return the process-wide shared state backend"""
+    global _shared_backend
+    with _shared_backend_lock:
+        if _shared_backend is None:
+            _shared_backend = create_shared_backend()
+        return _shared_backend
@@ -0,0 +1,114 @@
+"""Speculative chunk analysis that starts before the requirements are known.
+
+As soon as a long document's text is extracted, its chunks are mapped in the
+background with the requirement-independent chunk prompt while the user is
+still choosing requirements. When the analysis starts, it claims the run and
+waits on the chunk futures instead of calling the model again, so the map
+overlaps with the user's think time. When the chosen requirements change the
+chunk prompts, the run is cancelled: chunks not yet started are dropped and
+summaries already finished stay in the result cache.
+
+Runs are kept per owner (a browser session), and one that is never claimed
+is cancelled after a TTL. Speculation is opt-in and only runs together with
+the requirement-neutral map.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Off by default: speculation also needs the requirement-neutral map (GEMINI_REQUIREMENT_NEUTRAL_MAP)
+SPECULATIVE_ANALYSIS_ENABLED = os.getenv("ANALYSIS_SPECULATIVE", "0") == "1"
+
+# Unclaimed runs older than this are cancelled
+SPECULATION_TTL_SECONDS = float(os.getenv("ANALYSIS_SPECULATION_TTL_SECONDS", "900"))
+
+
+class SpeculativeRun:
+    """Background map of one document's chunks"""
+
+    def __init__(self, document_key, futures):
+        """Initialize run from its per-chunk futures"""
+        self.document_key = document_key
+        self.futures = futures
+        self.started_at = time.time()
+
+    def progress(self):
+        """Return (chunks done, total chunks)"""
+        return sum(future.done() for future in self.futures), len(self.futures)
+
+    def cancel(self):
+        """Cancel chunks that have not started; running ones finish and are cached"""
+        for future in self.futures:
+            future.cancel()
+
+
+class SpeculationRegistry:
+    """Process-wide speculative runs, at most one per owner"""
+
+    def __init__(self, ttl_seconds=SPECULATION_TTL_SECONDS):
+        """Initialize an empty registry"""
+        self.ttl_seconds = ttl_seconds
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def start(self, owner, document_key, chunks, analyze, max_workers):
+        """Start mapping chunks for an owner, replacing any run of a different document
+
+        analyze(chunk) is called for every chunk on a dedicated pool. Starting
+        the same document again returns the existing run.
+        """
+        with self._lock:
+            self._expire()
+            run = self._runs.get(owner)
+            if run is not None and run.document_key == document_key:
+                return run
+            if run is not None:
+                run.cancel()
+
+            executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks))),
+                                          thread_name_prefix="speculative-map")
+            # Each task runs in a copy of the caller's context so its spans join the caller's trace
+            futures = [executor.submit(contextvars.copy_context().run, analyze, chunk) for chunk in chunks]
+            # Queued chunks keep running after this returns; the threads exit when the queue is empty
+            executor.shutdown(wait=False)
+
+            run = SpeculativeRun(document_key, futures)
+            self._runs[owner] = run
+            return run
+
+    def get(self, owner):
+        """Return an owner's current run, if any"""
+        with self._lock:
+            return self._runs.get(owner)
+
+    def claim(self, owner, document_key):
+        """Take an owner's run for use by the real analysis
+
+        Returns the run if it maps this document with the same prompts;
+        otherwise the run is cancelled and None is returned.
+        """
+        with self._lock:
+            self._expire()
+            run = self._runs.pop(owner, None)
+        if run is None:
+            return None
+        if run.document_key != document_key:
+            run.cancel()
+            return None
+        return run
+
+    def cancel(self, owner):
+        """Cancel and forget an owner's run"""
+        with self._lock:
+            run = self._runs.pop(owner, None)
+        if run is not None:
+            run.cancel()
+
+    def _expire(self):
+        """Cancel runs nobody claimed within the TTL; called with the lock held"""
+        now = time.time()
+        for owner in [owner for owner, run in self._runs.items() if now - run.started_at > self.ttl_seconds]:
+            self._runs.pop(owner).cancel()
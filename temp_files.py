@@ -0,0 +1,202 @@
+"""Lifecycle of uploaded PDFs on local disk.
+
+Uploads are streamed to a content-addressed file in a dedicated directory in
+fixed-size blocks, so a large scanned PDF is never copied into a second
+in-memory buffer, and a file already on disk is not written again: a rerun,
+or another session uploading the same document, reuses it. The pipeline
+works on the path from then on.
+
+Each file records the sessions using it. A background sweep deletes files
+that no live session has used for a short grace period (the session expired
+or was abandoned) and any file left idle longer than the TTL, including
+files left behind by an earlier server process.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_TEMP_DIR = os.getenv("UPLOAD_TEMP_DIR", os.path.join(tempfile.gettempdir(), "ai-feedback-uploads"))
+
+# Files unused for this long are deleted even if their session is still open
+UPLOAD_TEMP_TTL_SECONDS = float(os.getenv("UPLOAD_TEMP_TTL_SECONDS", str(6 * 3600)))
+
+# Files whose sessions have all ended are deleted after this grace period, which
+# leaves time for a background job still reading the file to finish
+UPLOAD_TEMP_ORPHAN_SECONDS = float(os.getenv("UPLOAD_TEMP_ORPHAN_SECONDS", "600"))
+
+UPLOAD_TEMP_SWEEP_INTERVAL_SECONDS = 60
+
+# Size of the blocks uploads are hashed and written in
+COPY_BLOCK_SIZE = 1024 * 1024
+
+PARTIAL_SUFFIX = ".part"
+
+
+def iter_blocks(upload, block_size=COPY_BLOCK_SIZE):
+    """Yield the contents of a file-like upload in blocks, without copying in-memory uploads"""
+    if hasattr(upload, "getbuffer"):
+        # Streamlit uploads are BytesIO objects: slice their buffer instead of reading copies
+        with upload.getbuffer() as view:
+            for start in range(0, len(view), block_size):
+                yield view[start:start + block_size]
+        return
+    upload.seek(0)
+    for block in iter(lambda: upload.read(block_size), b""):
+        yield block
+
+
+class TempFileManager:
+    """Content-addressed temporary files for uploads, with session ownership and TTL cleanup"""
+
+    def __init__(self, directory=UPLOAD_TEMP_DIR, ttl_seconds=UPLOAD_TEMP_TTL_SECONDS,
+                 orphan_seconds=UPLOAD_TEMP_ORPHAN_SECONDS):
+        """Initialize manager and create the upload directory if needed"""
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.orphan_seconds = orphan_seconds
+        self._lock = threading.Lock()
+        self._entries = {}  # path -> {"owners": set of owner IDs, "used_at": last use}
+        self._uploads = {}  # upload ID -> (path, content hash)
+        self._cleanup_thread = None
+
+    def save_upload(self, upload, owner, suffix=".pdf"):
+        """Store a file-like upload once and return (path, content_hash)
+
+        Uploads with a ``file_id`` (Streamlit's UploadedFile) that were already
+        stored are recognised without being hashed again.
+        """
+        upload_id = getattr(upload, "file_id", None)
+        with self._lock:
+            known = self._uploads.get(upload_id) if upload_id else None
+        if known and os.path.exists(known[0]):
+            self.touch(known[0], owner)
+            return known
+
+        digest = hashlib.sha256()
+        for block in iter_blocks(upload):
+            digest.update(block)
+        content_hash = digest.hexdigest()
+        path = str(self.directory / f"{content_hash}{suffix}")
+
+        if not os.path.exists(path):
+            fd, partial_path = tempfile.mkstemp(dir=self.directory, suffix=PARTIAL_SUFFIX)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for block in iter_blocks(upload):
+                        f.write(block)
+                # Atomic, so concurrent sessions never see a half-written file
+                os.replace(partial_path, path)
+            except BaseException:
+                os.unlink(partial_path)
+                raise
+
+        with self._lock:
+            if upload_id:
+                self._uploads[upload_id] = (path, content_hash)
+        self.touch(path, owner)
+        return path, content_hash
+
+    def touch(self, path, owner=None):
+        """Mark a file as in use, optionally by another owner"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.setdefault(path, {"owners": set(), "used_at": now})
+            entry["used_at"] = now
+            if owner is not None:
+                entry["owners"].add(owner)
+        try:
+            # The modification time lets a later process tell idle files apart
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+
+    def release(self, owner):
+        """Drop an owner from its files, deleting those no one else is using
+
+        Files this owner was not using are left alone, even if they have no
+        owners left: they may be waiting out the orphan grace period, which
+        sweep enforces.
+        """
+        with self._lock:
+            unused = []
+            for path, entry in self._entries.items():
+                if owner not in entry["owners"]:
+                    continue
+                entry["owners"].discard(owner)
+                if not entry["owners"]:
+                    unused.append(path)
+        for path in unused:
+            self._delete(path)
+        return len(unused)
+
+    def _delete(self, path):
+        """Remove a file and forget it"""
+        with self._lock:
+            self._entries.pop(path, None)
+            for upload_id in [upload_id for upload_id, known in self._uploads.items() if known[0] == path]:
+                del self._uploads[upload_id]
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, is_active=None):
+        """Delete expired and orphaned files; return how many were removed
+
+        is_active(owner) tells whether an owner, such as a session, is still
+        alive; without it every owner is assumed to be.
+        """
+        now = time.time()
+        expired = []
+        with self._lock:
+            for path, entry in self._entries.items():
+                if is_active is not None:
+                    entry["owners"] = {owner for owner in entry["owners"] if is_active(owner)}
+                idle = now - entry["used_at"]
+                if idle > self.ttl_seconds or (not entry["owners"] and idle > self.orphan_seconds):
+                    expired.append(path)
+            known = set(self._entries)
+        for path in expired:
+            self._delete(path)
+
+        # Files this process does not know about were left by an earlier one
+        removed = len(expired)
+        for path in self.directory.iterdir():
+            if str(path) in known:
+                continue
+            try:
+                idle = now - path.stat().st_mtime
+                limit = self.orphan_seconds if path.suffix == PARTIAL_SUFFIX else self.ttl_seconds
+                if idle > limit:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def start_cleanup(self, is_active=None, interval=UPLOAD_TEMP_SWEEP_INTERVAL_SECONDS):
+        """Run sweep periodically on a daemon thread"""
+        if self._cleanup_thread is not None:
+            return self
+
+        def loop():
+            while True:
+                try:
+                    removed = self.sweep(is_active)
+                    if removed:
+                        logger.info("Removed %d expired upload files", removed)
+                except Exception as e:
+                    logger.warning("Upload file cleanup failed: %s", e)
+                time.sleep(interval)
+
+        self._cleanup_thread = threading.Thread(target=loop, name="upload-file-cleanup", daemon=True)
+        self._cleanup_thread.start()
+        return self
@@ -0,0 +1,183 @@
+"""Lightweight per-stage timing and token instrumentation.
+
+Code marks its stages with ``span(name, **attributes)``. Spans are recorded
+by the tracer made current with ``use(tracer)`` and are a no-op otherwise,
+so headless callers pay nothing unless they opt in. Each span records wall
+time and any attributes set on it (input/output tokens, retries, chunk
+index...). Finished spans are kept as OpenTelemetry-style dicts and can be
+summarized per stage or appended to a JSONL file.
+
+The current tracer lives in a context variable: asyncio tasks inherit it,
+and thread pool work inherits it when submitted through ``contextvars``'
+``copy_context().run``.
+"""
+
+import json
+import os
+import pathlib
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", ".cache/traces.jsonl")
+
+_current_tracer = ContextVar("tracer", default=None)
+_current_span = ContextVar("span", default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+    """A timed stage with attributes"""
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        """Initialize and start the span"""
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.seconds = None
+
+    def set(self, **attributes):
+        """Set attributes on the span"""
+        self.attributes.update(attributes)
+
+    def add(self, key, amount=1):
+        """Add to a numeric attribute, such as a retry or token count"""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def finish(self):
+        """Stop the span's clock"""
+        self.seconds = time.perf_counter() - self._started
+
+    def to_dict(self):
+        """Return the span in OpenTelemetry-style JSON form"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.start_ns + int(self.seconds * 1e9),
+            "duration_seconds": round(self.seconds, 6),
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+
+class _NullSpan:
+    """Span stand-in used when no tracer is active"""
+
+    def set(self, **attributes):
+        """Ignore attributes"""
+
+    def add(self, key, amount=1):
+        """Ignore counts"""
+
+
+class Tracer:
+    """Collects finished spans for one trace, such as one analysis"""
+
+    def __init__(self, **resource):
+        """Initialize an empty trace; resource attributes are attached to every exported span"""
+        self.trace_id = secrets.token_hex(16)
+        self.resource = resource
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Record a span around the enclosed block"""
+        parent = _current_span.get()
+        span = Span(name, self.trace_id, parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "ERROR"
+            span.set(error=str(e) or type(e).__name__)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+            with self._lock:
+                self.spans.append(span.to_dict())
+
+    def extend(self, spans):
+        """Add spans recorded elsewhere, such as by a background job, to this trace"""
+        with self._lock:
+            for span in spans:
+                self.spans.append(dict(span, trace_id=self.trace_id))
+
+    def summary(self):
+        """Aggregate spans per stage name: count, wall time, tokens and retries"""
+        stages = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            attributes = span["attributes"]
+            stage = stages.setdefault(span["name"], {
+                "stage": span["name"], "count": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+                "input_tokens": 0, "output_tokens": 0, "retries": 0, "errors": 0
+            })
+            stage["count"] += 1
+            stage["total_seconds"] += span["duration_seconds"]
+            stage["max_seconds"] = max(stage["max_seconds"], span["duration_seconds"])
+            stage["input_tokens"] += attributes.get("input_tokens", 0)
+            stage["output_tokens"] += attributes.get("output_tokens", 0)
+            stage["retries"] += attributes.get("retries", 0)
+            stage["errors"] += span["status"] == "ERROR"
+
+        rows = sorted(stages.values(), key=lambda row: row["total_seconds"], reverse=True)
+        for row in rows:
+            row["mean_seconds"] = round(row["total_seconds"] / row["count"], 4)
+            row["total_seconds"] = round(row["total_seconds"], 4)
+            row["max_seconds"] = round(row["max_seconds"], 4)
+        return rows
+
+    def to_jsonl(self):
+        """Return the trace as JSON lines, one span per line"""
+        with self._lock:
+            spans = list(self.spans)
+        return "".join(json.dumps(dict(span, resource=self.resource), ensure_ascii=False) + "\n" for span in spans)
+
+    def export(self, path=TRACE_EXPORT_PATH):
+        """Append the trace's spans to a JSONL file"""
+        if not path:
+            return
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = self.to_jsonl()
+        with _export_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+@contextmanager
+def use(tracer):
+    """Make a tracer current for the enclosed block"""
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record a span with the current tracer, or do nothing if there is none"""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield _NullSpan()
+        return
+    with tracer.span(name, **attributes) as active:
+        yield active
+
+
+def current_span():
+    """Return the innermost active span, or a no-op span if none is active"""
+    return _current_span.get() or _NullSpan()